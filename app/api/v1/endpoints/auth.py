@@ -32,6 +32,7 @@ from app.crud import user as crud_user
 # Import security utilities
 from app.core.security import verify_password, get_password_hash, create_access_token
 from app.core.config import settings
+from app.api.v1.endpoints.map_data import warm_map_view
 
 router = APIRouter()
 
@@ -114,6 +115,11 @@ async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db))
     access_token = create_access_token(
         data={"sub": db_user.email}, expires_delta=access_token_expires
     )
+
+    # Start loading the tiles of the user's saved map view before the dashboard asks for them
+    if settings.TILE_WARM_ON_LOGIN:
+        warm_map_view(db_user.map_latitude, db_user.map_longitude, db_user.map_zoom_level)
+
     return {"access_token": access_token, "token_type": "bearer"}
 
 
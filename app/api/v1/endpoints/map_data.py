@@ -1,21 +1,48 @@
 # app/api/v1/endpoints/map_data.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Header
 from pydantic import BaseModel
-from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional, Tuple
 
 # Assuming db_operations is in app/db_operations.py
 import app.db_operations as db_ops
+import app.tile_operations as tile_ops
 
 # Import the get_current_user dependency and UserInDB schema
 from app.api.v1.endpoints.users import get_current_user
 from app.schemas.user import UserInDB
+from app.database.database import get_db
+from app.core.config import settings
+from app.utils.tile_encoding import accepts_encoding, detect_encoding, negotiate_tile_body
+from app.utils.tile_upstream import open_upstream_tile, upstream_latency
+from app.utils.tile_cache import CachedTile, tile_cache
+from app.utils.tile_archives import TileSet, open_tileset
+from app.utils.single_flight import tile_flights
+from app.utils.tile_prefetch import nearby_tiles, tile_prefetcher, tiles_around
+from app.utils.tile_access_log import HotTile, build_hot_set, read_hot_set, tile_access_log, write_hot_set
+from app.utils.http_caching import (
+    cached_file_response,
+    content_etag,
+    etag_matches,
+    not_modified_response,
+    private_cache_control,
+    representation_etag,
+)
 
 # You might need to import settings for mapbox_token, but it's handled in map_dashboard.js directly
 # from app.core.config import settings
 
+import asyncio
+import functools
+import json
+import os
+import re
+import sqlite3
+
+import asyncpg
 import httpx
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse
 
 router = APIRouter()
 
@@ -232,27 +259,582 @@ async def get_offers_summary(
         )
 
 
+CACHEABLE_STATUS_CODES = (200, 204)  # Tiles and known-empty tiles; errors are never cached
+LOGGED_STATUS_CODES = (200, 204, 304)  # Tiles served (or still fresh in the browser) count in the access log
+PREFETCH_ACCEPT_ENCODING = "gzip"  # Prefetched tiles are cached the way browsers take them
+STYLE_PATH = "static/config/style.json"
+PROXIED_TILE_URL = re.compile(r"/proxy/tiles/([^/]+)/\{z\}/\{x\}/\{y\}\.pbf")
+
+_style_layers: Tuple[Optional[int], List[str]] = (None, [])  # (style.json mtime_ns, its proxied layers)
+
+
+def check_tile_coordinates(z: int, x: int, y: int) -> None:
+    """Rejects tile addresses outside the served zoom range or the zoom's grid with 400."""
+    if not 0 <= z <= settings.TILE_MAX_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise HTTPException(status_code=400, detail=f"Invalid tile {z}/{x}/{y}")
+
+
+def log_tile_access(kind: str, source: str, z: int, x: int, y: int, response: Response) -> Response:
+    """Counts a tile response in the tile access log when it served a tile (not an error); returns the response."""
+    if response.status_code in LOGGED_STATUS_CODES:
+        tile_access_log.record(kind, source, z, x, y)
+    return response
+
+
+def tile_response(
+    request: Request,
+    body: bytes,
+    encoding: Optional[str],
+    etag: Optional[str],
+    cache_control: Optional[str],
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Sends a tile held in memory, negotiating the encoding for this client.
+    200 responses carry a strong ETag (etag, else a hash of body) and are
+    answered with 304 while the client's If-None-Match still matches, before
+    anything is decoded.
+    """
+    headers = {"access-control-allow-origin": "*", "vary": "Accept-Encoding", **(headers or {})}
+    if cache_control:
+        headers["cache-control"] = cache_control
+    if not body:
+        return Response(status_code=status_code, headers=headers)
+    accept_encoding = request.headers.get("accept-encoding")
+    if status_code == 200:
+        decoded = encoding is not None and not accepts_encoding(accept_encoding, encoding)
+        headers["etag"] = representation_etag(etag or content_etag(body), decoded)
+        if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+            return not_modified_response(headers)
+    body, content_encoding = negotiate_tile_body(body, encoding, accept_encoding)
+    if content_encoding:
+        headers["content-encoding"] = content_encoding
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/x-protobuf")
+
+
+def cached_tile_response(request: Request, tile: CachedTile, cache_control: str, cache_status: str = "HIT") -> Response:
+    """
+    Answers a tile request from a tile cache entry: a cache hit, a freshly
+    rendered tile (MISS) or the result of a request this one was coalesced
+    with (COALESCED), which may be an uncached upstream error sent without
+    Cache-Control.
+    """
+    if tile.status_code not in CACHEABLE_STATUS_CODES:
+        cache_control = None
+    return tile_response(
+        request, tile.body, tile.encoding, tile.etag, cache_control, tile.status_code, {"x-tile-cache": cache_status}
+    )
+
+
+@router.get(
+    "/tiles/{schema}/{table}/{z}/{x}/{y}.pbf",
+    summary="Render a vector tile from a PostGIS table",
+)
+async def get_tile(
+    schema: str,
+    table: str,
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Renders one Mapbox Vector Tile directly from PostGIS (layer name = table).
+    Only tables registered in the geometry catalog are served. Tables with a
+    user_id column need a Bearer token and only return the caller's rows
+    (their cached tiles are kept per user, and browsers are told to keep them
+    private). Tiles without features are answered with 204 No Content.
+    Concurrent requests for a tile that is not cached share one query.
+    """
+    check_tile_coordinates(z, x, y)
+    try:
+        layer = await tile_ops.get_tile_layer(schema, table)
+        if layer is None:
+            raise HTTPException(status_code=404, detail=f"No tile layer {schema}.{table}")
+
+        user_id = None
+        cache_control = settings.TILE_LIVE_CACHE_CONTROL
+        if layer["has_user_id"]:
+            current_user = await get_current_user(db=db, authorization=authorization)
+            user_id = current_user.id
+            cache_control = private_cache_control(cache_control)
+
+        cache_key = ("postgis", schema, table, user_id, z, x, y)
+        cached = tile_cache.get(cache_key)
+        if cached is not None:
+            response = cached_tile_response(request, cached, cache_control)
+            if user_id is None:  # Per-user tiles are not logged
+                log_tile_access("postgis", f"{schema}.{table}", z, x, y, response)
+            return response
+
+        tile, coalesced = await tile_flights.run(
+            cache_key, functools.partial(load_live_tile, layer, user_id, z, x, y)
+        )
+    except HTTPException:
+        raise
+    except (asyncpg.PostgresError, OSError) as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render tile: {str(e)}")
+
+    if not coalesced:
+        for nz, nx, ny in prefetched_tiles(z, x, y):
+            tile_prefetcher.enqueue(
+                ("postgis", schema, table, user_id, nz, nx, ny),
+                functools.partial(load_live_tile, layer, user_id, nz, nx, ny),
+            )
+    response = cached_tile_response(request, tile, cache_control, "COALESCED" if coalesced else "MISS")
+    if user_id is None:
+        log_tile_access("postgis", f"{schema}.{table}", z, x, y, response)
+    return response
+
+
+async def load_live_tile(layer: Dict, user_id: Optional[int], z: int, x: int, y: int) -> CachedTile:
+    """Renders a live tile into the tile cache (empty tiles are cached as 204)."""
+    cache_key = ("postgis", layer["schema"], layer["table"], user_id, z, x, y)
+    tile = await tile_ops.render_tile(layer, z, x, y, user_id=user_id)
+    if not tile:
+        return tile_cache.put(cache_key, b"", status_code=status.HTTP_204_NO_CONTENT)
+    return tile_cache.put(cache_key, tile)
+
+
+async def load_shared_live_tile(schema: str, table: str, z: int, x: int, y: int) -> Optional[CachedTile]:
+    """Renders a live tile of a table without per-user rows into the tile cache, for warming."""
+    layer = await tile_ops.get_tile_layer(schema, table)
+    if layer is None or layer["has_user_id"]:
+        return None
+    return await load_live_tile(layer, None, z, x, y)
+
+
+def prefetched_tiles(z: int, x: int, y: int) -> List[Tuple[int, int, int]]:
+    """
+    Tiles prefetched after a miss on (z, x, y): its neighbours and, with
+    TILE_PREFETCH_CHILDREN, its children. None while earlier prefetches are
+    still queued.
+    """
+    if not tile_prefetcher.accepts_misses():
+        return []
+    return nearby_tiles(
+        z, x, y, settings.TILE_PREFETCH_RADIUS, settings.TILE_PREFETCH_CHILDREN, settings.TILE_MAX_ZOOM
+    )
+
+
+def read_tileset_tile(
+    tileset: str, z: int, x: int, y: int, accept_encoding: Optional[str]
+) -> Tuple[Optional[TileSet], Optional[str], Optional[bytes]]:
+    """
+    The blocking part of get_tileset_tile, run in a worker thread: opens the
+    tileset (stat, and the archive when it changed) and looks the tile up.
+    Returns (tileset reader or None, path of a tile to send as a file, bytes
+    of a tile read from an archive); the tile is in neither when not stored.
+    """
+    source = open_tileset(tileset)
+    if source is None:
+        return None, None, None
+    encoding = source.encoding
+    tile_path = source.tile_path(z, x, y)
+    if tile_path is not None and (encoding is None or accepts_encoding(accept_encoding, encoding)):
+        return source, tile_path, None
+    return source, None, source.get_tile(z, x, y)
+
+
+@router.get(
+    "/tilesets/{tileset}/{z}/{x}/{y}.pbf",
+    summary="Serve a tile of a pre-generated tileset",
+)
+async def get_tileset_tile(
+    tileset: str,
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Serves a tile written by postgis2mvt.py from TILE_DIRECTORY: a tile tree
+    (sent as a file), an MBTiles archive or a PMTiles archive. Tiles are sent
+    as stored when the client accepts their encoding, with an ETag of the tile
+    file's version or of the tile's bytes. Missing tiles are empty (204).
+    Archive and file reads run in a worker thread, off the event loop. With
+    TILE_LIVE_FALLBACK, tiles outside the tileset's zoom range or bounds, or
+    of tilesets that do not exist, are rendered live from the table
+    TILE_FALLBACK_SCHEMA.<tileset>.
+    """
+    check_tile_coordinates(z, x, y)
+    accept_encoding = request.headers.get("accept-encoding")
+    try:
+        source, tile_path, tile = await asyncio.to_thread(read_tileset_tile, tileset, z, x, y, accept_encoding)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read tileset {tileset}: {str(e)}")
+
+    if source is not None:
+        cache_control = settings.TILESET_CACHE_CONTROL
+        encoding = source.encoding
+        if tile_path is not None:
+            headers = {"access-control-allow-origin": "*", "vary": "Accept-Encoding"}
+            if encoding:
+                headers["content-encoding"] = encoding
+            return await asyncio.to_thread(
+                cached_file_response, request, tile_path, "application/x-protobuf", cache_control, headers
+            )
+
+        if tile is not None:
+            return tile_response(request, tile, encoding, None, cache_control)
+        if source.covers(z, x, y) or not settings.TILE_LIVE_FALLBACK:
+            # Generated but not stored: postgis2mvt.py skips empty tiles
+            return tile_response(request, b"", None, None, cache_control, status.HTTP_204_NO_CONTENT)
+    elif not settings.TILE_LIVE_FALLBACK:
+        raise HTTPException(status_code=404, detail=f"No tileset {tileset}")
+
+    return await get_tile(
+        settings.TILE_FALLBACK_SCHEMA, tileset, z, x, y, request, db=db, authorization=authorization
+    )
+
+
 @router.api_route("/proxy/tiles/{layer}/{z}/{x}/{y}.pbf", methods=["GET"])
-async def proxy_tile(layer: str, z: int, x: int, y: int):
+async def proxy_tile(layer: str, z: int, x: int, y: int, request: Request):
+    """
+    Reverse proxy for tile requests to the tile server (TILE_UPSTREAM_URL) to avoid CORS issues.
+    Requests share the app-wide pooled upstream client. A tile the tile server
+    sends with an ETag is streamed through as it arrives and keeps that ETag;
+    other tiles are buffered and get a hash of their bytes, so every response
+    carries a validator and a matching If-None-Match is answered with 304.
+    Pre-compressed tiles are passed through untouched with their
+    Content-Encoding when the client accepts it and only decoded for clients
+    that do not. Tiles are served from the tile cache when possible and added
+    to it once fully received.
+    Concurrent requests for a tile already being fetched wait for that fetch
+    instead of going upstream themselves, and get its response also when the
+    tile server answered with an error or could not be reached. A cache miss
+    queues the tile's neighbours for prefetching. Only the layers the map
+    style loads through this proxy are served.
     """
-    Reverse proxy for tile requests to localhost:3000 to avoid CORS issues.
+    check_tile_coordinates(z, x, y)
+    try:
+        proxied_layers = style_proxied_layers()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Could not read the map style: {str(e)}")
+    if layer not in proxied_layers:
+        raise HTTPException(status_code=404, detail=f"No proxied tile layer {layer}")
+
+    cache_control = settings.TILE_PROXY_CACHE_CONTROL
+    cache_key = ("proxy", layer, z, x, y)
+    cached = tile_cache.get(cache_key)
+    if cached is not None:
+        return log_tile_access("proxy", layer, z, x, y, cached_tile_response(request, cached, cache_control))
+
+    while True:
+        flight = tile_flights.join(cache_key)
+        if flight is None:
+            break
+        try:
+            tile = await tile_flights.wait(flight)
+        except httpx.HTTPError as e:  # A prefetch of the tile failed
+            raise HTTPException(status_code=502, detail=f"Tile server request failed: {str(e)}")
+        if tile is not None:
+            response = cached_tile_response(request, tile, cache_control, "COALESCED")
+            return log_tile_access("proxy", layer, z, x, y, response)
+        # The request fetching it went away first: the first waiter fetches it again, the rest wait for that
+
+    flight = tile_flights.start(cache_key)
+    for tile in prefetched_tiles(z, x, y):
+        prefetch_proxied_tile(layer, *tile)
+
+    def land(tile: Optional[CachedTile] = None, error: Optional[Exception] = None) -> None:
+        tile_flights.finish(cache_key, flight, tile, error)
+
+    try:
+        response = await fetch_proxied_tile(
+            request, f"/tiles/{layer}/{z}/{x}/{y}.pbf", cache_key, cache_control, land
+        )
+    except Exception as e:
+        land(error=e)
+        raise
+    except BaseException:
+        land()
+        raise
+    return log_tile_access("proxy", layer, z, x, y, response)
+
+
+async def fetch_proxied_tile(
+    request: Request,
+    path: str,
+    cache_key: Tuple,
+    cache_control: str,
+    land: Callable[..., None],
+) -> Response:
+    """
+    Fetches a tile from the tile server for proxy_tile and caches it. Calls
+    land with the tile once the whole response is in (an uncached entry for
+    error statuses), or with error= when the tile server failed mid-stream; a
+    streamed tile is read to the end even when the client goes away.
+    """
+    accept_encoding = request.headers.get("accept-encoding")
+    try:
+        proxied_response = await open_upstream_tile(path, accept_encoding)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Tile server request failed: {str(e)}")
+
+    # Raw bytes: httpx would otherwise decompress the body on read
+    chunks = proxied_response.aiter_raw()
+    try:
+        # The first chunk is enough to recognise an undeclared gzip body
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except httpx.HTTPError as e:
+        await proxied_response.aclose()
+        raise HTTPException(status_code=502, detail=f"Tile server request failed: {str(e)}")
+
+    headers = {key.lower(): value for key, value in proxied_response.headers.items()}
+    # Set CORS header
+    headers["access-control-allow-origin"] = "*"
+    # Remove hop-by-hop and body-specific headers; they are set again below
+    upstream_encoding = headers.pop("content-encoding", None)
+    headers.pop("transfer-encoding", None)
+    headers.pop("connection", None)
+    headers.pop("keep-alive", None)
+    headers["vary"] = "Accept-Encoding"
+    headers["x-tile-cache"] = "MISS"
+    cacheable = proxied_response.status_code in CACHEABLE_STATUS_CODES
+    if cacheable:
+        headers["cache-control"] = cache_control
+    upstream_etag = headers.pop("etag", None)
+
+    encoding = detect_encoding(first_chunk, upstream_encoding)
+    # Only tiles the tile server gave an ETag are streamed; the rest are read
+    # whole so that the MISS response already carries a hash of their bytes
+    if upstream_etag and (encoding is None or accepts_encoding(accept_encoding, encoding)):
+        # Pass-through: the client gets the upstream bytes (and Content-Length) unchanged
+        if encoding:
+            headers["content-encoding"] = encoding
+        headers["etag"] = upstream_etag
+        if proxied_response.status_code == 200 and etag_matches(request.headers.get("if-none-match"), upstream_etag):
+            # Still read the tile so the next request is served from the cache
+            try:
+                raw_body = first_chunk + b"".join([chunk async for chunk in chunks])
+            finally:
+                await proxied_response.aclose()
+            land(tile_cache.put(cache_key, raw_body, encoding, etag=upstream_etag))
+            return not_modified_response(headers)
+
+        # Upstream is read by its own task: the tile still reaches the cache
+        # and any coalesced requests when this client disconnects mid-stream
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def read_upstream():
+            received = [first_chunk]
+            tile = error = None
+            try:
+                async for chunk in chunks:
+                    received.append(chunk)
+                    queue.put_nowait(chunk)
+                tile = proxied_tile(
+                    cache_key, b"".join(received), encoding, proxied_response.status_code, upstream_etag
+                )
+            except httpx.HTTPError as e:
+                queue.put_nowait(e)
+                error = HTTPException(status_code=502, detail=f"Tile server request failed: {str(e)}")
+            finally:
+                queue.put_nowait(None)
+                await proxied_response.aclose()
+                land(tile, error)
+
+        async def stream_body():
+            if first_chunk:
+                yield first_chunk
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+
+        tile_flights.detach(read_upstream())
+
+        return StreamingResponse(
+            stream_body(),
+            status_code=proxied_response.status_code,
+            headers=headers,
+            media_type="application/x-protobuf",
+        )
+
+    try:
+        raw_body = first_chunk + b"".join([chunk async for chunk in chunks])
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Tile server request failed: {str(e)}")
+    finally:
+        await proxied_response.aclose()
+    land(proxied_tile(cache_key, raw_body, encoding, proxied_response.status_code, upstream_etag))
+    headers.pop("content-length", None)
+    return tile_response(
+        request,
+        raw_body,
+        encoding,
+        upstream_etag,
+        cache_control if cacheable else None,
+        proxied_response.status_code,
+        headers,
+    )
+
+
+def proxied_tile(
+    cache_key: Tuple, body: bytes, encoding: Optional[str], status_code: int, etag: Optional[str]
+) -> CachedTile:
+    """A tile server response as a tile cache entry; error statuses are not added to the cache."""
+    if status_code in CACHEABLE_STATUS_CODES:
+        return tile_cache.put(cache_key, body, encoding, status_code, etag)
+    return CachedTile(body, encoding, status_code, None, None)
+
+
+def prefetch_proxied_tile(layer: str, z: int, x: int, y: int) -> bool:
+    """Queues a proxied tile for prefetching; False when it is cached, already queued or the queue is full."""
+    return tile_prefetcher.enqueue(("proxy", layer, z, x, y), functools.partial(load_proxied_tile, layer, z, x, y))
+
+
+async def load_proxied_tile(layer: str, z: int, x: int, y: int) -> CachedTile:
+    """
+    Fetches a whole tile from the tile server into the tile cache, for
+    prefetching. Error statuses are returned (to requests waiting for the
+    tile) but not cached.
+    """
+    response = await open_upstream_tile(f"/tiles/{layer}/{z}/{x}/{y}.pbf", PREFETCH_ACCEPT_ENCODING)
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    encoding = detect_encoding(body, response.headers.get("content-encoding"))
+    return proxied_tile(
+        ("proxy", layer, z, x, y), body, encoding, response.status_code, response.headers.get("etag")
+    )
+
+
+def style_proxied_layers() -> List[str]:
+    """Layers the map style (static/config/style.json) loads through proxy_tile; re-read when the file changes."""
+    global _style_layers
+    mtime_ns = os.stat(STYLE_PATH).st_mtime_ns
+    if _style_layers[0] == mtime_ns:
+        return _style_layers[1]
+    with open(STYLE_PATH, "r", encoding="utf-8") as f:
+        style = json.load(f)
+    layers = []
+    for source in style.get("sources", {}).values():
+        for url in source.get("tiles", []):
+            match = PROXIED_TILE_URL.search(url)
+            if match and match.group(1) not in layers:
+                layers.append(match.group(1))
+    _style_layers = (mtime_ns, layers)
+    return layers
+
+
+def warm_map_view(latitude: Optional[float], longitude: Optional[float], zoom: Optional[float]) -> int:
+    """
+    Queues the tiles of the style's proxied layers around a map view (a
+    user's saved view at login), nearest first, for prefetching. Returns the
+    number of tiles queued.
+    """
+    if latitude is None or longitude is None or zoom is None:
+        return 0
+    try:
+        layers = style_proxied_layers()
+    except (OSError, ValueError) as e:
+        print(f"Could not read the proxied layers of {STYLE_PATH}: {e}")
+        return 0
+    zoom = min(max(int(zoom), 0), settings.TILE_MAX_ZOOM)
+    queued = 0
+    for tile in tiles_around(latitude, longitude, zoom, settings.TILE_WARM_RADIUS):
+        for layer in layers:
+            queued += prefetch_proxied_tile(layer, *tile)
+    return queued
+
+
+async def warm_hot_tiles(hot_tiles: List[HotTile]) -> int:
     """
-    tile_url = f"http://localhost:3000/tiles/{layer}/{z}/{x}/{y}.pbf"
-    async with httpx.AsyncClient() as client:
-        proxied_response = await client.get(tile_url)
-        headers = dict(proxied_response.headers)
-        # Set CORS header
-        headers["Access-Control-Allow-Origin"] = "*"
-        # Remove hop-by-hop headers if present
-        headers.pop("content-encoding", None)
-        headers.pop("transfer-encoding", None)
-        return Response(content=proxied_response.content, status_code=proxied_response.status_code, headers=headers, media_type="application/x-protobuf")
+    Queues hot set tiles (most requested first) for prefetching, waiting for
+    room in the prefetch queue. Tiles the endpoints would reject (a hot set
+    built from an older log) are skipped. Returns the number of tiles queued.
+    """
+    try:
+        proxied_layers = style_proxied_layers()
+    except (OSError, ValueError) as e:
+        print(f"Could not read the proxied layers of {STYLE_PATH}: {e}")
+        proxied_layers = []
+    queued = 0
+    for kind, source, z, x, y in hot_tiles:
+        try:
+            check_tile_coordinates(z, x, y)
+        except HTTPException:
+            continue
+        if kind == "proxy":
+            if source not in proxied_layers:
+                continue
+            key, load = ("proxy", source, z, x, y), functools.partial(load_proxied_tile, source, z, x, y)
+        elif kind == "postgis":
+            schema, _, table = source.partition(".")
+            key = ("postgis", schema, table, None, z, x, y)
+            load = functools.partial(load_shared_live_tile, schema, table, z, x, y)
+        else:
+            continue
+        queued += await tile_prefetcher.enqueue_wait(key, load)
+    return queued
+
+
+def rebuild_hot_set() -> List[HotTile]:
+    """Writes the access log counts so far, then rebuilds the hot set file from the log (python -m app.tile_hotset does the same)."""
+    tile_access_log.flush()
+    hot_set = build_hot_set(settings.TILE_ACCESS_LOG, settings.TILE_HOTSET_DAYS, settings.TILE_HOTSET_SIZE)
+    write_hot_set(settings.TILE_HOTSET_PATH, hot_set)
+    return [tile for tile, _ in hot_set]
+
+
+async def warm_from_hot_set(rebuild: bool) -> None:
+    """Preloads the hot set file (rebuilt from the access log first when rebuild is set or there is no file)."""
+    try:
+        hot_tiles = [] if rebuild else await asyncio.to_thread(read_hot_set, settings.TILE_HOTSET_PATH)
+        if not hot_tiles and settings.TILE_ACCESS_LOG:
+            hot_tiles = await asyncio.to_thread(rebuild_hot_set)
+        queued = await warm_hot_tiles(hot_tiles)
+        print(f"Queued {queued} of {len(hot_tiles)} hot set tiles for warming")
+    except (OSError, ValueError) as e:
+        print(f"Tile warming from the hot set failed: {e}")
+
+
+async def keep_hot_tiles_warm() -> None:
+    """
+    Preloads the hot set into the tile cache at startup and then, every
+    TILE_HOTSET_WARM_INTERVAL_SECONDS, rebuilds it from the access log and
+    preloads it again. Runs as a background task for the app's lifetime.
+    """
+    if settings.TILE_HOTSET_WARM_ON_STARTUP:
+        await warm_from_hot_set(rebuild=False)
+    interval = settings.TILE_HOTSET_WARM_INTERVAL_SECONDS
+    while interval > 0:
+        await asyncio.sleep(interval)
+        await warm_from_hot_set(rebuild=True)
+
+
+@router.get("/tile-stats", summary="Tile serving statistics")
+async def get_tile_stats():
+    """Upstream tile server latency, tile cache counters, coalesced tile requests and prefetching."""
+    return {
+        "upstream": upstream_latency.summary(),
+        "cache": tile_cache.stats(),
+        "coalescing": tile_flights.stats(),
+        "prefetch": tile_prefetcher.stats(),
+    }
 
 
 @router.get("/static/sprite.json", include_in_schema=False)
-def get_sprite_json():
-    return FileResponse("static/config/sprite.json", media_type="application/json")
+def get_sprite_json(request: Request):
+    return cached_file_response(
+        request, "static/config/sprite.json", "application/json", settings.MAP_STYLE_CACHE_CONTROL
+    )
 
 @router.get("/static/sprite.png", include_in_schema=False)
-def get_sprite_png():
-    return FileResponse("static/config/sprite.png", media_type="image/png")
+def get_sprite_png(request: Request):
+    return cached_file_response(
+        request, "static/config/sprite.png", "image/png", settings.MAP_STYLE_CACHE_CONTROL
+    )
@@ -34,5 +34,58 @@ class Settings(BaseSettings):
     APP_NAME: str = Field(..., description="Application name")
     APP_VERSION: str = Field(..., description="Application version")
 
+    # Live vector tile settings (/tiles endpoint)
+    TILE_POOL_MIN_SIZE: int = Field(1, description="Connections the tile pool keeps open")
+    TILE_POOL_MAX_SIZE: int = Field(10, description="Upper bound on concurrent tile queries")
+    TILE_STATEMENT_TIMEOUT_MS: int = Field(10000, description="Server-side timeout of one tile query")
+    TILE_PROFILES: str = Field("", description="postgis2mvt profile file (JSON/YAML) shaping live tiles per layer and zoom ('' for the defaults)")
+    TILE_MAX_BYTES: int = Field(0, description="Live tiles larger than this are re-rendered coarser, like postgis2mvt --max-tile-bytes (0: no limit)")
+    TILE_PRIORITY_COLUMN: str = Field("", description="Column ranking features kept by TILE_MAX_BYTES thinning, like postgis2mvt --priority-column ('': largest area/length first)")
+    TILE_MAX_ZOOM: int = Field(22, description="Highest zoom served by the live tile endpoint")
+    TILE_CATALOG_TTL_SECONDS: int = Field(300, description="How long a table's geometry catalog lookup is reused")
+
+    # Upstream tile server behind /proxy/tiles
+    TILE_UPSTREAM_URL: str = Field("http://localhost:3000", description="Base URL of the upstream tile server")
+    TILE_UPSTREAM_MAX_CONNECTIONS: int = Field(100, description="Upper bound on open upstream connections")
+    TILE_UPSTREAM_MAX_KEEPALIVE: int = Field(20, description="Idle upstream connections kept alive for reuse")
+    TILE_UPSTREAM_KEEPALIVE_EXPIRY: float = Field(30.0, description="Seconds an idle upstream connection is kept")
+    TILE_UPSTREAM_HTTP2: bool = Field(False, description="Use HTTP/2 to the tile server (needs the h2 package)")
+    TILE_UPSTREAM_CONNECT_TIMEOUT: float = Field(2.0, description="Seconds to connect to the tile server")
+    TILE_UPSTREAM_READ_TIMEOUT: float = Field(10.0, description="Seconds to wait for upstream data")
+    TILE_UPSTREAM_POOL_TIMEOUT: float = Field(5.0, description="Seconds to wait for a free upstream connection")
+
+    # In-process tile cache in front of the tile endpoints
+    TILE_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, description="Total size of cached tiles, bodies plus a fixed per-entry overhead (0 disables the cache)")
+    TILE_CACHE_MAX_ENTRY_BYTES: int = Field(1024 * 1024, description="Larger tiles are not cached")
+    TILE_CACHE_TTL_SECONDS: float = Field(0, description="Seconds a cached tile is served (0: until evicted)")
+
+    # Pre-generated tilesets (postgis2mvt.py output) served by /tilesets
+    TILE_DIRECTORY: str = Field("tiles", description="Directory holding <tileset>/, <tileset>.mbtiles and <tileset>.pmtiles")
+    TILE_LIVE_FALLBACK: bool = Field(False, description="Render tiles a tileset was not generated for from PostGIS")
+    TILE_FALLBACK_SCHEMA: str = Field("public", description="Schema of the table rendered for a tileset by the live fallback")
+
+    # Background prefetching into the tile cache
+    TILE_PREFETCH_CONCURRENCY: int = Field(2, description="Tiles prefetched at once (0 disables prefetching and warming)")
+    TILE_PREFETCH_QUEUE_SIZE: int = Field(512, description="Queued prefetches; more are dropped")
+    TILE_PREFETCH_RADIUS: int = Field(1, description="Rings of neighbours prefetched around a missed tile (0: none; 1 loads up to 8 tiles per miss)")
+    TILE_PREFETCH_CHILDREN: bool = Field(False, description="Also prefetch the next zoom's 4 children of a missed tile")
+    TILE_WARM_ON_LOGIN: bool = Field(True, description="Prefetch the style's proxied layers around a user's saved map view at login")
+    TILE_WARM_RADIUS: int = Field(2, description="Rings of tiles warmed around the saved map center")
+
+    # Tile access log and the hot set preloaded into the tile cache (python -m app.tile_hotset)
+    TILE_ACCESS_LOG: str = Field("logs/tile_access.log", description="File tile request counts are appended to ('' disables)")
+    TILE_ACCESS_LOG_FLUSH_SECONDS: float = Field(60.0, description="Seconds between appends to the tile access log")
+    TILE_HOTSET_PATH: str = Field("logs/tile_hotset.json", description="Hot set file built from the access log")
+    TILE_HOTSET_SIZE: int = Field(500, description="Most requested tiles kept in the hot set")
+    TILE_HOTSET_DAYS: float = Field(7.0, description="Days of access log the hot set is built from")
+    TILE_HOTSET_WARM_ON_STARTUP: bool = Field(True, description="Preload the hot set into the tile cache at startup")
+    TILE_HOTSET_WARM_INTERVAL_SECONDS: float = Field(0, description="Rebuild and preload the hot set this often (0: startup only)")
+
+    # Browser caching (Cache-Control) per route class; responses also carry ETags
+    TILE_LIVE_CACHE_CONTROL: str = Field("public, max-age=60", description="Live PostGIS tiles (sent as private for per-user tables)")
+    TILE_PROXY_CACHE_CONTROL: str = Field("public, max-age=300", description="Tiles proxied from the tile server")
+    TILESET_CACHE_CONTROL: str = Field("public, max-age=86400", description="Pre-generated tilesets (add immutable for versioned tileset names)")
+    MAP_STYLE_CACHE_CONTROL: str = Field("public, max-age=3600", description="Map style and sprite sheet")
+
 # Create an instance of the Settings
 settings = Settings()
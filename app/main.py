@@ -4,12 +4,12 @@
 from fastapi import FastAPI, Request, HTTPException
 from typing import Dict, List
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer
 from fastapi.openapi.utils import (
     get_openapi,
 )
+import asyncio
 import os
 import uvicorn
 
@@ -22,6 +22,13 @@ from app.database.models import User, PasswordResetToken
 # Import the authentication and user routers
 from app.api.v1.endpoints import auth, users, map_data  # NEW: Import offers_summary router
 import app.db_operations as db_ops  # NEW: Import db_operations for schema data
+import app.tile_operations as tile_ops
+from app.utils.tile_upstream import close_upstream_client
+from app.utils.tile_archives import close_tilesets
+from app.utils.http_caching import CacheControlStaticFiles
+from app.utils.tile_prefetch import tile_prefetcher
+from app.utils.tile_access_log import tile_access_log
+from app.core.config import settings
 
 # Define the Bearer security scheme
 bearer_scheme = HTTPBearer()
@@ -63,9 +70,14 @@ app.openapi = custom_openapi
 # Define base directory for easier path management
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Mount static files directory (CSS, JS, images)
+# Mount static files directory (CSS, JS, images); the map style under config/ is cached by browsers
 app.mount(
-    "/static", StaticFiles(directory=os.path.join(BASE_DIR, "../static")), name="static"
+    "/static",
+    CacheControlStaticFiles(
+        directory=os.path.join(BASE_DIR, "../static"),
+        cache_control={"config/": settings.MAP_STYLE_CACHE_CONTROL},
+    ),
+    name="static",
 )
 
 # Configure Jinja2Templates to serve HTML templates
@@ -80,6 +92,30 @@ def on_startup():
     print("Database tables created (if they didn't exist).")
 
 
+# Start counting tile requests into the access log and preloading the hot set of tiles
+hot_tile_warming = None
+
+
+@app.on_event("startup")
+async def start_tile_warming():
+    global hot_tile_warming
+    tile_access_log.start()
+    hot_tile_warming = asyncio.ensure_future(map_data.keep_hot_tiles_warm())
+
+
+# Stop tile warming and prefetching, write the tile access log, then close the live tile
+# connection pool, the upstream tile client and open tile archives
+@app.on_event("shutdown")
+async def on_shutdown():
+    if hot_tile_warming is not None:
+        hot_tile_warming.cancel()
+    await tile_prefetcher.close()
+    await tile_access_log.close()
+    await tile_ops.close_tile_pool()
+    await close_upstream_client()
+    close_tilesets()
+
+
 # Define the root endpoint to serve the new welcome page
 @app.get("/", response_class=HTMLResponse, summary="Serve the main welcome page")
 async def read_root(request: Request):
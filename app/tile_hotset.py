@@ -0,0 +1,32 @@
+# app/tile_hotset.py
+
+import argparse
+
+from app.core.config import settings
+from app.utils.tile_access_log import build_hot_set, write_hot_set
+
+# Builds the tile cache "hot set" from the tile access log:
+#   python -m app.tile_hotset [--days 7] [--size 500] [--log <file>] [--output <file>]
+# The app preloads the hot set into its tile cache at startup
+# (TILE_HOTSET_WARM_ON_STARTUP); run this from cron to refresh it between
+# restarts, or let the app rebuild it itself (TILE_HOTSET_WARM_INTERVAL_SECONDS).
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the tile cache hot set from the tile access log.")
+    parser.add_argument("--log", default=settings.TILE_ACCESS_LOG, help="Tile access log to read")
+    parser.add_argument("--output", default=settings.TILE_HOTSET_PATH, help="Hot set file to write")
+    parser.add_argument("--days", type=float, default=settings.TILE_HOTSET_DAYS, help="Only count requests of the last days")
+    parser.add_argument("--size", type=int, default=settings.TILE_HOTSET_SIZE, help="Number of tiles in the hot set")
+    args = parser.parse_args()
+
+    hot_set = build_hot_set(args.log, args.days, args.size)
+    write_hot_set(args.output, hot_set)
+    requests = sum(count for _, count in hot_set)
+    print(f"Wrote {len(hot_set)} tiles ({requests} requests in the last {args.days:g} days) to {args.output}")
+    for (kind, source, z, x, y), count in hot_set[:10]:
+        print(f"  {count:>8}  {kind} {source} {z}/{x}/{y}")
+
+
+if __name__ == "__main__":
+    main()
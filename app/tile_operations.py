@@ -0,0 +1,326 @@
+# app/tile_operations.py
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from app.core.config import settings
+from postgis2mvt.tile_prepare import (
+    FEATURE_COLUMN,
+    SERVING_SUFFIX,
+    SOURCE_AREA_COLUMN,
+    SOURCE_LENGTH_COLUMN,
+    WHOLE_GEOM_COLUMN,
+    serving_table_name,
+)
+from postgis2mvt.tile_profiles import DEGRADE_STEPS, WEB_MERCATOR_WIDTH, load_profiles, profile_rule
+
+# Live vector tiles straight from PostGIS for the /tiles endpoint, issued over
+# an asyncpg pool that lives as long as the app: no tile server hop and no
+# connection setup per tile. asyncpg prepares each distinct statement once per
+# pooled connection. Tiles are shaped like postgis2mvt.py's: the same profile
+# rules (TILE_PROFILES, keyed by table name), serving copies read the same way
+# and over-budget tiles (TILE_MAX_BYTES) thinned with the same DEGRADE_STEPS
+# and feature ranking (TILE_PRIORITY_COLUMN, as --priority-column), so a live
+# tile matches the pre-generated one. Layers are validated against
+# the PostGIS geometry catalog before any tile SQL is built, and tables with a
+# user_id column only return the caller's rows.
+
+WEB_MERCATOR_SRID = 3857
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+_layer_cache: Dict[Tuple[str, str], Tuple[float, Optional[Dict[str, Any]]]] = {}
+_profiles = load_profiles(settings.TILE_PROFILES) if settings.TILE_PROFILES else {}
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """Turns an SQLAlchemy URL (postgresql+psycopg2://...) into a DSN asyncpg accepts."""
+    scheme, sep, rest = database_url.partition("://")
+    return f"{scheme.split('+')[0]}{sep}{rest}"
+
+
+def quote_identifier(name: str) -> str:
+    """Quotes a schema, table or column name for the tile SQL (asyncpg has no sql.Identifier)."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+async def get_tile_pool() -> asyncpg.Pool:
+    """Returns the app-wide asyncpg pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    dsn=asyncpg_dsn(settings.DATABASE_URL),
+                    min_size=settings.TILE_POOL_MIN_SIZE,
+                    max_size=settings.TILE_POOL_MAX_SIZE,
+                    server_settings={
+                        "application_name": f"{settings.APP_NAME} tiles",
+                        "statement_timeout": str(settings.TILE_STATEMENT_TIMEOUT_MS),
+                    },
+                )
+    return _pool
+
+
+async def close_tile_pool() -> None:
+    """Closes the pool on shutdown."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def get_tile_layer(schema: str, table: str) -> Optional[Dict[str, Any]]:
+    """
+    Looks a table up in the geometry catalog and describes how to tile it:
+    geometry column and SRID, its serving copy (when one exists), feature id
+    column, property columns, thinning priority column (TILE_PRIORITY_COLUMN
+    when the table has it) and whether rows belong to users. Returns None
+    for tables without a registered geometry column, for geometry columns
+    without an SRID (0: the tile envelope cannot be transformed into them) and
+    for serving copies (<table>_mvt), which are only read on behalf of their
+    source table. Results are cached for TILE_CATALOG_TTL_SECONDS.
+    """
+    if table.endswith(SERVING_SUFFIX):
+        return None
+    key = (schema, table)
+    cached = _layer_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    pool = await get_tile_pool()
+    async with pool.acquire() as conn:
+        geometry = await conn.fetchrow(
+            """
+            SELECT f_geometry_column, srid
+            FROM geometry_columns
+            WHERE f_table_schema = $1 AND f_table_name = $2
+            ORDER BY f_geometry_column
+            LIMIT 1
+            """,
+            schema,
+            table,
+        )
+        layer = None
+        if geometry and geometry["srid"]:
+            rows = await conn.fetch(
+                """
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_schema = $1 AND table_name = $2
+                  AND data_type NOT IN ('USER-DEFINED', 'geometry')
+                ORDER BY ordinal_position
+                """,
+                schema,
+                table,
+            )
+            columns = [row["column_name"] for row in rows]
+            # Serving copies from an older prepare lack the whole feature geometry and are not used
+            serving_copy = await conn.fetchval(
+                """
+                SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                               WHERE table_schema = $1 AND table_name = $2 AND column_name = $3)
+                """,
+                schema,
+                serving_table_name(table),
+                WHOLE_GEOM_COLUMN,
+            )
+            # Same id choice as postgis2mvt.py: id, else gid, else a dummy id
+            id_column = next((col for col in ("id", "gid") if col in columns), None)
+            layer = {
+                "schema": schema,
+                "table": table,
+                "geom_column": geometry["f_geometry_column"],
+                "srid": geometry["srid"],
+                # Serving copies hold geom in EPSG:3857, subdivided and clustered, plus each whole feature
+                "serving_copy": serving_table_name(table) if serving_copy else None,
+                "id_column": id_column,
+                "columns": [col for col in columns if col != id_column],
+                # Tables without the priority column are thinned largest geometries first
+                "priority": settings.TILE_PRIORITY_COLUMN if settings.TILE_PRIORITY_COLUMN in columns else None,
+                "has_user_id": "user_id" in columns,
+            }
+
+    _layer_cache[key] = (time.monotonic() + settings.TILE_CATALOG_TTL_SECONDS, layer)
+    return layer
+
+
+def sql_number(value: Any) -> str:
+    """Formats a profile value as an SQL number literal."""
+    return repr(float(value))
+
+
+def build_select_list(
+    layer: Dict[str, Any], rule: Dict[str, Any], geom: str, stored_measures: bool, tolerance: Optional[str] = None
+) -> str:
+    """
+    The tile_data SELECT list of a layer, as postgis2mvt.py's build_select_list:
+    the clipped MVT geometry (simplified by the rule, or by at least the
+    tolerance parameter when degraded), the feature id and the rule's columns.
+    Features below min_area/min_length get a NULL geometry, which ST_AsMVT
+    skips; on serving copy rows (stored_measures=True) the whole source
+    feature's stored size is compared.
+    """
+    columns = layer["columns"]
+    if rule["columns"] is not None:
+        columns = [col for col in columns if col in rule["columns"]]
+
+    source_geom = geom
+    if tolerance is not None:
+        source_geom = f"ST_Simplify({geom}, GREATEST({sql_number(rule['simplify'])}, {tolerance}::float8))"
+    elif rule["simplify"]:
+        source_geom = f"ST_Simplify({geom}, {sql_number(rule['simplify'])})"
+    area, length = f"ST_Area({geom})", f"ST_Length({geom})"
+    if stored_measures:
+        area, length = f"t.{quote_identifier(SOURCE_AREA_COLUMN)}", f"t.{quote_identifier(SOURCE_LENGTH_COLUMN)}"
+    size_filters = []
+    if rule["min_area"]:
+        size_filters.append(f"(ST_Dimension({geom}) <> 2 OR {area} >= {sql_number(rule['min_area'])})")
+    if rule["min_length"]:
+        size_filters.append(f"(ST_Dimension({geom}) <> 1 OR {length} >= {sql_number(rule['min_length'])})")
+    if size_filters:
+        source_geom = f"CASE WHEN {' AND '.join(size_filters)} THEN {source_geom} END"
+
+    id_select = f"t.{quote_identifier(layer['id_column'])} AS id" if layer["id_column"] else "1 AS id"
+    properties = "".join(f", t.{quote_identifier(col)}" for col in columns)
+    return (
+        f"ST_AsMVTGeom({source_geom}, bounds.geom, {int(rule['extent'])}, {int(rule['buffer'])}, true) AS geom, "
+        f"{id_select}{properties}"
+    )
+
+
+def build_cluster_select_list(rule: Dict[str, Any], geom: str) -> str:
+    """The SELECT list of a clustered point layer, as postgis2mvt.py's build_cluster_select_list."""
+    select_items = [
+        f"ST_AsMVTGeom(ST_Centroid(ST_Collect({geom})), bounds.geom, {int(rule['extent'])}, {int(rule['buffer'])}, true) AS geom",
+        "count(*) AS point_count",
+    ]
+    for column, aggregate in rule["cluster_summary"].items():
+        if aggregate == "count_distinct":
+            expression = f"count(DISTINCT t.{quote_identifier(column)})"
+        else:
+            expression = f"{aggregate}(t.{quote_identifier(column)})"
+        select_items.append(f"{expression} AS {quote_identifier(f'{column}_{aggregate}')}")
+    return ", ".join(select_items)
+
+
+def build_tile_query(layer: Dict[str, Any], z: int, degraded: bool = False) -> str:
+    """
+    Builds the single-tile ST_AsMVT query for a layer at zoom z, shaped by the
+    layer's profile rule for that zoom. Parameters (see query_params): $1-$3
+    z/x/y, $4 the MVT layer name, then the user for tables with a user_id
+    column and, degraded, the share of features kept (highest priority
+    column first, else largest; or of cluster cells) and, unless clustered,
+    the simplification tolerance in metres. Like postgis2mvt.py, simplified
+    tiles read whole features instead of serving copy pieces: from the
+    serving copy, the features with a piece in the tile. Rows are matched
+    against the tile envelope grown by the buffer, so features just outside
+    the tile still draw across its edge.
+    """
+    rule = profile_rule(_profiles, layer["table"], z)
+    extent = int(rule["extent"])
+    whole = (bool(rule["simplify"]) or degraded) and not rule["cluster"]  # Clusters are never simplified
+    copy = layer["serving_copy"]
+    if copy is None:
+        relation, geom, srid = layer["table"], "t." + quote_identifier(layer["geom_column"]), layer["srid"]
+    elif whole:
+        relation, geom, srid = copy, "t." + quote_identifier(WHOLE_GEOM_COLUMN), WEB_MERCATOR_SRID
+    else:
+        relation, geom, srid = copy, "t.geom", WEB_MERCATOR_SRID
+    if srid == WEB_MERCATOR_SRID:
+        tile_geom = geom
+        search_area = "bounds.search"
+    else:
+        tile_geom = f"ST_Transform({geom}, {WEB_MERCATOR_SRID})"
+        search_area = f"ST_Transform(bounds.search, {int(srid)})"
+
+    if copy is not None and whole:
+        # The whole geometry is on each feature's first piece; the pieces' index finds the features
+        feature = quote_identifier(FEATURE_COLUMN)
+        conditions = [
+            f"{geom} IS NOT NULL",
+            f"t.{feature} IN (SELECT p.{feature} FROM {quote_identifier(layer['schema'])}.{quote_identifier(copy)} AS p "
+            f"WHERE ST_Intersects(p.geom, {search_area}))",
+        ]
+    else:
+        conditions = [f"ST_Intersects({geom}, {search_area})"]
+    if layer["has_user_id"]:
+        conditions.append("t.user_id = $5")
+    keep_share = f"${6 if layer['has_user_id'] else 5}::float8"
+    tolerance = f"${7 if layer['has_user_id'] else 6}" if degraded else None
+    source = (
+        f"{quote_identifier(layer['schema'])}.{quote_identifier(relation)} AS t "
+        f"WHERE {' AND '.join(conditions)}"
+    )
+    if rule["cluster"]:
+        cell_size = sql_number(rule["cluster"] * WEB_MERCATOR_WIDTH / (1 << z) / extent)
+        if degraded:
+            cell_size = f"{cell_size} / sqrt({keep_share})"
+        source = f"{source} GROUP BY ST_SnapToGrid({tile_geom}, {cell_size})"
+        select_list = build_cluster_select_list(rule, tile_geom)
+    else:
+        if degraded:
+            if layer["priority"]:
+                priority = f"t.{quote_identifier(layer['priority'])}"
+            elif copy is not None:
+                priority = f"t.{quote_identifier(SOURCE_AREA_COLUMN)} + t.{quote_identifier(SOURCE_LENGTH_COLUMN)}"
+            else:
+                priority = f"ST_Area({tile_geom}) + ST_Length({tile_geom})"
+            source = f"""(
+                SELECT t.*, row_number() OVER (ORDER BY {priority} DESC NULLS LAST) AS thin_rank,
+                       count(*) OVER () AS thin_total
+                FROM {source}
+            ) AS t
+            WHERE t.thin_rank <= ceil(t.thin_total * {keep_share})"""
+        select_list = build_select_list(layer, rule, tile_geom, copy is not None, tolerance)
+
+    return f"""
+        SELECT ST_AsMVT(tile_data, $4, {extent}, 'geom')
+        FROM (
+            SELECT ST_TileEnvelope($1, $2, $3) AS geom,
+                   ST_TileEnvelope($1, $2, $3, margin => {int(rule['buffer']) / extent}) AS search
+        ) AS bounds
+        CROSS JOIN LATERAL (
+            SELECT {select_list}
+            FROM {source}
+        ) AS tile_data
+    """
+
+
+def query_params(
+    layer: Dict[str, Any], z: int, x: int, y: int, user_id: Optional[int], step: Optional[Tuple[int, float]] = None
+) -> List[Any]:
+    """Parameters of build_tile_query(layer, z, degraded=step is not None) for tile z/x/y and a DEGRADE_STEPS step."""
+    params = [z, x, y, layer["table"]]
+    if layer["has_user_id"]:
+        params.append(user_id)
+    if step is not None:
+        tolerance_units, keep_share = step
+        rule = profile_rule(_profiles, layer["table"], z)
+        params.append(keep_share)
+        if not rule["cluster"]:
+            params.append(tolerance_units * WEB_MERCATOR_WIDTH / (1 << z) / rule["extent"])
+    return params
+
+
+async def render_tile(
+    layer: Dict[str, Any], z: int, x: int, y: int, user_id: Optional[int] = None
+) -> bytes:
+    """
+    Renders one tile of a layer as raw (uncompressed) MVT bytes; empty when no
+    feature intersects it. Tiles over TILE_MAX_BYTES are re-rendered with the
+    DEGRADE_STEPS ladder until they fit, or with its last step.
+    """
+    pool = await get_tile_pool()
+    async with pool.acquire() as conn:
+        tile = bytes(await conn.fetchval(build_tile_query(layer, z), *query_params(layer, z, x, y, user_id)) or b"")
+        if settings.TILE_MAX_BYTES and len(tile) > settings.TILE_MAX_BYTES:
+            query = build_tile_query(layer, z, degraded=True)
+            for step in DEGRADE_STEPS:
+                tile = bytes(await conn.fetchval(query, *query_params(layer, z, x, y, user_id, step)) or b"")
+                if len(tile) <= settings.TILE_MAX_BYTES:
+                    break
+    return tile
@@ -0,0 +1,114 @@
+# app/utils/http_caching.py
+
+import hashlib
+import os
+from typing import Dict, Mapping, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+
+# Browser-side caching for tiles, the map style and the sprite sheet. Responses
+# carry a strong ETag and the Cache-Control configured for their route class
+# (TILE_*_CACHE_CONTROL, MAP_STYLE_CACHE_CONTROL); a request whose
+# If-None-Match still matches is answered with an empty 304. ETags are a hash
+# of the bytes for tiles held in memory, and the file's mtime and size (the
+# tileset version) for files sent from disk, so no file is read to revalidate.
+
+# Headers a 304 repeats from the full response (RFC 9110, section 15.4.5)
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "etag", "expires", "vary", "access-control-allow-origin")
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag of a response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag of a file from its modification time and size."""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def representation_etag(etag: str, decoded: bool) -> str:
+    """
+    ETag of the representation actually sent: a tile decoded for a client that
+    does not accept its stored encoding is a different body, so it gets its
+    own tag.
+    """
+    if not decoded:
+        return etag
+    return etag[:-1] + '-identity"' if etag.endswith('"') else etag + "-identity"
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Checks an If-None-Match header against an ETag (weak comparison, honouring '*')."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def private_cache_control(cache_control: str) -> str:
+    """The same policy for a response that depends on who asked (browser cache only)."""
+    directives = [d.strip() for d in cache_control.split(",") if d.strip() and d.strip() != "public"]
+    if "private" not in directives and "no-store" not in directives:
+        directives.insert(0, "private")
+    return ", ".join(directives)
+
+
+def not_modified_response(headers: Mapping[str, str]) -> Response:
+    """304 Not Modified carrying the validators and caching headers of the full response."""
+    return Response(
+        status_code=304,
+        headers={name: value for name, value in headers.items() if name.lower() in NOT_MODIFIED_HEADERS},
+    )
+
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    cache_control: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Sends a file with its ETag, Last-Modified and Cache-Control, or a 304 when
+    the client's copy is still current. Only the file's metadata is read for a
+    304.
+    """
+    stat_result = os.stat(path)
+    headers = dict(headers or {})
+    headers["etag"] = file_etag(stat_result)
+    headers["cache-control"] = cache_control
+    if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+        return not_modified_response(headers)
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
+
+
+class CacheControlStaticFiles(StaticFiles):
+    """
+    StaticFiles that adds Cache-Control to the files under the given path
+    prefixes (StaticFiles already sends ETag and Last-Modified and answers
+    conditional requests with 304).
+    """
+
+    def __init__(self, *args, cache_control: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control or {}
+
+    def file_response(self, full_path, stat_result, scope, status_code=200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code=status_code)
+        path = self.get_path(scope).replace(os.sep, "/")
+        for prefix, cache_control in self.cache_control.items():
+            if path.startswith(prefix):
+                response.headers["cache-control"] = cache_control
+                break
+        return response
@@ -0,0 +1,103 @@
+# app/utils/single_flight.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+# Request coalescing for the tile endpoints. While a tile is being rendered or
+# fetched, further requests for the same tile (same cache key) do not start
+# their own query: they wait for the first request's result. The work runs in
+# its own task, so it still completes (and fills the tile cache) when the
+# client that started it goes away. Everything runs on the app's event loop,
+# so no lock is needed.
+
+
+class SingleFlight:
+    """At most one piece of work in flight per key; concurrent callers share its result."""
+
+    def __init__(self):
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        self.tasks: Set[asyncio.Task] = set()  # Strong references to detached work
+        self.leaders = 0
+        self.coalesced = 0
+
+    def busy(self, key: Hashable) -> bool:
+        """Whether work for key is in progress."""
+        return key in self.flights
+
+    def join(self, key: Hashable) -> Optional[asyncio.Future]:
+        """Returns the flight in progress for key, or None when there is none."""
+        return self.flights.get(key)
+
+    async def wait(self, flight: asyncio.Future) -> Any:
+        """
+        Waits for a joined flight and returns its result, counting the caller
+        as coalesced. Errors are re-raised and None results (work given up on)
+        returned without being counted: the caller was not served from them.
+        """
+        result = await asyncio.shield(flight)
+        if result is not None:
+            self.coalesced += 1
+        return result
+
+    def start(self, key: Hashable) -> asyncio.Future:
+        """Registers the caller as the one doing the work for key; it must call finish."""
+        flight = asyncio.get_running_loop().create_future()
+        self.flights[key] = flight
+        self.leaders += 1
+        return flight
+
+    def finish(
+        self, key: Hashable, flight: asyncio.Future, result: Any = None, error: Optional[BaseException] = None
+    ) -> None:
+        """Hands result (or error) to everyone waiting on flight. Later calls for the same flight are ignored."""
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if flight.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            flight.cancel()
+        elif error is not None:
+            flight.set_exception(error)
+            flight.exception()  # Waiters re-raise it; do not report it as never retrieved
+        else:
+            flight.set_result(result)
+
+    def detach(self, work: Awaitable) -> asyncio.Task:
+        """Runs work in its own task, independent of the request that started it."""
+        task = asyncio.ensure_future(work)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Returns (result of work(), coalesced). Only the first caller for a key
+        runs work; callers arriving while it runs get the same result (or
+        exception) with coalesced set.
+        """
+        flight = self.join(key)
+        if flight is not None:
+            return await self.wait(flight), True
+
+        flight = self.start(key)
+
+        async def fly():
+            try:
+                result = await work()
+            except asyncio.CancelledError as e:
+                self.finish(key, flight, error=e)
+                raise
+            except Exception as e:
+                self.finish(key, flight, error=e)  # Raised by every caller, not by this task
+            else:
+                self.finish(key, flight, result)
+
+        self.detach(fly())
+        return await asyncio.shield(flight), False
+
+    def stats(self) -> Dict[str, int]:
+        """Flights started, requests served from another's flight, and flights in progress."""
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self.flights)}
+
+
+tile_flights = SingleFlight()
@@ -0,0 +1,136 @@
+# app/utils/tile_access_log.py
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+# Tile access counts for cache warming. The tile endpoints count the tiles they
+# serve in memory (rejected requests and errors are not counted); every
+# TILE_ACCESS_LOG_FLUSH_SECONDS the counts are appended to TILE_ACCESS_LOG as
+# one tab-separated line per tile requested since the last flush:
+#   <unix time>  <kind>  <source>  <z>  <x>  <y>  <requests>
+# kind is "proxy" (source = upstream layer) or "postgis" (source =
+# schema.table). Tiles of per-user tables are not logged. A "hot set" is the
+# most requested tiles of the last days; it is built with
+#   python -m app.tile_hotset
+# (or by the app itself, see TILE_HOTSET_*) and preloaded into the tile cache.
+
+HotTile = Tuple[str, str, int, int, int]  # (kind, source, z, x, y)
+
+
+class TileAccessLog:
+    """Per-tile request counters, appended to the access log file periodically."""
+
+    def __init__(self, path: str, flush_seconds: float):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.counts: Counter = Counter()
+        self.lock = threading.Lock()  # flush runs in a worker thread
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def record(self, kind: str, source: str, z: int, x: int, y: int) -> None:
+        if self.enabled:
+            with self.lock:
+                self.counts[(kind, source, z, x, y)] += 1
+
+    def flush(self) -> int:
+        """Appends the counts gathered since the last flush to the log; returns the number of lines written."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return 0
+        stamp = int(time.time())
+        lines = "".join(
+            f"{stamp}\t{kind}\t{source}\t{z}\t{x}\t{y}\t{requests}\n"
+            for (kind, source, z, x, y), requests in counts.items()
+        )
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return len(counts)
+
+    def start(self) -> None:
+        """Starts the periodic flush on the app's event loop."""
+        if self.enabled and self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except OSError as e:
+                print(f"Could not write the tile access log {self.path}: {e}")
+
+    async def close(self) -> None:
+        """Stops the periodic flush and writes what is left on shutdown."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.enabled:
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Could not write the tile access log {self.path}: {e}")
+
+
+def read_tile_hits(path: str, since: float = 0) -> Counter:
+    """Sums the requests per tile logged at or after since (unix time). A missing log counts nothing."""
+    hits: Counter = Counter()
+    if not os.path.exists(path):
+        return hits
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 7:
+                continue
+            try:
+                stamp, z, x, y, requests = int(fields[0]), int(fields[3]), int(fields[4]), int(fields[5]), int(fields[6])
+            except ValueError:
+                continue  # A line cut short by a crash
+            if stamp >= since:
+                hits[(fields[1], fields[2], z, x, y)] += requests
+    return hits
+
+
+def build_hot_set(path: str, days: float, size: int) -> List[Tuple[HotTile, int]]:
+    """The size most requested tiles of the last days in the access log at path, with their request counts."""
+    return read_tile_hits(path, since=time.time() - days * 86400).most_common(size)
+
+
+def write_hot_set(path: str, hot_set: List[Tuple[HotTile, int]]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    document = {
+        "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "tiles": [[kind, source, z, x, y, requests] for (kind, source, z, x, y), requests in hot_set],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+
+
+def read_hot_set(path: str) -> List[HotTile]:
+    """Tiles of the hot set file at path, most requested first; empty when there is none."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    return [(kind, source, int(z), int(x), int(y)) for kind, source, z, x, y, _ in document.get("tiles", [])]
+
+
+tile_access_log = TileAccessLog(settings.TILE_ACCESS_LOG, settings.TILE_ACCESS_LOG_FLUSH_SECONDS)
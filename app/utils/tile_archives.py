@@ -0,0 +1,245 @@
+# app/utils/tile_archives.py
+
+import gzip
+import json
+import math
+import mmap
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from postgis2mvt.tile_pmtiles import (
+    PMTILES_COMPRESSION_GZIP,
+    PMTILES_HEADER_LENGTH,
+    PMTILES_TILE_COMPRESSION_NAMES,
+    deserialize_directory,
+    find_entry,
+    unpack_header,
+    zxy_to_tileid,
+)
+
+# Pre-generated tilesets written by postgis2mvt.py, served without the tile
+# server. A tileset <name> is looked up in TILE_DIRECTORY as, in this order:
+#   <name>.pmtiles - PMTiles v3 archive: the file is mmap'd, the root directory
+#                    is decoded once and leaf directories are kept in a small
+#                    LRU, so a tile is a binary search plus one copy of its
+#                    bytes out of the map (a copy, so it stays valid after the
+#                    archive is reopened)
+#   <name>.mbtiles - MBTiles archive, opened read-only
+#   <name>/        - <z>/<x>/<y>.pbf tree; tiles are sent as files (sendfile)
+# Tiles are returned exactly as stored (see the tileset's compression) and
+# archives are reopened when their file changes.
+
+TILESET_NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+PMTILES_LEAF_CACHE_SIZE = 64
+
+_tilesets: Dict[str, Tuple[float, "TileSet"]] = {}
+_tilesets_lock = threading.Lock()
+
+
+class TileSet:
+    """Common part of the tileset readers: metadata, stored encoding and coverage."""
+
+    def __init__(self, path: str, metadata: dict):
+        self.path = path
+        self.metadata = metadata
+
+    @property
+    def encoding(self) -> Optional[str]:
+        """Content-Encoding of the stored tiles (None for raw MVT)."""
+        compression = self.metadata.get("compression", "none")
+        return None if compression in (None, "none") else compression
+
+    def covers(self, z: int, x: int, y: int) -> bool:
+        """
+        Whether the tileset was generated for this tile (zoom range and bounds).
+        A covered tile that is not stored is empty; anything else is unknown.
+        """
+        if "minzoom" not in self.metadata:
+            return True
+        if not self.metadata["minzoom"] <= z <= self.metadata["maxzoom"]:
+            return False
+        west, south, east, north = self.metadata["bounds"]
+        n = 1 << z
+        min_x = int((west + 180.0) / 360.0 * n)
+        max_x = int((east + 180.0) / 360.0 * n)
+        min_y = _lat_to_tile_y(north, n)
+        max_y = _lat_to_tile_y(south, n)
+        return min_x <= x <= max_x and min_y <= y <= max_y
+
+    def tile_path(self, z: int, x: int, y: int) -> Optional[str]:
+        """Path of a tile stored as its own file, for sendfile; None for archives."""
+        return None
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def _lat_to_tile_y(lat: float, n: int) -> int:
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    lat_rad = math.radians(lat)
+    return int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+
+
+class DirectoryTileSet(TileSet):
+    """A <z>/<x>/<y>.pbf tree with the metadata.json postgis2mvt.py writes."""
+
+    def __init__(self, path: str):
+        metadata = {}
+        metadata_path = os.path.join(path, "metadata.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        super().__init__(path, metadata)
+
+    def tile_path(self, z: int, x: int, y: int) -> Optional[str]:
+        path = os.path.join(self.path, str(z), str(x), f"{y}.pbf")
+        return path if os.path.isfile(path) else None
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        path = self.tile_path(z, x, y)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class MBTilesTileSet(TileSet):
+    """An MBTiles archive (TMS rows), plain or deduplicated schema."""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        rows = dict(self.conn.execute("SELECT name, value FROM metadata"))
+        metadata = {"compression": rows.get("compression", "none")}
+        if "minzoom" in rows and "maxzoom" in rows and "bounds" in rows:
+            metadata.update(
+                minzoom=int(rows["minzoom"]),
+                maxzoom=int(rows["maxzoom"]),
+                bounds=tuple(float(value) for value in rows["bounds"].split(",")),
+            )
+        super().__init__(path, metadata)
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self.conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class PMTilesTileSet(TileSet):
+    """A PMTiles v3 archive read through mmap."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = unpack_header(self.map[:PMTILES_HEADER_LENGTH], path)
+        self.internal_compression = header[14]
+        root_offset, root_length = header[2], header[3]
+        self.leaves_offset = header[6]
+        self.data_offset = header[8]
+        self.root = deserialize_directory(self._internal(root_offset, root_length))
+        self.leaves: "OrderedDict[Tuple[int, int], list]" = OrderedDict()
+        self.leaves_lock = threading.Lock()
+        super().__init__(path, {
+            "compression": PMTILES_TILE_COMPRESSION_NAMES.get(header[15], "none"),
+            "minzoom": header[17],
+            "maxzoom": header[18],
+            "bounds": (header[19] / 1e7, header[20] / 1e7, header[21] / 1e7, header[22] / 1e7),
+        })
+
+    def _internal(self, offset: int, length: int) -> bytes:
+        data = self.map[offset:offset + length]
+        if self.internal_compression == PMTILES_COMPRESSION_GZIP:
+            return gzip.decompress(data)
+        return data
+
+    def _leaf(self, offset: int, length: int) -> List[Tuple[int, int, int, int]]:
+        key = (offset, length)
+        with self.leaves_lock:
+            if key in self.leaves:
+                self.leaves.move_to_end(key)
+                return self.leaves[key]
+        entries = deserialize_directory(self._internal(self.leaves_offset + offset, length))
+        with self.leaves_lock:
+            self.leaves[key] = entries
+            if len(self.leaves) > PMTILES_LEAF_CACHE_SIZE:
+                self.leaves.popitem(last=False)
+        return entries
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        tile_id = zxy_to_tileid(z, x, y)
+        directory = self.root
+        for _ in range(4):  # Root plus at most three levels of leaves
+            entry = find_entry(directory, tile_id)
+            if entry is None:
+                return None
+            _, offset, length, run_length = entry
+            if run_length > 0:
+                start = self.data_offset + offset
+                return self.map[start:start + length]
+            directory = self._leaf(offset, length)
+        return None
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+def _locate(name: str) -> Optional[Tuple[str, type]]:
+    root = settings.TILE_DIRECTORY
+    for path, reader in (
+        (os.path.join(root, f"{name}.pmtiles"), PMTilesTileSet),
+        (os.path.join(root, f"{name}.mbtiles"), MBTilesTileSet),
+    ):
+        if os.path.isfile(path):
+            return path, reader
+    path = os.path.join(root, name)
+    if os.path.isdir(path):
+        return path, DirectoryTileSet
+    return None
+
+
+def open_tileset(name: str) -> Optional[TileSet]:
+    """
+    Returns the reader for tileset name in TILE_DIRECTORY, or None when there is
+    no such tileset. Readers are cached and reopened after the archive (or the
+    directory's metadata.json) is rewritten.
+    """
+    if not TILESET_NAME.match(name):
+        return None
+    located = _locate(name)
+    if located is None:
+        return None
+    path, reader = located
+    stamp_path = os.path.join(path, "metadata.json") if reader is DirectoryTileSet else path
+    stamp = os.path.getmtime(stamp_path) if os.path.exists(stamp_path) else 0.0
+
+    with _tilesets_lock:
+        cached = _tilesets.get(name)
+        if cached and cached[0] == stamp and cached[1].path == path:
+            return cached[1]
+        # The reader this replaces is not closed here: tiles are read in worker
+        # threads, which may still be using it. Its mmap or connection is
+        # closed when the last of them lets go of it.
+        tileset = reader(path)
+        _tilesets[name] = (stamp, tileset)
+        return tileset
+
+
+def close_tilesets() -> None:
+    """Closes every open archive on shutdown."""
+    with _tilesets_lock:
+        for _, tileset in _tilesets.values():
+            tileset.close()
+        _tilesets.clear()
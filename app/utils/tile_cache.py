@@ -0,0 +1,135 @@
+# app/utils/tile_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional
+
+from app.core.config import settings
+from app.utils.http_caching import content_etag
+
+# In-process cache in front of the tile endpoints (proxied and live PostGIS
+# tiles). Entries are kept in least-recently-used order and the oldest are
+# evicted once the cached bodies exceed TILE_CACHE_MAX_BYTES. Every entry is
+# charged ENTRY_OVERHEAD_BYTES on top of its body for its key, headers and
+# bookkeeping, so empty (204) tiles count towards the budget and get evicted
+# like any other. Tiles are cached
+# as stored/rendered (possibly pre-compressed), so Content-Encoding negotiation
+# still happens per request. TILE_CACHE_TTL_SECONDS bounds how stale a tile can
+# get; 0 keeps tiles until they are evicted.
+
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class CachedTile(NamedTuple):
+    body: bytes
+    encoding: Optional[str]  # Content-Encoding of body, None for raw MVT
+    status_code: int
+    expires: Optional[float]  # time.monotonic() deadline, None without TTL
+    etag: Optional[str]  # Strong ETag of body, None for empty tiles
+
+
+class TileCache:
+    """LRU tile cache bounded by the total size of the cached bodies plus a fixed per-entry overhead."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float = 0, max_entry_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes
+        self.entries: "OrderedDict[Hashable, CachedTile]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Hashable) -> Optional[CachedTile]:
+        """Returns the cached tile for key and marks it recently used, or None (counted as a miss)."""
+        with self.lock:
+            tile = self.entries.get(key)
+            if tile is not None and tile.expires is not None and tile.expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                tile = None
+            if tile is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def contains(self, key: Hashable) -> bool:
+        """Whether key holds an unexpired tile; unlike get, not counted and not marked as used."""
+        with self.lock:
+            tile = self.entries.get(key)
+            return tile is not None and (tile.expires is None or tile.expires > time.monotonic())
+
+    def put(
+        self,
+        key: Hashable,
+        body: bytes,
+        encoding: Optional[str] = None,
+        status_code: int = 200,
+        etag: Optional[str] = None,
+    ) -> CachedTile:
+        """
+        Caches a tile body, evicting least recently used tiles to stay within
+        max_bytes. The ETag defaults to a hash of the body. Returns the entry,
+        also when the tile is too large to be kept.
+        """
+        if etag is None and body:
+            etag = content_etag(body)
+        expires = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        tile = CachedTile(body, encoding, status_code, expires, etag)
+        if not self.enabled or len(body) > self.max_entry_bytes:
+            return tile
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = tile
+            self.bytes += len(body) + ENTRY_OVERHEAD_BYTES
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return tile
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        self.bytes -= len(self.entries.pop(key).body) + ENTRY_OVERHEAD_BYTES
+
+    def stats(self) -> Dict[str, float]:
+        """Hit, miss, eviction and expiry counters plus current size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+tile_cache = TileCache(
+    settings.TILE_CACHE_MAX_BYTES,
+    ttl_seconds=settings.TILE_CACHE_TTL_SECONDS,
+    max_entry_bytes=settings.TILE_CACHE_MAX_ENTRY_BYTES,
+)
@@ -0,0 +1,69 @@
+# app/utils/tile_encoding.py
+
+import gzip
+import zlib
+from typing import Optional, Tuple
+
+import brotli
+
+# Tiles are stored pre-compressed by postgis2mvt.py (--compress gzip|br), so the
+# tile endpoints hand the stored bytes straight to the client with a matching
+# Content-Encoding. Decoding only happens for the rare client that does not
+# accept the stored encoding; nothing is ever compressed on the request path.
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def detect_encoding(data: bytes, declared: Optional[str] = None) -> Optional[str]:
+    """
+    Returns the content encoding of a stored tile: the declared one if any,
+    otherwise gzip when the payload carries the gzip magic bytes.
+    Brotli has no magic bytes and must always be declared.
+    """
+    if declared and declared.lower() not in ("identity", "none"):
+        return declared.lower()
+    if data[:2] == GZIP_MAGIC:
+        return "gzip"
+    return None
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Checks an Accept-Encoding header for an encoding (honouring q=0 and '*')."""
+    if not accept_encoding:
+        return False
+    wildcard = False
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        refused = params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+        if name == encoding:
+            return not refused
+        if name == "*":
+            wildcard = not refused
+    return wildcard
+
+
+def decode_tile(data: bytes, encoding: Optional[str]) -> bytes:
+    """Decodes a gzip, brotli or deflate encoded tile back to raw MVT bytes."""
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "deflate":
+        return zlib.decompress(data)
+    raise ValueError(f"Unsupported tile encoding: {encoding}")
+
+
+def negotiate_tile_body(
+    data: bytes, encoding: Optional[str], accept_encoding: Optional[str]
+) -> Tuple[bytes, Optional[str]]:
+    """
+    Picks what to send for a stored tile: the stored bytes with their encoding
+    when the client accepts it, otherwise the decoded tile with no encoding.
+    Returns (body, content_encoding).
+    """
+    if not encoding or not data:
+        return data, None
+    if accepts_encoding(accept_encoding, encoding):
+        return data, encoding
+    return decode_tile(data, encoding), None
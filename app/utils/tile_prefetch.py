@@ -0,0 +1,165 @@
+# app/utils/tile_prefetch.py
+
+import asyncio
+import math
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.utils.single_flight import tile_flights
+from app.utils.tile_cache import tile_cache
+
+# Background prefetching into the tile cache. After a tile cache miss the tile
+# endpoints queue the missed tile's neighbours and its children at the next
+# zoom, which the map is likely to ask for on the next pan or zoom; at login
+# the tiles around the user's saved map view are queued, and the hot set of
+# most requested tiles (see tile_access_log) at startup. A few worker tasks
+# (TILE_PREFETCH_CONCURRENCY) work the queue so prefetching never competes
+# with requests for more than that many tiles at once. Tiles already cached,
+# queued or being fetched are skipped, and new work is dropped while the
+# queue is full. Loads run through tile_flights, so a request arriving for a
+# tile that is being prefetched waits for it instead of fetching it again.
+# A miss costs up to (2r+1)^2 - 1 extra tile loads for TILE_PREFETCH_RADIUS r
+# (8 with the default of 1), plus 4 with TILE_PREFETCH_CHILDREN. To keep a pan
+# over uncached tiles from multiplying the load on the tile server or the
+# database by that much, misses queue nothing while earlier prefetches are
+# still waiting in the queue.
+
+Tile = Tuple[int, int, int]
+
+
+def nearby_tiles(z: int, x: int, y: int, radius: int, children: bool, max_zoom: int) -> List[Tile]:
+    """Tiles within radius of (z, x, y) at its zoom (x wraps around) plus, optionally, its four children."""
+    n = 1 << z
+    tiles = []
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if (dx or dy) and 0 <= y + dy < n:
+                tiles.append((z, (x + dx) % n, y + dy))
+    if children and z < max_zoom:
+        tiles.extend((z + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1))
+    return tiles
+
+
+def tiles_around(latitude: float, longitude: float, zoom: int, radius: int) -> List[Tile]:
+    """The tile holding (latitude, longitude) at zoom and the tiles within radius of it, nearest first."""
+    n = 1 << zoom
+    latitude = max(min(latitude, 85.0511287798), -85.0511287798)
+    x = min(int((longitude + 180.0) / 360.0 * n), n - 1)
+    y = min(int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n), n - 1)
+    tiles = [(zoom, x, y)]
+    for ring in range(1, radius + 1):
+        tiles.extend(tile for tile in nearby_tiles(zoom, x, y, ring, False, zoom) if tile not in tiles)
+    return tiles
+
+
+class TilePrefetcher:
+    """Bounded queue of tile loads worked off by a fixed number of background tasks."""
+
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.pending: Set[Hashable] = set()
+        self.queued = 0
+        self.loaded = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0 and tile_cache.enabled
+
+    def enqueue(self, key: Hashable, load: Callable[[], Awaitable]) -> bool:
+        """
+        Queues load() to fill tile cache key in the background. Returns False
+        when the tile is already cached, queued or being fetched, or the queue
+        is full. Must be called from the app's event loop.
+        """
+        if not self._wanted(key):
+            return False
+        try:
+            self.queue.put_nowait((key, load))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.pending.add(key)
+        self.queued += 1
+        return True
+
+    async def enqueue_wait(self, key: Hashable, load: Callable[[], Awaitable]) -> bool:
+        """Like enqueue, but waits for room in the queue instead of dropping the tile (for bulk warming)."""
+        if not self._wanted(key):
+            return False
+        self.pending.add(key)
+        await self.queue.put((key, load))
+        self.queued += 1
+        return True
+
+    def accepts_misses(self) -> bool:
+        """
+        Whether a cache miss may queue its neighbours now: not while earlier
+        prefetches are still waiting in the queue (counted as throttled).
+        """
+        if self.queue is not None and not self.queue.empty():
+            self.throttled += 1
+            return False
+        return True
+
+    def _wanted(self, key: Hashable) -> bool:
+        if not self.enabled:
+            return False
+        if key in self.pending or tile_cache.contains(key) or tile_flights.busy(key):
+            self.skipped += 1
+            return False
+        self._start()
+        return True
+
+    def _start(self) -> None:
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+    async def _work(self) -> None:
+        while True:
+            key, load = await self.queue.get()
+            try:
+                # A request may have fetched the tile while it was queued
+                if tile_cache.contains(key):
+                    self.skipped += 1
+                else:
+                    await tile_flights.run(key, load)
+                    self.loaded += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Tile prefetch of {key} failed: {e}")
+            finally:
+                self.pending.discard(key)
+                self.queue.task_done()
+
+    async def close(self) -> None:
+        """Stops the workers and forgets queued work on shutdown."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+        self.pending.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Queue length and how queued tiles were handled."""
+        return {
+            "queue": self.queue.qsize() if self.queue else 0,
+            "queued": self.queued,
+            "loaded": self.loaded,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+
+tile_prefetcher = TilePrefetcher(settings.TILE_PREFETCH_CONCURRENCY, settings.TILE_PREFETCH_QUEUE_SIZE)
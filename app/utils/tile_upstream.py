@@ -0,0 +1,115 @@
+# app/utils/tile_upstream.py
+
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+
+from app.core.config import settings
+
+# The upstream tile server behind proxy_tile. One httpx.AsyncClient lives as
+# long as the app: its bounded connection pool keeps connections to the tile
+# server alive between tiles, so a tile request no longer pays TCP setup.
+# HTTP/2 (TILE_UPSTREAM_HTTP2) multiplexes all tiles over one connection but
+# needs the optional h2 package (pip install "httpx[http2]").
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class LatencyTracker:
+    """Rolling window of upstream response times (time to response headers)."""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, seconds: float) -> None:
+        self.requests += 1
+        self.samples.append(seconds)
+
+    def record_error(self) -> None:
+        self.requests += 1
+        self.errors += 1
+
+    def summary(self) -> Dict[str, float]:
+        """Request and error counts plus latency percentiles (ms) over the window."""
+        ordered = sorted(self.samples)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "window": len(ordered),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        }
+
+
+upstream_latency = LatencyTracker()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_upstream_client() -> httpx.AsyncClient:
+    """Returns the app-wide upstream client, creating it on first use."""
+    global _client
+    if _client is None:
+        http2 = settings.TILE_UPSTREAM_HTTP2
+        if http2 and not _http2_available():
+            print("TILE_UPSTREAM_HTTP2 is set but the h2 package is missing; using HTTP/1.1")
+            http2 = False
+        _client = httpx.AsyncClient(
+            base_url=settings.TILE_UPSTREAM_URL,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.TILE_UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.TILE_UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=settings.TILE_UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.TILE_UPSTREAM_READ_TIMEOUT,
+                connect=settings.TILE_UPSTREAM_CONNECT_TIMEOUT,
+                pool=settings.TILE_UPSTREAM_POOL_TIMEOUT,
+            ),
+        )
+    return _client
+
+
+async def close_upstream_client() -> None:
+    """Closes the client and its pooled connections on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def open_upstream_tile(path: str, accept_encoding: Optional[str]) -> httpx.Response:
+    """
+    Sends a GET for path to the tile server and returns the response with its
+    body still unread (stream it with aiter_raw, then aclose). Records the time
+    to the response headers in upstream_latency.
+    """
+    client = get_upstream_client()
+    request = client.build_request("GET", path, headers={"Accept-Encoding": accept_encoding or "identity"})
+    started = time.perf_counter()
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.HTTPError:
+        upstream_latency.record_error()
+        raise
+    upstream_latency.record(time.perf_counter() - started)
+    return response
@@ -5,6 +5,62 @@
 # Structure of the command:
 # python postgis2mvt.py --dbname <database_name> --user <username> --password <password> --schema <schema_name> --table <table_name> --layer <layer_name> --bbox <top_left_long> <top_left_lat> <bottom_right_long> <bottom_right_lat> --zoom <zoom_levels>
 # python postgis2mvt.py --dbname <database_name> --user <username> --password <password> --query "<SQL_query>" --layer <layer_name> --bbox <top_left_long> <top_left_lat> <bottom_right_long> <bottom_right_lat> --zoom <zoom_levels>
+# python postgis2mvt.py --dbname <database_name> --user <username> --password <password> --layers <schema.table:layer> [<schema.table:layer> ...] --tileset <tileset_name> --bbox <top_left_long> <top_left_lat> <bottom_right_long> <bottom_right_lat> --zoom <zoom_levels>
+
+# Parallel generation: add --workers <N> (one database connection per worker) and optionally --block-size <tiles>
+# python postgis2mvt.py ... --zoom 10 11 12 13 14 15 16 17 18 --workers 8 --block-size 16
+# Tiles are rendered by one prepared statement per connection, --batch-size <N> tiles per round trip (default 32)
+
+# Skip the subtree of every tile without features (queried zooms are walked top-down): add --prune
+# python postgis2mvt.py ... --zoom 10 11 12 13 14 15 16 17 18 --prune
+
+# Pre-compressed tiles (served as-is with Content-Encoding by the map-data tile endpoints): add --compress gzip or --compress br
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --compress gzip
+
+# Per-zoom generalization (columns, simplification, minimum area/length, MVT extent/buffer per zoom range): add --profile <file>
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --profile profiles.json
+# Point clustering: a profile rule with "cluster": <grid size in extent units> (and optional "cluster_summary")
+# emits one feature per grid cell with point_count; zooms above the rule's maxzoom get raw points again
+# python postgis2mvt.py ... --layer nsw_addresses --zoom 10 11 12 13 14 15 16 17 18 --profile profiles.json
+
+# Data-driven coverage instead of the bbox rectangle: --coverage extent (the layers' data extent) or --coverage cells
+# (only tiles touched by the subdivided geometries at the max zoom, and their parents); --bbox becomes optional and clips
+# python postgis2mvt.py ... --layer nsw_landzones --zoom 10 11 12 13 14 15 16 17 18 --coverage cells
+
+# Resumable runs: add --checkpoint <file>; rerunning the same command after a crash resumes where it stopped
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --checkpoint nsw_lots.ckpt
+
+# Incremental runs (dir or mbtiles output): regenerate only tiles touched by a changed area or by recently updated rows
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --dirty-bbox 151.20 -33.88 151.21 -33.89
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --changed-since "2025-01-01 00:00" --updated-column updated_at
+
+# Writer threads: rendering feeds a bounded queue (--queue-size blocks) drained by --writer-threads threads (several only for dir output);
+# Ctrl-C stops fetching, writes and flushes what is already rendered, and leaves the checkpoint ready to resume
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --workers 4 --writer-threads 4 --queue-size 64 --checkpoint nsw_lots.ckpt
+
+# Sharded generation across machines: each runs --shard i/N (blocks split along a Hilbert curve), then merge the outputs
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --shard 1/3 --output mbtiles:tiles/nsw_lots.1.mbtiles
+# python postgis2mvt.py merge mbtiles:tiles/nsw_lots.1.mbtiles mbtiles:tiles/nsw_lots.2.mbtiles mbtiles:tiles/nsw_lots.3.mbtiles --output pmtiles:tiles/nsw_lots.pmtiles
+
+# Bottom-up pyramid: query PostGIS only at zoom 18, build zooms 10-17 by merging and generalizing child tiles with the profile
+# (--base-zoom queries a deeper zoom than the ones written; not combinable with --prune, --checkpoint, incremental runs or --shard)
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --engine bottom-up --profile profiles.json --workers 4
+
+# Single-archive output instead of one file per tile: add --output mbtiles:<path> or --output pmtiles:<path>
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --output mbtiles:tiles/nsw_lots.mbtiles
+
+# Deduplicated output (identical tiles, e.g. empty sea or solid land-zone fills, stored once): add --dedup
+# python postgis2mvt.py ... --layer nsw_landzones --zoom 10 11 12 13 14 15 16 17 18 --output mbtiles:tiles/nsw_landzones.mbtiles --dedup
+
+# Per-tile instrumentation (query/write time, size, features per tile; per-zoom percentiles, slowest and largest tiles)
+# python postgis2mvt.py ... --layer nsw_lots --zoom 10 11 12 13 14 15 16 17 18 --stats nsw_lots_stats.json --stats-top 20
+
+# Tile byte budget (over-budget tiles are re-rendered with coarser simplification and feature thinning; degraded tiles are logged)
+# python postgis2mvt.py ... --layer nsw_addresses --zoom 10 11 12 13 14 15 16 17 18 --max-tile-bytes 200000 --priority-column priority
+
+# Serving copies (<table>_mvt: EPSG:3857 geometry, subdivided polygons plus whole features for simplified zooms, GiST index, clustered); tile runs read them automatically
+# (re-run prepare after the source table changes, or pass --no-serving-copy to read the source table)
+# python postgis2mvt.py prepare --dbname nsw --user postgres --password postgres --host localhost --port 5432 --layers public.nsw_landzones public.nsw_lots --max-vertices 256
 
 ############## Actual commands for tables ##############
 
@@ -26,4 +82,7 @@ python postgis2mvt.py --dbname nsw --user postgres --password postgres --host lo
 
 # nsw_landzones
 python postgis2mvt.py --dbname nsw --user postgres --password postgres --host localhost --port 5432 --schema public --table nsw_landzones --layer nsw_landzones --bbox 151.16359 -33.86696 151.22493 -33.93055 --zoom 10 11 12 13 14 15 16 17 18
-python postgis2mvt.py --dbname nsw --user postgres --password postgres --host localhost --port 5432 --query "SELECT * FROM public.nsw_landzones" --layer nsw_landzones --bbox 151.16359 -33.86696 151.22493 -33.93055 --zoom 10 11 12 13 14 15 16 17 18
\ No newline at end of file
+python postgis2mvt.py --dbname nsw --user postgres --password postgres --host localhost --port 5432 --query "SELECT * FROM public.nsw_landzones" --layer nsw_landzones --bbox 151.16359 -33.86696 151.22493 -33.93055 --zoom 10 11 12 13 14 15 16 17 18
+
+# nsw composite (addresses, roads, lots and lots centers as four layers of one tile)
+python postgis2mvt.py --dbname nsw --user postgres --password postgres --host localhost --port 5432 --layers public.nsw_addresses:nsw_addresses public.nsw_roads:nsw_roads public.nsw_lots:nsw_lots public.nsw_lots_centers:nsw_lots_centers --tileset nsw --bbox 151.16359 -33.86696 151.22493 -33.93055 --zoom 10 11 12 13 14 15 16 17 18
\ No newline at end of file
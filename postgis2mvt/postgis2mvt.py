@@ -1,10 +1,29 @@
 import argparse
+import gzip
 import os
 import math
+import multiprocessing
+import sys
+import threading
+import time
+import brotli # Brotli tile compression (--compress br)
 import psycopg2
 from psycopg2 import sql
 import mercantile # Import mercantile for tile calculations
 from tqdm import tqdm # Import tqdm for progress bars
+from tile_writers import open_tile_writer # Directory / MBTiles / PMTiles output targets
+from tile_pmtiles import zxy_to_tileid # PMTiles tile ids (also the block order of lazy enumeration)
+from tile_readers import merge_metadata, open_tile_reader # Reading shard outputs back ("merge")
+from tile_checkpoint import TileCheckpoint # Resumable-run manifest
+from tile_profiles import DEGRADE_STEPS, WEB_MERCATOR_WIDTH, load_profiles, profile_rule # Per-zoom generalization profiles
+from tile_stats import TileStats # Per-tile timing and size instrumentation (--stats)
+from tile_pipeline import DEFAULT_QUEUE_SIZE, WriterPipeline, throttled # Overlapped fetch/write pipeline
+from tile_prepare import (DEFAULT_MAX_VERTICES, FEATURE_COLUMN, SOURCE_AREA_COLUMN, SOURCE_LENGTH_COLUMN,
+                          WHOLE_GEOM_COLUMN, build_serving_copy, find_serving_copy,
+                          serving_table_name) # Serving copies ("prepare")
+from tile_pyramid import PYRAMID_SUMMARY_AGGREGATES, PyramidScratch, decode_stored_tile, merge_child_tiles # --engine bottom-up
+
+CHECKPOINT_INTERVAL = 2000 # Processed tiles between writer flush + checkpoint commit
 
 def deg2rad(deg):
     """Converts degrees to radians."""
@@ -58,13 +77,14 @@ def get_tile_range_for_bbox(min_lat, min_lon, max_lat, max_lon, zoom):
     max_x, max_y = latlon_to_tile(min_lat, max_lon, zoom)
     return min_x, min_y, max_x, max_y
 
-def get_table_columns(cursor, schema_name, table_name):
+def get_table_columns(cursor, schema_name, table_name, include_types=False):
     """
     Fetches all column names for a given table and schema, excluding geometry columns.
     Assumes 'geom' is the geometry column name.
+    With include_types=True, returns (column_name, data_type) pairs instead.
     """
     query = sql.SQL("""
-        SELECT column_name
+        SELECT column_name, data_type
         FROM information_schema.columns
         WHERE table_schema = {schema_name}
           AND table_name = {table_name}
@@ -74,28 +94,862 @@ def get_table_columns(cursor, schema_name, table_name):
         table_name=sql.Literal(table_name)
     )
     cursor.execute(query)
+    if include_types:
+        return [(row[0], row[1]) for row in cursor.fetchall()]
     columns = [row[0] for row in cursor.fetchall()]
     return columns
 
+def describe_vector_layer(cursor, schema_name, table_name, layer_name, minzoom, maxzoom, profiles=None):
+    """
+    Builds the TileJSON 'vector_layers' entry for a layer from the table's columns.
+    The id/gid column is exported as the 'id' attribute, matching build_select_list.
+    Zooms clustered by the layer's profile add point_count and the summary attributes.
+    """
+    numeric_types = {"smallint", "integer", "bigint", "numeric", "real", "double precision"}
+    fields = {"id": "Number"}
+    for column_name, data_type in get_table_columns(cursor, schema_name, table_name, include_types=True):
+        if column_name in ("id", "gid"):
+            continue
+        if data_type in numeric_types:
+            fields[column_name] = "Number"
+        elif data_type == "boolean":
+            fields[column_name] = "Boolean"
+        else:
+            fields[column_name] = "String"
+    for rule in (profiles or {}).get(layer_name, []):
+        if rule["cluster"]:
+            fields["point_count"] = "Number"
+            for column_name, aggregate in rule["cluster_summary"].items():
+                if aggregate in ("min", "max"):
+                    field_type = fields.get(column_name, "String")
+                else:
+                    field_type = "Number"
+                fields[f"{column_name}_{aggregate}"] = field_type
+    return {
+        "id": layer_name,
+        "fields": fields,
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+    }
+
+def resolve_layer_columns(cursor, schema_name, table_name):
+    """
+    Works out which columns of a table become MVT properties.
+    Returns (mvt_id_column_select, id_column_name_for_print, columns_to_include).
+    """
+    columns_to_include = get_table_columns(cursor, schema_name, table_name)
+
+    # Ensure 'id' is selected if it exists, otherwise use a placeholder.
+    # If your table has a unique ID column, it's best to use that as the MVT 'id'.
+    # Assuming 'id' or 'gid' is commonly used as a primary key.
+    # You might need to adjust this logic based on your actual table's ID column name.
+    mvt_id_column_select = ""
+    id_column_name_for_print = "id" # Default for printing
+    if 'id' in columns_to_include:
+        mvt_id_column_select = sql.SQL("t.id AS id")
+        columns_to_include.remove('id') # Remove to avoid duplicate selection if 'id' is desired as MVT feature ID
+    elif 'gid' in columns_to_include: # Common alternative for ID
+        mvt_id_column_select = sql.SQL("t.gid AS id")
+        columns_to_include.remove('gid')
+        id_column_name_for_print = "gid" # Update for printing
+    else:
+        mvt_id_column_select = sql.SQL("1 AS id") # Fallback to dummy ID if no id/gid found
+        id_column_name_for_print = "id (dummy)" # Update for printing dummy id
+
+    return mvt_id_column_select, id_column_name_for_print, columns_to_include
+
+def build_select_list(layer, rule, tolerance=None, stored_measures=False):
+    """
+    Builds the SELECT list used inside the ST_AsMVT sub-query for a layer at one
+    zoom range: the clipped MVT geometry, the feature id and the property columns,
+    shaped by the layer's profile rule. Features below min_area/min_length get a
+    NULL geometry instead of being filtered out in WHERE, so ST_AsMVT skips them
+    while the feature count used by --prune still sees them.
+    tolerance is an optional SQL expression for a coarser simplification
+    (the larger of it and the profile's simplify is used).
+    stored_measures=True when the rows come from the serving copy: the size
+    filters then use the whole source feature's area and length stored there.
+    """
+    columns_to_include = layer["columns"]
+    if rule["columns"] is not None:
+        columns_to_include = [col for col in columns_to_include if col in rule["columns"]]
+
+    # Construct the comma-separated list of columns for the SQL query
+    # Using sql.Identifier to safely quote column names
+    properties_select_list = sql.SQL(', ').join(
+        [sql.SQL("t.{}").format(sql.Identifier(col)) for col in columns_to_include]
+    )
+
+    source_geom = sql.SQL("t.geom")
+    if tolerance is not None:
+        source_geom = sql.SQL("ST_Simplify(t.geom, GREATEST({}, {}))").format(
+            sql.Literal(rule["simplify"]), tolerance)
+    elif rule["simplify"]:
+        source_geom = sql.SQL("ST_Simplify(t.geom, {})").format(sql.Literal(rule["simplify"]))
+    area = sql.SQL("ST_Area(t.geom)")
+    length = sql.SQL("ST_Length(t.geom)")
+    if stored_measures:
+        area = sql.SQL("t.{}").format(sql.Identifier(SOURCE_AREA_COLUMN))
+        length = sql.SQL("t.{}").format(sql.Identifier(SOURCE_LENGTH_COLUMN))
+    size_filters = []
+    if rule["min_area"]:
+        size_filters.append(sql.SQL("(ST_Dimension(t.geom) <> 2 OR {} >= {})").format(
+            area, sql.Literal(rule["min_area"])))
+    if rule["min_length"]:
+        size_filters.append(sql.SQL("(ST_Dimension(t.geom) <> 1 OR {} >= {})").format(
+            length, sql.Literal(rule["min_length"])))
+    if size_filters:
+        source_geom = sql.SQL("CASE WHEN {} THEN {} END").format(
+            sql.SQL(" AND ").join(size_filters), source_geom)
+
+    geom_select = sql.SQL("""
+            ST_AsMVTGeom(
+                {source_geom},
+                bounds.geom,
+                {extent},
+                {buffer},
+                true
+            ) AS geom""").format(
+        source_geom=source_geom,
+        extent=sql.Literal(rule["extent"]),
+        buffer=sql.Literal(rule["buffer"])
+    )
+
+    # Combine geometry, ID, and other properties
+    if not columns_to_include: # Check if properties_select_list is empty
+        return sql.SQL("{}, {}").format(geom_select, layer["id_select"])
+    return sql.SQL("{}, {}, {}").format(geom_select, layer["id_select"], properties_select_list)
+
+def build_cluster_select_list(rule):
+    """
+    Builds the SELECT list of a clustered point layer: one feature per grid cell
+    at the mean position of its points, with point_count and the rule's
+    cluster_summary aggregates as attributes.
+    """
+    select_items = [
+        sql.SQL("""
+            ST_AsMVTGeom(
+                ST_Centroid(ST_Collect(t.geom)),
+                bounds.geom,
+                {extent},
+                {buffer},
+                true
+            ) AS geom""").format(extent=sql.Literal(rule["extent"]), buffer=sql.Literal(rule["buffer"])),
+        sql.SQL("count(*) AS point_count"),
+    ]
+    for column_name, aggregate in rule["cluster_summary"].items():
+        if aggregate == "count_distinct":
+            expression = sql.SQL("count(DISTINCT t.{})").format(sql.Identifier(column_name))
+        else:
+            expression = sql.SQL("{}(t.{})").format(sql.SQL(aggregate), sql.Identifier(column_name))
+        select_items.append(sql.SQL("{} AS {}").format(
+            expression, sql.Identifier(f"{column_name}_{aggregate}")))
+    return sql.SQL(", ").join(select_items)
+
+def tile_statement_name(zoom):
+    """Name of the prepared batch statement for one zoom level."""
+    return f"mvt_tiles_z{zoom}"
+
+def degraded_statement_name(zoom):
+    """Name of the prepared single-tile statement used to shrink over-budget tiles."""
+    return f"mvt_tile_degraded_z{zoom}"
+
+def parse_layer_spec(spec):
+    """
+    Parses a --layers entry of the form schema.table[:layer] into
+    (schema, table, layer). The layer name defaults to the table name.
+    """
+    table_part, _, layer_name = spec.partition(":")
+    schema_name, dot, table_name = table_part.partition(".")
+    if not dot or not schema_name or not table_name:
+        raise argparse.ArgumentTypeError(f"Invalid layer spec '{spec}', expected schema.table[:layer]")
+    return schema_name, table_name, layer_name or table_name
+
+def build_job(cursor, layer_specs, options):
+    """
+    Builds the per-connection rendering job: one entry per (schema, table, layer)
+    with its property columns, thinning priority, the source table's columns and
+    SRID, and the relation tiles are read from (the serving copy when one
+    exists), plus the render options (zooms,
+    profiles, batch_size, compression, collect_stats, max_tile_bytes,
+    priority_column, use_serving_copy, scratch_path) shared by the parent and
+    every worker.
+    """
+    layers = []
+    for schema_name, table_name, layer_name in layer_specs:
+        id_select, id_column_name_for_print, columns_to_include = resolve_layer_columns(
+            cursor, schema_name, table_name)
+        priority_column = options["priority_column"]
+        serving_copy = None
+        if options["use_serving_copy"]:
+            serving_copy = find_serving_copy(cursor, schema_name, table_name)
+        cursor.execute("SELECT Find_SRID(%s, %s, 'geom')", (schema_name, table_name))
+        layers.append({
+            "schema": schema_name,
+            "table": table_name,
+            "relation": serving_copy or table_name,
+            "srid": cursor.fetchone()[0],
+            "source_columns": get_table_columns(cursor, schema_name, table_name),
+            "layer": layer_name,
+            "id_select": id_select,
+            "columns": columns_to_include,
+            "printable_columns": [id_column_name_for_print] + columns_to_include,
+            # Layers without the priority column are thinned largest geometries first
+            "priority": priority_column if priority_column in columns_to_include else None,
+        })
+    return dict(options, layers=layers, zooms=sorted(set(options["zooms"])))
+
+def build_layer_source(layer, whole=False):
+    """
+    Builds the FROM item of a layer's rows intersecting bounds.geom, aliased t
+    with geom in EPSG:3857. From a serving copy these are its pieces, or with
+    whole=True its whole features: those with a piece intersecting the tile,
+    read from the feature's first piece. Without a serving copy they are the
+    source table's rows; a source table in another SRID is matched against the
+    transformed tile bounds and its geometries are transformed on the fly.
+    """
+    if layer["relation"] != layer["table"] and whole:
+        return sql.SQL("""(
+                    SELECT {columns}w.{area_column}, w.{length_column}, w.{whole_column} AS geom
+                    FROM {schema_name}.{relation} AS w
+                    WHERE w.{whole_column} IS NOT NULL AND w.{feature_column} IN (
+                        SELECT p.{feature_column} FROM {schema_name}.{relation} AS p
+                        WHERE ST_Intersects(p.geom, bounds.geom)
+                    )
+                ) AS t""").format(
+            columns=sql.SQL("").join([sql.SQL("w.{}, ").format(sql.Identifier(col)) for col in layer["source_columns"]]),
+            area_column=sql.Identifier(SOURCE_AREA_COLUMN),
+            length_column=sql.Identifier(SOURCE_LENGTH_COLUMN),
+            whole_column=sql.Identifier(WHOLE_GEOM_COLUMN),
+            feature_column=sql.Identifier(FEATURE_COLUMN),
+            schema_name=sql.Identifier(layer["schema"]),
+            relation=sql.Identifier(layer["relation"]),
+        )
+    if layer["relation"] != layer["table"] or layer["srid"] in (0, 3857):
+        return sql.SQL("""{schema_name}.{table_name} AS t
+                WHERE ST_Intersects(t.geom, bounds.geom)""").format(
+            schema_name=sql.Identifier(layer["schema"]),
+            table_name=sql.Identifier(layer["relation"]),
+        )
+    return sql.SQL("""(
+                    SELECT {columns}ST_Transform(s.geom, 3857) AS geom
+                    FROM {schema_name}.{table_name} AS s
+                    WHERE ST_Intersects(s.geom, ST_Transform(bounds.geom, {srid}))
+                ) AS t""").format(
+        columns=sql.SQL("").join([sql.SQL("s.{}, ").format(sql.Identifier(col)) for col in layer["source_columns"]]),
+        schema_name=sql.Identifier(layer["schema"]),
+        table_name=sql.Identifier(layer["table"]),
+        srid=sql.Literal(layer["srid"]),
+    )
+
+def build_layer_joins(layers, zoom, profiles, degraded=False):
+    """
+    Builds one CROSS JOIN LATERAL per layer (each an ST_AsMVT over the rows
+    intersecting bounds.geom) and the expressions that concatenate the layer
+    tiles and sum their feature counts. With degraded=True the layer sources
+    read the simplification tolerance ($4, metres) and the share of features to
+    keep ($5) from the statement parameters; features are kept by descending
+    priority column, or by descending area/length when the layer has none.
+    Layers clustered at this zoom (profile "cluster") are grouped with
+    ST_SnapToGrid on a grid of rule["cluster"] extent units; degraded, the grid
+    grows so that roughly the $5 share of cells remains.
+    Simplified layers (profile simplify, or degraded) read whole features
+    rather than serving copy pieces, which would be simplified apart along
+    their cut lines; thinning then also ranks whole features.
+    Returns (layer_joins, tile_expression, features_expression).
+    """
+    layer_joins = []
+    tile_parts = []
+    feature_parts = []
+    for index, layer in enumerate(layers):
+        alias = sql.Identifier(f"layer_{index}")
+        rule = profile_rule(profiles, layer["layer"], zoom)
+        # Clustered layers are never simplified
+        whole = (bool(rule["simplify"]) or degraded) and not rule["cluster"]
+        source = build_layer_source(layer, whole)
+        if rule["cluster"]:
+            cell_size = sql.Literal(rule["cluster"] * WEB_MERCATOR_WIDTH / (1 << zoom) / rule["extent"])
+            if degraded:
+                cell_size = sql.SQL("{} / sqrt($5)").format(cell_size)
+            source = sql.SQL("""{source}
+                GROUP BY ST_SnapToGrid(t.geom, {cell_size})""").format(source=source, cell_size=cell_size)
+            select_list = build_cluster_select_list(rule)
+        else:
+            tolerance = None
+            if degraded:
+                if layer["priority"]:
+                    priority = sql.SQL("t.{}").format(sql.Identifier(layer["priority"]))
+                elif layer["relation"] != layer["table"]:
+                    priority = sql.SQL("t.{} + t.{}").format(
+                        sql.Identifier(SOURCE_AREA_COLUMN), sql.Identifier(SOURCE_LENGTH_COLUMN))
+                else:
+                    priority = sql.SQL("ST_Area(t.geom) + ST_Length(t.geom)")
+                source = sql.SQL("""(
+                    SELECT t.*, row_number() OVER (ORDER BY {priority} DESC NULLS LAST) AS thin_rank,
+                           count(*) OVER () AS thin_total
+                    FROM {source}
+                ) AS t
+                WHERE t.thin_rank <= ceil(t.thin_total * $5)""").format(priority=priority, source=source)
+                tolerance = sql.SQL("$4")
+            select_list = build_select_list(layer, rule, tolerance, layer["relation"] != layer["table"])
+        layer_joins.append(sql.SQL("""
+        CROSS JOIN LATERAL (
+            SELECT ST_AsMVT(tile_data, {layer_name}, {extent}, 'geom') AS tile, count(*) AS features FROM (
+                SELECT
+                    {final_select_list}
+                FROM {source}
+            ) AS tile_data
+        ) AS {alias}""").format(
+            layer_name=sql.Literal(layer["layer"]),
+            extent=sql.Literal(rule["extent"]),
+            final_select_list=select_list,
+            source=source,
+            alias=alias
+        ))
+        tile_parts.append(sql.SQL("COALESCE({}.tile, ''::bytea)").format(alias))
+        feature_parts.append(sql.SQL("{}.features").format(alias))
+    return sql.Composed(layer_joins), sql.SQL(" || ").join(tile_parts), sql.SQL(" + ").join(feature_parts)
+
+def build_batch_tile_query(layers, zoom, profiles):
+    """
+    Constructs the PREPARE statement that renders a whole batch of tiles in one round trip.
+    The three int[] parameters are unnested into (z, x, y) rows; each row gets its own
+    ST_TileEnvelope (SRID 3857, Web Mercator) and one ST_AsMVT per layer. The layer
+    tiles are concatenated into a single multi-layer tile, and the statement returns
+    one (z, x, y, mvt, features) row per requested tile. features counts the rows that
+    intersect the tile, even those whose geometry collapses away in ST_AsMVTGeom.
+    Each zoom gets its own statement, built from the layers' profile rules.
+    """
+    layer_joins, tile, features = build_layer_joins(layers, zoom, profiles)
+    return sql.SQL("""
+        PREPARE {statement_name}(int[], int[], int[]) AS
+        SELECT k.z, k.x, k.y, {tile}, {features}
+        FROM unnest($1::int[], $2::int[], $3::int[]) AS k(z, x, y)
+        CROSS JOIN LATERAL (
+            SELECT ST_TileEnvelope(k.z, k.x, k.y) AS geom
+        ) AS bounds{layer_joins};
+    """).format(
+        statement_name=sql.Identifier(tile_statement_name(zoom)),
+        tile=tile,
+        features=features,
+        layer_joins=layer_joins
+    )
+
+def build_degraded_tile_query(layers, zoom, profiles):
+    """
+    Constructs the PREPARE statement that re-renders one over-budget tile
+    (z, x, y, tolerance in metres, share of features kept) for --max-tile-bytes.
+    """
+    layer_joins, tile, features = build_layer_joins(layers, zoom, profiles, degraded=True)
+    return sql.SQL("""
+        PREPARE {statement_name}(int, int, int, float8, float8) AS
+        SELECT {tile}, {features}
+        FROM (
+            SELECT ST_TileEnvelope($1, $2, $3) AS geom
+        ) AS bounds{layer_joins};
+    """).format(
+        statement_name=sql.Identifier(degraded_statement_name(zoom)),
+        tile=tile,
+        features=features,
+        layer_joins=layer_joins
+    )
+
+def prepare_tile_statements(cur, job):
+    """Prepares the tile statements of every zoom once on the cursor's connection."""
+    for zoom in job["zooms"]:
+        cur.execute(build_batch_tile_query(job["layers"], zoom, job["profiles"]))
+        if job["max_tile_bytes"]:
+            cur.execute(build_degraded_tile_query(job["layers"], zoom, job["profiles"]))
+
+def group_into_blocks(tiles, block_size):
+    """
+    Groups the tiles of one zoom level into square blocks of block_size x block_size
+    tiles. Tiles inside a block are spatially adjacent, so the queries issued for
+    one block keep hitting the same spatial index pages and table pages.
+    Returns {(block_x, block_y): [(z, x, y), ...]} with each block sorted by x then y.
+    """
+    blocks = {}
+    for tile in tiles:
+        key = (tile.x // block_size, tile.y // block_size)
+        blocks.setdefault(key, []).append((tile.z, tile.x, tile.y))
+    for block in blocks.values():
+        block.sort(key=lambda t: (t[1], t[2]))
+    return blocks
+
+def range_block_keys(tile_range, block_size):
+    """
+    Lazy counterpart of group_into_blocks for every tile of tile_range: returns
+    the keys of the blocks covering the range without listing their tiles.
+    """
+    min_x, min_y, max_x, max_y = tile_range
+    return [(block_x, block_y)
+            for block_x in range(min_x // block_size, max_x // block_size + 1)
+            for block_y in range(min_y // block_size, max_y // block_size + 1)]
+
+def _range_block_spans(key, tile_range, block_size):
+    block_x, block_y = key
+    min_x, min_y, max_x, max_y = tile_range
+    return (range(max(block_x * block_size, min_x), min((block_x + 1) * block_size, max_x + 1)),
+            range(max(block_y * block_size, min_y), min((block_y + 1) * block_size, max_y + 1)))
+
+def range_block_tiles(key, zoom, tile_range, block_size):
+    """The (z, x, y) tiles of one block of tile_range, sorted by x then y."""
+    x_span, y_span = _range_block_spans(key, tile_range, block_size)
+    return [(zoom, x, y) for x in x_span for y in y_span]
+
+def range_block_count(key, tile_range, block_size):
+    """Number of tiles of tile_range in one block."""
+    x_span, y_span = _range_block_spans(key, tile_range, block_size)
+    return len(x_span) * len(y_span)
+
+def parse_shard(spec):
+    """Parses a --shard value "i/N" (1 <= i <= N) into (i, N)."""
+    index, slash, count = spec.partition("/")
+    if not slash or not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+        raise argparse.ArgumentTypeError(f"Invalid shard '{spec}', expected i/N with 1 <= i <= N")
+    return int(index), int(count)
+
+def shard_block_keys(keys, zoom, block_size, shard):
+    """
+    Orders the block keys of a zoom along a Hilbert curve and returns the
+    shard's contiguous share: shard (i, N) gets the i-th of N equal slices.
+    Every machine computes the same order, so the shards are disjoint and
+    together cover all blocks, and each shard's blocks stay spatially compact.
+    """
+    index, count = shard
+    block_zoom = max(0, zoom - (block_size.bit_length() - 1)) # Block keys fit a grid of this zoom
+    ordered = sorted(keys, key=lambda key: zxy_to_tileid(block_zoom, key[0], key[1]))
+    return ordered[len(ordered) * (index - 1) // count:len(ordered) * index // count]
+
+def bbox_tile_range(west, south, east, north, zoom):
+    """
+    Returns (min_x, min_y, max_x, max_y) of the tiles covering the bbox at zoom,
+    matching the tiles mercantile.tiles() would enumerate.
+    """
+    ul_tile = mercantile.tile(west, north, zoom)
+    lr_tile = mercantile.tile(east - mercantile.LL_EPSILON, south + mercantile.LL_EPSILON, zoom)
+    return ul_tile.x, ul_tile.y, lr_tile.x, lr_tile.y
+
+def child_tiles(parents, parent_zoom, zoom, tile_range):
+    """
+    Top-down step of the pyramid walk: yields the tiles at zoom that descend from
+    one of the (x, y) parents at parent_zoom and lie inside tile_range.
+    """
+    min_x, min_y, max_x, max_y = tile_range
+    shift = zoom - parent_zoom
+    for px, py in parents:
+        for x in range(max(px << shift, min_x), min((px + 1) << shift, max_x + 1)):
+            for y in range(max(py << shift, min_y), min((py + 1) << shift, max_y + 1)):
+                yield mercantile.Tile(x, y, zoom)
+
+def fetch_data_extent(cursor, schema_name, table_name):
+    """Returns the WGS84 (west, south, east, north) extent of a table's geometries, or None if it has none."""
+    query = sql.SQL("""
+        SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (
+            SELECT ST_Extent(ST_Transform(t.geom, 4326)) AS e
+            FROM {schema_name}.{table_name} AS t
+        ) AS extent;
+    """).format(
+        schema_name=sql.Identifier(schema_name),
+        table_name=sql.Identifier(table_name)
+    )
+    cursor.execute(query)
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return tuple(row)
+
+def fetch_coverage_cells(cursor, schema_name, table_name, zoom, subdivide):
+    """
+    Returns the (x, y) tiles at zoom touched by the bounding boxes of a table's
+    geometries. Large geometries are ST_Subdivide'd first (unless the table is
+    a serving copy, which already is), so a long coastline or a sprawling land
+    zone only claims the tiles its pieces actually cover.
+    """
+    geometry = sql.SQL("ST_Transform(t.geom, 3857)")
+    if subdivide:
+        geometry = sql.SQL("ST_Subdivide({}, {})").format(geometry, sql.Literal(DEFAULT_MAX_VERTICES))
+    half_width = WEB_MERCATOR_WIDTH / 2
+    tile_size = WEB_MERCATOR_WIDTH / (1 << zoom)
+    query = sql.SQL("""
+        SELECT DISTINCT x, y
+        FROM (
+            SELECT {geometry}::box2d AS b
+            FROM {schema_name}.{table_name} AS t
+            WHERE t.geom IS NOT NULL
+        ) AS pieces
+        CROSS JOIN LATERAL generate_series(
+            GREATEST(floor((ST_XMin(b) + {half_width}) / {tile_size})::int, 0),
+            LEAST(floor((ST_XMax(b) + {half_width}) / {tile_size})::int, {max_index})
+        ) AS x
+        CROSS JOIN LATERAL generate_series(
+            GREATEST(floor(({half_width} - ST_YMax(b)) / {tile_size})::int, 0),
+            LEAST(floor(({half_width} - ST_YMin(b)) / {tile_size})::int, {max_index})
+        ) AS y;
+    """).format(
+        geometry=geometry,
+        schema_name=sql.Identifier(schema_name),
+        table_name=sql.Identifier(table_name),
+        half_width=sql.Literal(half_width),
+        tile_size=sql.Literal(tile_size),
+        max_index=sql.Literal((1 << zoom) - 1)
+    )
+    cursor.execute(query)
+    return {(x, y) for x, y in cursor.fetchall()}
+
+def coverage_tiles(cells, cells_zoom, zoom, tile_range):
+    """Returns the tiles at zoom (<= cells_zoom, limited to tile_range) that contain one of the cells."""
+    min_x, min_y, max_x, max_y = tile_range
+    shift = cells_zoom - zoom
+    parents = {(x >> shift, y >> shift) for x, y in cells}
+    return [mercantile.Tile(x, y, zoom) for x, y in parents if min_x <= x <= max_x and min_y <= y <= max_y]
+
+def fetch_changed_bounds(cursor, schema_name, table_name, column_name, since):
+    """
+    Returns the WGS84 (west, south, east, north) bounds of every row whose
+    column_name is later than since. Deleted rows leave no trace here, so
+    deletions have to be covered with --dirty-bbox.
+    """
+    query = sql.SQL("""
+        SELECT ST_XMin(b), ST_YMin(b), ST_XMax(b), ST_YMax(b) FROM (
+            SELECT ST_Transform(t.geom, 4326)::box2d AS b
+            FROM {schema_name}.{table_name} AS t
+            WHERE t.{column_name} > %s AND t.geom IS NOT NULL
+        ) AS changed;
+    """).format(
+        schema_name=sql.Identifier(schema_name),
+        table_name=sql.Identifier(table_name),
+        column_name=sql.Identifier(column_name)
+    )
+    cursor.execute(query, (since,))
+    return cursor.fetchall()
+
+def dirty_tiles(dirty_bounds, zoom, tile_range, buffer_fraction):
+    """
+    Returns the tiles at zoom (limited to tile_range) whose rendered area touches
+    any of the dirty WGS84 bounds. Bounds are padded by the MVT buffer (buffer_fraction
+    of a tile width), because a change near a tile edge also shows up in the
+    neighbouring tile's buffer.
+    """
+    min_x, min_y, max_x, max_y = tile_range
+    tile_size_m = 2 * math.pi * 6378137 / (1 << zoom)
+    pad = tile_size_m * buffer_fraction
+    tiles = set()
+    for west, south, east, north in dirty_bounds:
+        left, bottom = mercantile.xy(west, south)
+        right, top = mercantile.xy(east, north)
+        padded_west, padded_south = mercantile.lnglat(left - pad, bottom - pad)
+        padded_east, padded_north = mercantile.lnglat(right + pad, top + pad)
+        x0, y0, x1, y1 = bbox_tile_range(max(padded_west, -180.0), max(padded_south, -85.051129),
+                                         min(padded_east, 180.0), min(padded_north, 85.051129), zoom)
+        for x in range(max(x0, min_x), min(x1, max_x) + 1):
+            for y in range(max(y0, min_y), min(y1, max_y) + 1):
+                tiles.add(mercantile.Tile(x, y, zoom))
+    return list(tiles)
+
+def compress_tile(mvt_data, compression):
+    """Compresses a tile for storage: 'gzip', 'br' (brotli) or 'none'."""
+    if compression == "gzip":
+        return gzip.compress(mvt_data, compresslevel=9, mtime=0)
+    if compression == "br":
+        return brotli.compress(mvt_data, mode=brotli.MODE_GENERIC, quality=11)
+    return mvt_data
+
+def degrade_tile(cur, job, z, x, y):
+    """
+    Re-renders an over-budget tile with the DEGRADE_STEPS ladder until its stored
+    size fits job["max_tile_bytes"]. Returns (mvt_data, step) for the first step
+    that fits, or for the last step when even that is still over budget.
+    """
+    statement_name = sql.Identifier(degraded_statement_name(z))
+    extent = max(profile_rule(job["profiles"], layer["layer"], z)["extent"] for layer in job["layers"])
+    metres_per_unit = WEB_MERCATOR_WIDTH / (1 << z) / extent
+    for step in DEGRADE_STEPS:
+        tolerance_units, keep_share = step
+        cur.execute(
+            sql.SQL("EXECUTE {}(%s, %s, %s, %s, %s)").format(statement_name),
+            (z, x, y, tolerance_units * metres_per_unit, keep_share),
+        )
+        mvt_data = compress_tile(bytes(cur.fetchone()[0] or b""), job["compression"])
+        if len(mvt_data) <= job["max_tile_bytes"]:
+            break
+    return mvt_data, step
+
+def render_block(cur, job, block):
+    """
+    Renders every (z, x, y) in block with the prepared batch statement,
+    sending job["batch_size"] tiles per round trip. Tiles are compressed here,
+    so --workers spreads the compression cost over the worker processes too.
+    Returns (rendered, query_times, degraded): rendered lists (z, x, y, mvt_data,
+    features) for the tiles that intersect at least one feature (mvt_data may
+    still be empty at low zooms); query_times maps every (x, y) of the block to
+    its share of the batch round trip in seconds, or is None unless
+    job["collect_stats"]; degraded lists (z, x, y, original_bytes, final_bytes,
+    step) for every tile shrunk to fit job["max_tile_bytes"].
+    """
+    rendered = []
+    degraded = []
+    query_times = {} if job["collect_stats"] else None
+    batch_size = job["batch_size"]
+    statement_name = sql.Identifier(tile_statement_name(block[0][0])) # A block never spans zooms
+    for start in range(0, len(block), batch_size):
+        batch = block[start:start + batch_size]
+        started = time.perf_counter()
+        cur.execute(
+            sql.SQL("EXECUTE {}(%s, %s, %s)").format(statement_name),
+            ([z for z, _, _ in batch], [x for _, x, _ in batch], [y for _, _, y in batch]),
+        )
+        if query_times is not None:
+            share = (time.perf_counter() - started) / len(batch)
+            for _, x, y in batch:
+                query_times[(x, y)] = share
+        batch_rendered = []
+        for z, x, y, mvt_data, features in cur: # ST_AsMVT returns bytea
+            if features:
+                mvt_data = bytes(mvt_data or b"")
+                if mvt_data:
+                    mvt_data = compress_tile(mvt_data, job["compression"])
+                batch_rendered.append((z, x, y, mvt_data, features))
+            # else:
+                # No data for this tile. The progress bar still advances.
+        for z, x, y, mvt_data, features in batch_rendered:
+            if job["max_tile_bytes"] and len(mvt_data) > job["max_tile_bytes"]:
+                started = time.perf_counter()
+                smaller_data, step = degrade_tile(cur, job, z, x, y)
+                if query_times is not None:
+                    query_times[(x, y)] += time.perf_counter() - started
+                degraded.append((z, x, y, len(mvt_data), len(smaller_data), step))
+                mvt_data = smaller_data
+            rendered.append((z, x, y, mvt_data, features))
+    return rendered, query_times, degraded
+
+# Per-process state for --workers mode: every worker process owns exactly one
+# database connection, opened once by init_worker and reused for all its blocks.
+_worker_conn = None
+_worker_cur = None
+_worker_job = None
+
+def init_worker(conn_kwargs, layer_specs, options):
+    """Pool initializer: opens this worker's connection and prepares its tile statement."""
+    global _worker_conn, _worker_cur, _worker_job
+    try:
+        _worker_conn = psycopg2.connect(**conn_kwargs)
+        _worker_cur = _worker_conn.cursor()
+        _worker_job = build_job(_worker_cur, layer_specs, options)
+        prepare_tile_statements(_worker_cur, _worker_job)
+    except psycopg2.Error as e:
+        # Raising here would make the pool respawn the worker forever;
+        # report the failure through the first task instead.
+        _worker_job = e
+
+def render_block_in_worker(block):
+    """Pool task: renders one block on the worker's own connection."""
+    if isinstance(_worker_job, Exception):
+        raise RuntimeError(f"Worker could not connect to the database: {_worker_job}")
+    return (block,) + render_block(_worker_cur, _worker_job, block)
+
+def pyramid_layer_rules(job, zoom):
+    """Maps every layer name to (profile rule at zoom, has a real id, priority column) for merge_child_tiles."""
+    return {
+        layer["layer"]: (profile_rule(job["profiles"], layer["layer"], zoom),
+                         layer["printable_columns"][0] != "id (dummy)", layer["priority"])
+        for layer in job["layers"]
+    }
+
+def merge_block(scratch, job, block):
+    """
+    --engine bottom-up counterpart of render_block: builds every (z, x, y) in
+    block from its four children in the pyramid scratch store instead of
+    querying PostGIS. Over-budget tiles are rebuilt with the DEGRADE_STEPS
+    ladder. Returns the same (rendered, query_times, degraded) triple, with the
+    merge time of each tile in query_times.
+    """
+    rendered = []
+    degraded = []
+    query_times = {} if job["collect_stats"] else None
+    layer_rules = pyramid_layer_rules(job, block[0][0]) # A block never spans zooms
+    for z, x, y in block:
+        started = time.perf_counter()
+        children = [(dx, dy, decode_stored_tile(data, job["compression"]))
+                    for dx, dy, data in scratch.children(z, x, y)]
+        raw, features = merge_child_tiles(children, z, layer_rules)
+        if features:
+            mvt_data = compress_tile(raw, job["compression"])
+            if job["max_tile_bytes"] and len(mvt_data) > job["max_tile_bytes"]:
+                for step in DEGRADE_STEPS:
+                    smaller_raw, _ = merge_child_tiles(children, z, layer_rules, *step)
+                    smaller_data = compress_tile(smaller_raw, job["compression"]) if smaller_raw else b""
+                    if len(smaller_data) <= job["max_tile_bytes"]:
+                        break
+                degraded.append((z, x, y, len(mvt_data), len(smaller_data), step))
+                mvt_data = smaller_data
+            rendered.append((z, x, y, mvt_data, features))
+        if query_times is not None:
+            query_times[(x, y)] = time.perf_counter() - started
+    return rendered, query_times, degraded
+
+_worker_scratch = None # Opened on the first merge task (--engine bottom-up)
+
+def merge_block_in_worker(block):
+    """Pool task: merges one block from the pyramid scratch store."""
+    global _worker_scratch
+    if isinstance(_worker_job, Exception):
+        raise RuntimeError(f"Worker could not connect to the database: {_worker_job}")
+    if _worker_scratch is None:
+        _worker_scratch = PyramidScratch(_worker_job["scratch_path"])
+    return (block,) + merge_block(_worker_scratch, _worker_job, block)
+
 def main():
     parser = argparse.ArgumentParser(description="Generate Mapbox Vector Tiles from PostGIS.")
     parser.add_argument("--dbname", required=True, help="Database name")
     parser.add_argument("--user", required=True, help="Database user")
     parser.add_argument("--password", required=True, help="Database password")
-    parser.add_argument("--schema", required=True, help="Database schema (e.g., public)")
-    parser.add_argument("--table", required=True, help="Table name to extract data from")
-    parser.add_argument("--layer", required=True, help="Layer name for the MVT (will be used for folder and MVT layer name)")
-    parser.add_argument("--bbox", nargs=4, type=float, required=True,
-                        help="Bounding box in WGS84: top_left_long top_left_lat bottom_right_long bottom_right_lat") # Updated help text
+    parser.add_argument("--schema", help="Database schema (e.g., public)")
+    parser.add_argument("--table", help="Table name to extract data from")
+    parser.add_argument("--layer", help="Layer name for the MVT (will be used for folder and MVT layer name)")
+    parser.add_argument("--layers", nargs='+', type=parse_layer_spec, default=None,
+                        help="Several layers in one composite tile, as schema.table[:layer] specs "
+                             "(e.g., public.nsw_roads:nsw_roads public.nsw_lots:nsw_lots)")
+    parser.add_argument("--tileset", type=str, default=None,
+                        help="Output tileset name used for the folder/archive (default: the layer name, or 'composite' for --layers)")
+    parser.add_argument("--bbox", nargs=4, type=float, default=None,
+                        help="Bounding box in WGS84: top_left_long top_left_lat bottom_right_long bottom_right_lat "
+                             "(required unless --coverage is given; with --coverage it clips the coverage)") # Updated help text
+    parser.add_argument("--coverage", choices=["extent", "cells"], default=None,
+                        help="Derive the tiles from the data instead of the bbox: 'extent' uses the layers' data extent, "
+                             "'cells' the tiles touched by the (subdivided) geometries at the max zoom, with the lower "
+                             "zooms derived from them")
     parser.add_argument("--zoom", nargs='+', type=int, required=True,
                         help="Space-separated list of zoom levels to generate (e.g., 4 5 6)")
     parser.add_argument("--port", type=int, default=5432, help="Database port (default: 5432)")
     parser.add_argument("--host", type=str, default="localhost", help="Database host (default: localhost)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, each with its own database connection (default: 1)")
+    parser.add_argument("--block-size", type=int, default=16,
+                        help="Width in tiles of the square tile blocks handed to each worker (default: 16)")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Tiles rendered per database round trip (default: 32)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Generate only shard i of N (e.g. 2/4): each zoom's blocks are ordered along a Hilbert "
+                             "curve and split into N equal contiguous ranges; combine the outputs with 'merge'")
+    parser.add_argument("--prune", action="store_true",
+                        help="Walk the tile pyramid top-down and skip the subtree of every tile without features")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="Checkpoint file; an interrupted run started with the same arguments resumes from it")
+    parser.add_argument("--dirty-bbox", nargs=4, type=float, default=None,
+                        help="Incremental mode: only regenerate tiles touching this WGS84 box "
+                             "(top_left_long top_left_lat bottom_right_long bottom_right_lat)")
+    parser.add_argument("--changed-since", type=str, default=None,
+                        help="Incremental mode: only regenerate tiles touching rows whose --updated-column is later than this timestamp")
+    parser.add_argument("--updated-column", type=str, default="updated_at",
+                        help="Timestamp column used by --changed-since (default: updated_at)")
+    parser.add_argument("--compress", choices=["none", "gzip", "br"], default="none",
+                        help="Store tiles pre-compressed (default: none). gzip tiles are recognised by any tile "
+                             "server; br tiles need a server that reads the tileset metadata or an archive")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="JSON/YAML generalization profile: per layer and zoom range, the columns, simplification "
+                             "tolerance, minimum area/length and MVT extent/buffer (see tile_profiles.py)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Store byte-identical tiles once (MBTiles images/map schema, PMTiles shared offsets, "
+                             "hardlinks in directory output) and report the dedup ratio")
+    parser.add_argument("--stats", type=str, default=None,
+                        help="Record query time, write time, size and feature count of every tile to this JSON file "
+                             "and print per-zoom percentiles with the slowest and largest tiles")
+    parser.add_argument("--stats-top", type=int, default=10,
+                        help="Number of slowest / largest tiles listed by --stats (default: 10)")
+    parser.add_argument("--max-tile-bytes", type=int, default=None,
+                        help="Byte budget per stored tile: larger tiles are re-rendered with coarser simplification "
+                             "and feature thinning until they fit, and each degraded tile is logged")
+    parser.add_argument("--priority-column", type=str, default=None,
+                        help="Column ranking features for thinning under --max-tile-bytes (highest kept first; "
+                             "default: largest area/length first)")
+    parser.add_argument("--no-serving-copy", action="store_true",
+                        help="Read from the source tables even where a serving copy built by 'prepare' exists")
+    parser.add_argument("--writer-threads", type=int, default=1,
+                        help="Threads writing rendered tiles while the next blocks are fetched (default: 1; "
+                             "more than one needs a dir output)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"Rendered blocks that may wait for a writer before fetching pauses (default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--engine", choices=["postgis", "bottom-up"], default="postgis",
+                        help="postgis: query every zoom from the database (default); bottom-up: query only --base-zoom "
+                             "and build each lower zoom by merging and generalizing the four child tiles")
+    parser.add_argument("--base-zoom", type=int, default=None,
+                        help="Zoom queried from the database by --engine bottom-up (default: the highest --zoom); "
+                             "zooms between it and the requested ones are built but not written")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output target: dir:<path>, mbtiles:<path> or pmtiles:<path> (default: tiles/<tileset> directory)")
 
     args = parser.parse_args()
 
+    if args.layers:
+        if args.schema or args.table:
+            parser.error("use either --layers or --schema/--table/--layer, not both")
+        layer_specs = args.layers
+    elif args.schema and args.table and args.layer:
+        layer_specs = [(args.schema, args.table, args.layer)]
+    else:
+        parser.error("--schema, --table and --layer are required unless --layers is given")
+    layer_names = [layer_name for _, _, layer_name in layer_specs]
+    if len(set(layer_names)) != len(layer_names):
+        parser.error("layer names must be unique within a tileset")
+    if args.tileset:
+        tileset_name = args.tileset
+    elif len(layer_specs) == 1:
+        tileset_name = layer_specs[0][2]
+    else:
+        tileset_name = "composite"
+
+    profiles = {}
+    if args.profile:
+        try:
+            profiles = load_profiles(args.profile)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.block_size < 1:
+        parser.error("--block-size must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.writer_threads < 1:
+        parser.error("--writer-threads must be at least 1")
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if args.max_tile_bytes is not None and args.max_tile_bytes < 1:
+        parser.error("--max-tile-bytes must be at least 1")
+    incremental = args.dirty_bbox is not None or args.changed_since is not None
+    if incremental and args.prune:
+        parser.error("--prune cannot be combined with incremental mode (emptied tiles must be deleted)")
+    if args.bbox is None and args.coverage is None:
+        parser.error("--bbox is required unless --coverage is given")
+    if args.shard and args.prune:
+        parser.error("--prune cannot be combined with --shard (a shard does not see the other shards' parent tiles)")
+    if incremental and args.coverage:
+        parser.error("--coverage cannot be combined with incremental mode (the changed rows define the tiles)")
+    bottom_up = args.engine == "bottom-up"
+    if args.base_zoom is not None and not bottom_up:
+        parser.error("--base-zoom needs --engine bottom-up")
+    if bottom_up:
+        if args.base_zoom is None:
+            args.base_zoom = max(args.zoom)
+        if args.base_zoom < max(args.zoom):
+            parser.error("--base-zoom must be at least the highest --zoom")
+        if args.prune or incremental or args.checkpoint or args.shard:
+            parser.error("--engine bottom-up cannot be combined with --prune, incremental mode, --checkpoint "
+                         "or --shard (every level is built from the complete level below it)")
+        for layer_name, rules in profiles.items():
+            for rule in rules:
+                if any(aggregate not in PYRAMID_SUMMARY_AGGREGATES for aggregate in rule.get("cluster_summary", {}).values()):
+                    parser.error(f"--engine bottom-up can only rebuild {', '.join(PYRAMID_SUMMARY_AGGREGATES)} "
+                                 f"cluster_summary aggregates from child tiles (layer '{layer_name}')")
+    # Zooms queried from the database; the bottom-up engine merges every level below its base zoom
+    query_zooms = [args.base_zoom] if bottom_up else sorted(set(args.zoom))
+    top_zoom = query_zooms[-1]
+
     # Parse bounding box according to the new convention: top_left_long top_left_lat bottom_right_long bottom_right_lat
-    top_left_long, top_left_lat, bottom_right_long, bottom_right_lat = args.bbox
+    # (without --bbox, --coverage starts from the whole Web Mercator world)
+    top_left_long, top_left_lat, bottom_right_long, bottom_right_lat = args.bbox or (-180.0, 85.051129, 180.0, -85.051129)
 
     # mercantile.tiles expects (west, south, east, north)
     # Map the input values to mercantile's expected order
@@ -104,149 +958,481 @@ def main():
     min_lat_merc = bottom_right_lat  # South is bottom_right_lat
     max_lat_merc = top_left_lat      # North is top_left_lat
 
+    conn_kwargs = {
+        "dbname": args.dbname,
+        "user": args.user,
+        "password": args.password,
+        "host": args.host,
+        "port": args.port,
+    }
+
     conn = None
+    pool = None
+    writer = None
+    checkpoint = None
+    scratch = None
+    stop_feeding = threading.Event() # Stops handing blocks to the worker pool
     try:
         # Establish database connection
         print("="*50)
         print(f"Connecting to database: {args.dbname} as user: {args.user} on port: {args.port}...")
-        conn = psycopg2.connect(
-            dbname=args.dbname,
-            user=args.user,
-            password=args.password,
-            host=args.host,
-            port=args.port
-        )
+        conn = psycopg2.connect(**conn_kwargs)
         cur = conn.cursor()
         print("Database connection successful. [✓]")
 
-        # Dynamically get column names from the table
-        print(f"Fetching column names for {args.schema}.{args.table}...")
-        columns_to_include = get_table_columns(cur, args.schema, args.table)
-        
-        # Ensure 'id' is selected if it exists, otherwise use a placeholder.
-        # If your table has a unique ID column, it's best to use that as the MVT 'id'.
-        # Assuming 'id' or 'gid' is commonly used as a primary key.
-        # You might need to adjust this logic based on your actual table's ID column name.
-        mvt_id_column_select = ""
-        id_column_name_for_print = "id" # Default for printing
-        if 'id' in columns_to_include:
-            mvt_id_column_select = sql.SQL("t.id AS id")
-            columns_to_include.remove('id') # Remove to avoid duplicate selection if 'id' is desired as MVT feature ID
-        elif 'gid' in columns_to_include: # Common alternative for ID
-            mvt_id_column_select = sql.SQL("t.gid AS id")
-            columns_to_include.remove('gid')
-            id_column_name_for_print = "gid" # Update for printing
-        else:
-            mvt_id_column_select = sql.SQL("1 AS id") # Fallback to dummy ID if no id/gid found
-            id_column_name_for_print = "id (dummy)" # Update for printing dummy id
+        if bottom_up:
+            scratch = PyramidScratch()
+            print(f"Bottom-up pyramid: querying zoom {args.base_zoom}"
+                  + (f", merging zooms {args.base_zoom - 1} to {min(args.zoom)}" if args.base_zoom > min(args.zoom) else "")
+                  + f" (scratch {scratch.path})")
 
-        # Construct the comma-separated list of columns for the SQL query
-        # Using sql.Identifier to safely quote column names
-        properties_select_list = sql.SQL(', ').join(
-            [sql.SQL("t.{}").format(sql.Identifier(col)) for col in columns_to_include]
-        )
-        
-        # Combine geometry, ID, and other properties
-        if properties_select_list.as_string(conn) == '': # Check if properties_select_list is empty
-             final_select_list = sql.SQL("""
-                ST_AsMVTGeom(
-                    t.geom,
-                    bounds.geom,
-                    4096,
-                    256,
-                    true
-                ) AS geom,
-                {}
-            """).format(mvt_id_column_select)
-        else:
-            final_select_list = sql.SQL("""
-                ST_AsMVTGeom(
-                    t.geom,
-                    bounds.geom,
-                    4096,
-                    256,
-                    true
-                ) AS geom,
-                {},
-                {}
-            """).format(mvt_id_column_select, properties_select_list)
-
-        # Corrected print statement: construct a list of strings for display
-        printable_columns = [id_column_name_for_print] + [col for col in columns_to_include if col != 'geom']
-        print(f"Columns to be included in MVT properties: {', '.join(printable_columns)}")
+        # Dynamically get column names from each table
+        render_options = {
+            "zooms": query_zooms,
+            "profiles": profiles,
+            "batch_size": args.batch_size,
+            "compression": args.compress,
+            "collect_stats": args.stats is not None,
+            "max_tile_bytes": args.max_tile_bytes,
+            "priority_column": args.priority_column,
+            "use_serving_copy": not args.no_serving_copy,
+            "scratch_path": scratch.path if scratch is not None else None,
+        }
+        job = build_job(cur, layer_specs, render_options)
+        for layer in job["layers"]:
+            print(f"Columns to be included in MVT properties of {layer['schema']}.{layer['table']} "
+                  f"(layer {layer['layer']}): {', '.join(layer['printable_columns'])}")
+            if layer["relation"] != layer["table"]:
+                print(f"Reading {layer['layer']} tiles from serving copy {layer['schema']}.{layer['relation']}")
+                if incremental:
+                    print(f"[WARNING] Incremental run reads the serving copy; re-run prepare for "
+                          f"{layer['schema']}.{layer['table']} first so it holds the changed rows")
+            if layer["layer"] in profiles:
+                print(f"Generalization profile for {layer['layer']}: {len(profiles[layer['layer']])} zoom range(s)")
+            if args.max_tile_bytes:
+                print(f"Tile budget for {layer['layer']}: {args.max_tile_bytes} bytes, thinning by "
+                      + (f"{layer['priority']}" if layer["priority"] else "area/length"))
         print("="*50)
+        prepare_tile_statements(cur, job)
+
+        coverage_cells = None # (x, y) at the max zoom touched by data (--coverage cells)
+        requested_bounds = (min_lon_merc, min_lat_merc, max_lon_merc, max_lat_merc) # Skipped tiles are counted against these
+        if args.coverage:
+            extents = [extent for extent in (fetch_data_extent(cur, layer["schema"], layer["relation"])
+                                             for layer in job["layers"]) if extent is not None]
+            if not extents:
+                raise ValueError("--coverage found no geometries in the layers")
+            # Shrink the bbox to the data extent
+            min_lon_merc = max(min_lon_merc, min(extent[0] for extent in extents))
+            min_lat_merc = max(min_lat_merc, min(extent[1] for extent in extents))
+            max_lon_merc = min(max_lon_merc, max(extent[2] for extent in extents))
+            max_lat_merc = min(max_lat_merc, max(extent[3] for extent in extents))
+            if min_lon_merc >= max_lon_merc or min_lat_merc >= max_lat_merc:
+                raise ValueError("--coverage: the data extent does not overlap --bbox")
+            print(f"Coverage: data extent {min_lon_merc:.5f} {min_lat_merc:.5f} {max_lon_merc:.5f} {max_lat_merc:.5f}")
+            if args.coverage == "cells":
+                coverage_cells = set()
+                for layer in job["layers"]:
+                    coverage_cells |= fetch_coverage_cells(cur, layer["schema"], layer["relation"], top_zoom,
+                                                           subdivide=layer["relation"] == layer["table"])
+                print(f"Coverage: {len(coverage_cells)} tiles at zoom {top_zoom} touch data")
+            print("="*50)
 
+        metadata = {
+            "name": tileset_name,
+            "bounds": (min_lon_merc, min_lat_merc, max_lon_merc, max_lat_merc),
+            "minzoom": min(args.zoom),
+            "maxzoom": max(args.zoom),
+            "compression": args.compress,
+            "dedup": args.dedup,
+            "vector_layers": [
+                describe_vector_layer(cur, schema_name, table_name, layer_name, min(args.zoom), max(args.zoom),
+                                      profiles)
+                for schema_name, table_name, layer_name in layer_specs
+            ],
+        }
 
         base_tiles_dir = "tiles"
-        layer_tiles_dir = os.path.join(base_tiles_dir, args.layer)
-        os.makedirs(layer_tiles_dir, exist_ok=True)
-        print(f"Output directory ensured: {os.path.abspath(layer_tiles_dir)}")
+        layer_tiles_dir = os.path.join(base_tiles_dir, tileset_name)
+        writer = open_tile_writer(args.output, layer_tiles_dir, dedup=args.dedup)
+        print(f"Output ensured: {writer}")
+        if (incremental or args.checkpoint) and not writer.supports_updates:
+            raise ValueError(f"Incremental and resumable runs need a dir or mbtiles output, not a {writer}")
+        if args.writer_threads > 1 and not writer.concurrent_writes:
+            raise ValueError(f"Several --writer-threads need a dir output; a {writer} takes one writer thread")
+
+        dirty_bounds = []
+        if incremental:
+            if args.dirty_bbox is not None:
+                dirty_left, dirty_top, dirty_right, dirty_bottom = args.dirty_bbox
+                dirty_bounds.append((dirty_left, dirty_bottom, dirty_right, dirty_top))
+            if args.changed_since is not None:
+                for schema_name, table_name, _ in layer_specs:
+                    changed = fetch_changed_bounds(cur, schema_name, table_name, args.updated_column, args.changed_since)
+                    print(f"Rows of {schema_name}.{table_name} changed since {args.changed_since}: {len(changed)}")
+                    dirty_bounds.extend(changed)
+
+        if args.checkpoint:
+            checkpoint = TileCheckpoint(args.checkpoint, {
+                "layers": [list(spec) for spec in layer_specs], "tileset": tileset_name,
+                "bbox": args.bbox, "coverage": args.coverage, "shard": args.shard, "zoom": sorted(set(args.zoom)), "output": args.output,
+                "prune": args.prune, "dirty_bbox": args.dirty_bbox,
+                "changed_since": args.changed_since, "compress": args.compress, "dedup": args.dedup,
+                "profiles": profiles, "max_tile_bytes": args.max_tile_bytes,
+                "priority_column": args.priority_column,
+            })
+            print(f"Checkpoint: {os.path.abspath(args.checkpoint)}")
+
+        if args.workers > 1:
+            # "spawn" keeps the parent's open connection out of the workers.
+            print(f"Starting {args.workers} worker processes (one database connection each)...")
+            pool = multiprocessing.get_context("spawn").Pool(
+                processes=args.workers,
+                initializer=init_worker,
+                initargs=(conn_kwargs, layer_specs, render_options),
+            )
         print("="*50)
 
-        for zoom in sorted(args.zoom):
-            # print(f"\n--- Generating tiles for zoom level: {zoom} ---")
-            zoom_dir = os.path.join(layer_tiles_dir, str(zoom))
-            os.makedirs(zoom_dir, exist_ok=True)
-            # print(f"Zoom level directory ensured: {zoom_dir}")
+        occupied = None # (x, y) of the previous zoom's tiles that intersect features (--prune)
+        previous_zoom = None
+        total_bbox_tiles = 0
+        queries_saved = 0
+        stats = TileStats() if render_options["collect_stats"] else None
+        state_lock = threading.Lock() # Guards occupied, stats, checkpoint marks and counters across writer threads
+        degraded_count = 0
+        over_budget_count = 0
+        output_zooms = set(args.zoom)
+        merged_tiles = 0
+
+        # Bottom-up runs descend from the base zoom so every level's children exist before it is merged
+        zoom_levels = range(args.base_zoom, min(args.zoom) - 1, -1) if bottom_up else sorted(output_zooms)
+        for zoom in zoom_levels:
+            merged = bottom_up and zoom < args.base_zoom
+            keep_level = bottom_up and zoom > min(args.zoom) # Its tiles are the children of the next level
+            tile_range = bbox_tile_range(min_lon_merc, min_lat_merc, max_lon_merc, max_lat_merc, zoom)
+            requested_range = bbox_tile_range(*requested_bounds, zoom)
+            bbox_tiles = (requested_range[2] - requested_range[0] + 1) * (requested_range[3] - requested_range[1] + 1)
+            if not merged:
+                total_bbox_tiles += bbox_tiles
+
+            if merged:
+                # The parents of the level below that has data; no query at all
+                tiles_to_process = [mercantile.Tile(x, y, zoom) for x, y in scratch.parents(zoom + 1)
+                                    if tile_range[0] <= x <= tile_range[2] and tile_range[1] <= y <= tile_range[3]]
+            elif incremental:
+                # Only the tiles the changed geometries touch
+                buffer_fraction = max(rule["buffer"] / rule["extent"] for rule in
+                                      (profile_rule(profiles, name, zoom) for name in layer_names))
+                tiles_to_process = dirty_tiles(dirty_bounds, zoom, tile_range, buffer_fraction)
+            elif coverage_cells is not None:
+                # Only tiles containing a max-zoom cell with data
+                tiles_to_process = coverage_tiles(coverage_cells, top_zoom, zoom, tile_range)
+                if args.prune and occupied is not None:
+                    shift = zoom - previous_zoom
+                    tiles_to_process = [tile for tile in tiles_to_process
+                                        if (tile.x >> shift, tile.y >> shift) in occupied]
+            elif args.prune and occupied is not None:
+                # Only descend into parents that had features; everything else is known empty
+                tiles_to_process = list(child_tiles(occupied, previous_zoom, zoom, tile_range))
+            else:
+                # Every tile of the bbox, enumerated lazily block by block below
+                tiles_to_process = None
+            if tiles_to_process is None:
+                block_keys = range_block_keys(tile_range, args.block_size)
+                candidate_count = (tile_range[2] - tile_range[0] + 1) * (tile_range[3] - tile_range[1] + 1)
+            else:
+                grouped_blocks = group_into_blocks(tiles_to_process, args.block_size)
+                block_keys = sorted(grouped_blocks)
+                candidate_count = len(tiles_to_process)
+            if (args.prune or args.coverage) and not merged:
+                queries_saved += bbox_tiles - candidate_count
+            occupied = set()
+            previous_zoom = zoom
+
+            if args.shard:
+                block_keys = shard_block_keys(block_keys, zoom, args.block_size, args.shard)
+            if tiles_to_process is None:
+                planned = sum(range_block_count(key, tile_range, args.block_size) for key in block_keys)
+            else:
+                planned = sum(len(grouped_blocks[key]) for key in block_keys)
+
+            resumed = 0
+            done = checkpoint.done_tiles(zoom) if checkpoint is not None else {}
+            if done:
+                occupied.update(tile for tile, features in done.items() if features)
+                selected_keys = set(block_keys)
+                resumed = sum(1 for x, y in done if (x // args.block_size, y // args.block_size) in selected_keys)
+
+            def pending_blocks():
+                """Yields the blocks still to render, generating bbox blocks only when they are reached."""
+                for key in block_keys:
+                    if tiles_to_process is None:
+                        block = range_block_tiles(key, zoom, tile_range, args.block_size)
+                    else:
+                        block = grouped_blocks[key]
+                    if done:
+                        block = [tile for tile in block if (tile[1], tile[2]) not in done]
+                    if block:
+                        yield block
 
-            # Use mercantile.tiles to get all tiles within the bbox for the current zoom
-            tiles_to_process = list(mercantile.tiles(min_lon_merc, min_lat_merc, max_lon_merc, max_lat_merc, zoom))
-            print(f"Zoom: {zoom} - Tiles: {len(tiles_to_process)}")
+            blocks = pending_blocks()
+            print(f"Zoom: {zoom} - Tiles: {planned - resumed} of {bbox_tiles} - Blocks: {len(block_keys)}"
+                  + (f" - Shard {args.shard[0]}/{args.shard[1]}" if args.shard else "")
+                  + (f" - Resumed: {resumed} already done" if resumed else "")
+                  + (f" - Merged from zoom {zoom + 1}" if merged else "")
+                  + ("" if zoom in output_zooms else " - Not written"))
+            if merged:
+                merged_tiles += planned
 
             tile_count = 0
-            # Wrap the tile iteration with tqdm for a progress bar
-            for tile in tqdm(tiles_to_process, desc=f"Generating Z{zoom} tiles", unit="tile"):
-                x, y, z = tile.x, tile.y, tile.z # mercantile.Tile objects have x, y, z attributes
-
-                x_dir = os.path.join(zoom_dir, str(x))
-                os.makedirs(x_dir, exist_ok=True)
-
-                tile_path = os.path.join(x_dir, f"{y}.pbf")
-
-                # Construct the SQL query for ST_AsMVT
-                # Using ST_TileEnvelope({z}, {x}, {y}) without explicit margin or SRID
-                # This function returns geometry in SRID 3857 (Web Mercator)
-                query = sql.SQL("""
-                    SELECT ST_AsMVT(tile_data, {layer_name}, 4096, 'geom') FROM (
-                        WITH bounds AS (
-                            SELECT ST_TileEnvelope({z}, {x}, {y}) AS geom
-                        )
-                        SELECT
-                            {final_select_list}
-                        FROM {schema_name}.{table_name} AS t, bounds
-                        WHERE ST_Intersects(t.geom, bounds.geom)
-                    ) AS tile_data;
-                """).format(
-                    layer_name=sql.Literal(args.layer),
-                    z=sql.Literal(z),
-                    x=sql.Literal(x),
-                    y=sql.Literal(y),
-                    final_select_list=final_select_list,
-                    schema_name=sql.Identifier(args.schema),
-                    table_name=sql.Identifier(args.table)
-                )
-
-                cur.execute(query)
-                mvt_data = cur.fetchone()[0] # ST_AsMVT returns bytea
+            # A single progress bar per zoom, advanced as blocks finish in any worker
+            with tqdm(total=planned - resumed, desc=f"{'Merging' if merged else 'Generating'} Z{zoom} tiles",
+                      unit="tile") as progress:
 
-                if mvt_data:
-                    with open(tile_path, "wb") as f:
-                        f.write(mvt_data)
-                    tile_count += 1
-                # else:
-                    # No data for this tile. The progress bar still advances.
+                def handle_block(result):
+                    """Writer thread: writes one rendered block, then records it under the state lock."""
+                    nonlocal tile_count, degraded_count, over_budget_count
+                    block, rendered, query_times, degraded = result
+                    write_times = {}
+                    written = block[0][0] in output_zooms # Bottom-up runs also build zooms that are not requested
+                    for z, x, y, mvt_data, _ in rendered:
+                        if mvt_data and keep_level:
+                            scratch.put(z, x, y, mvt_data)
+                        if mvt_data and written:
+                            write_started = time.perf_counter()
+                            writer.write(z, x, y, mvt_data)
+                            write_times[(x, y)] = time.perf_counter() - write_started
+
+                    with state_lock:
+                        for z, x, y, original_bytes, final_bytes, (tolerance_units, keep_share) in degraded:
+                            degraded_count += 1
+                            fits = final_bytes <= args.max_tile_bytes
+                            if not fits:
+                                over_budget_count += 1
+                            progress.write(f"[DEGRADED] {z}/{x}/{y}: {original_bytes / 1024:.1f} KiB -> "
+                                           f"{final_bytes / 1024:.1f} KiB (simplify {tolerance_units} units, "
+                                           f"kept {keep_share:.0%} of features)"
+                                           + ("" if fits else " - still over budget"))
+                        for z, x, y, mvt_data, features in rendered:
+                            occupied.add((x, y))
+                            if stats is not None and written:
+                                stats.record(z, x, y, query_times[(x, y)], write_times.get((x, y), 0.0),
+                                             len(mvt_data), features)
+                            if mvt_data and written:
+                                tile_count += 1
+                            if checkpoint is not None:
+                                checkpoint.mark(z, x, y, features)
+                        for z, x, y in block:
+                            if (x, y) in write_times:
+                                continue
+                            if incremental:
+                                # The tile may have had data before this change
+                                writer.delete(z, x, y)
+                            if stats is not None and written and (x, y) not in occupied:
+                                stats.record(z, x, y, query_times[(x, y)], 0.0, 0, 0)
+                            if checkpoint is not None and (x, y) not in occupied:
+                                checkpoint.mark(z, x, y, 0)
+                        if checkpoint is not None and checkpoint.pending >= CHECKPOINT_INTERVAL:
+                            writer.flush()
+                            checkpoint.commit()
+                        progress.update(len(block))
+
+                # Rendering (here or in the worker pool) feeds a bounded queue drained by the writer threads
+                pipeline = WriterPipeline(handle_block, args.writer_threads, args.queue_size)
+                try:
+                    if pool is not None:
+                        slots = threading.Semaphore(args.queue_size)
+                        task = merge_block_in_worker if merged else render_block_in_worker
+                        for result in pool.imap_unordered(task, throttled(blocks, slots, stop_feeding)):
+                            slots.release()
+                            pipeline.put(result)
+                    else:
+                        for block in blocks:
+                            if merged:
+                                pipeline.put((block,) + merge_block(scratch, job, block))
+                            else:
+                                pipeline.put((block,) + render_block(cur, job, block))
+                finally:
+                    # Also on errors and Ctrl-C: everything already rendered still gets written
+                    pipeline.close()
+                pipeline.check()
 
+            writer.flush()
+            if checkpoint is not None:
+                checkpoint.commit()
+            if scratch is not None:
+                scratch.commit()
+                if merged:
+                    scratch.drop_level(zoom + 1)
             # print(f"--- Completed zoom {zoom}: Generated {tile_count} tiles. ---")
 
+        writer.close(metadata)
+        print("Tileset written. [✓]")
+        if args.dedup:
+            print(writer.dedup_summary())
+        writer = None
+        if checkpoint is not None:
+            checkpoint.remove()
+            checkpoint = None
+        if args.max_tile_bytes:
+            print(f"Tile budget: {degraded_count} tiles degraded, {over_budget_count} still over "
+                  f"{args.max_tile_bytes} bytes at the coarsest setting.")
+        if stats is not None:
+            stats.save(args.stats)
+            stats.print_report(args.stats_top)
+            print(f"Tile statistics written to {os.path.abspath(args.stats)}")
+        if args.prune or args.coverage:
+            saved_share = queries_saved / total_bbox_tiles * 100 if total_bbox_tiles else 0.0
+            skipped_by = " and ".join(name for name, used in (("pruning", args.prune), ("coverage", args.coverage)) if used)
+            print(f"Skipped {queries_saved} of {total_bbox_tiles} tile queries ({saved_share:.1f}%) by {skipped_by}.")
+        if bottom_up and args.base_zoom > min(args.zoom):
+            print(f"Bottom-up pyramid: {merged_tiles} tiles of zooms {min(args.zoom)}-{args.base_zoom - 1} "
+                  f"merged from their children without a database query.")
+
     except psycopg2.Error as e:
         print(f"\n[ERROR] Database error: {e}")
+    except KeyboardInterrupt:
+        print("\n[INTERRUPTED] Stopped; tiles rendered so far have been written and flushed.")
+        if checkpoint is not None:
+            print("Run the same command again to resume from the checkpoint.")
     except Exception as e:
         print(f"\n[ERROR] An unexpected error occurred: {e}")
     finally:
+        stop_feeding.set()
+        if writer is not None:
+            writer.abort()
+            if checkpoint is not None:
+                # abort() flushed the writer, so the pending marks are safe to record
+                checkpoint.commit()
+        if checkpoint is not None:
+            checkpoint.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if scratch is not None:
+            scratch.remove()
         if conn:
             conn.close()
             print("\nDatabase connection closed. [✓]")
             print("="*50)
 
+def prepare_main(argv):
+    """
+    "postgis2mvt.py prepare": builds the serving copy (<table>_mvt: EPSG:3857 geometry,
+    ST_Subdivide'd lines and polygons, GiST index, CLUSTERed, plus each whole feature
+    for simplified zooms) of each table. Later tile runs read from it automatically.
+    """
+    parser = argparse.ArgumentParser(prog="postgis2mvt.py prepare",
+                                     description="Build serving copies of PostGIS tables for tile generation.")
+    parser.add_argument("--dbname", required=True, help="Database name")
+    parser.add_argument("--user", required=True, help="Database user")
+    parser.add_argument("--password", required=True, help="Database password")
+    parser.add_argument("--schema", help="Database schema (e.g., public)")
+    parser.add_argument("--table", help="Table to prepare")
+    parser.add_argument("--layers", nargs='+', type=parse_layer_spec, default=None,
+                        help="Several tables as schema.table[:layer] specs (the layer part is ignored)")
+    parser.add_argument("--port", type=int, default=5432, help="Database port (default: 5432)")
+    parser.add_argument("--host", type=str, default="localhost", help="Database host (default: localhost)")
+    parser.add_argument("--max-vertices", type=int, default=DEFAULT_MAX_VERTICES,
+                        help=f"ST_Subdivide vertex limit per piece (default: {DEFAULT_MAX_VERTICES})")
+    args = parser.parse_args(argv)
+
+    if args.layers:
+        tables = [(schema_name, table_name) for schema_name, table_name, _ in args.layers]
+    elif args.schema and args.table:
+        tables = [(args.schema, args.table)]
+    else:
+        parser.error("--schema and --table are required unless --layers is given")
+    if args.max_vertices < 8:
+        parser.error("--max-vertices must be at least 8 (ST_Subdivide's minimum)")
+
+    conn = None
+    try:
+        print("="*50)
+        print(f"Connecting to database: {args.dbname} as user: {args.user} on port: {args.port}...")
+        conn = psycopg2.connect(dbname=args.dbname, user=args.user, password=args.password,
+                                host=args.host, port=args.port)
+        cur = conn.cursor()
+        print("Database connection successful. [✓]")
+        print("="*50)
+        for schema_name, table_name in tables:
+            print(f"Preparing serving copy of {schema_name}.{table_name}...")
+            columns = get_table_columns(cur, schema_name, table_name)
+            row_count = build_serving_copy(cur, schema_name, table_name, columns, args.max_vertices)
+            conn.commit()
+            print(f"Serving copy {schema_name}.{serving_table_name(table_name)}: {row_count} rows "
+                  f"(subdivided to {args.max_vertices} vertices, GiST indexed, clustered). [✓]")
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print(f"\n[ERROR] Database error: {e}")
+    except Exception as e:
+        print(f"\n[ERROR] An unexpected error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+            print("\nDatabase connection closed. [✓]")
+            print("="*50)
+
+def merge_main(argv):
+    """
+    "postgis2mvt.py merge": combines the outputs of sharded runs (any mix of
+    dir, mbtiles and pmtiles) into one tileset or archive.
+    """
+    parser = argparse.ArgumentParser(prog="postgis2mvt.py merge",
+                                     description="Merge the outputs of sharded postgis2mvt.py runs.")
+    parser.add_argument("inputs", nargs='+',
+                        help="Shard outputs as dir:<path>, mbtiles:<path> or pmtiles:<path>")
+    parser.add_argument("--output", required=True,
+                        help="Merged output: dir:<path>, mbtiles:<path> or pmtiles:<path>")
+    parser.add_argument("--tileset", type=str, default=None,
+                        help="Name of the merged tileset (default: the first input's name)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Store byte-identical tiles once in the merged output")
+    args = parser.parse_args(argv)
+    if args.output in args.inputs:
+        parser.error("--output must not be one of the inputs")
+
+    writer = None
+    try:
+        readers = [open_tile_reader(spec) for spec in args.inputs]
+        metadata = merge_metadata([reader.metadata() for reader in readers], args.tileset)
+        metadata["dedup"] = args.dedup
+        writer = open_tile_writer(args.output, None, dedup=args.dedup)
+        print("="*50)
+        print(f"Merging {len(readers)} inputs into {writer}")
+        print("="*50)
+
+        seen = set() # PMTiles ids of the tiles written so far
+        duplicates = 0
+        for reader in readers:
+            for z, x, y, data in tqdm(reader.tiles(), desc=f"Merging {reader}", unit="tile"):
+                tile_id = zxy_to_tileid(z, x, y)
+                if tile_id in seen:
+                    # Shards are disjoint; overlapping inputs keep the first copy
+                    duplicates += 1
+                    continue
+                seen.add(tile_id)
+                writer.write(z, x, y, data)
+            writer.flush()
+
+        writer.close(metadata)
+        print(f"Merged tileset written: {len(seen)} tiles. [✓]")
+        if duplicates:
+            print(f"[WARNING] {duplicates} tiles appeared in more than one input; the first copy was kept.")
+        if args.dedup:
+            print(writer.dedup_summary())
+        writer = None
+    except Exception as e:
+        print(f"\n[ERROR] An unexpected error occurred: {e}")
+    finally:
+        if writer is not None:
+            writer.abort()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "prepare":
+        prepare_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "merge":
+        merge_main(sys.argv[2:])
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,61 @@
+import json
+import os
+import sqlite3
+
+# Checkpoint (manifest) for resumable postgis2mvt.py runs. Every processed tile
+# is recorded with its feature count, so an interrupted run can skip finished
+# tiles and --prune can rebuild its set of occupied parent tiles.
+# Marks are only committed after the tile writer has flushed, so the checkpoint
+# never claims a tile that is not on disk yet.
+
+class TileCheckpoint:
+    """SQLite manifest of the tiles a run has already processed."""
+
+    def __init__(self, path, run_key):
+        self.path = path
+        self._pending = []
+        # Committed from the pipeline's writer thread, opened and closed from the main thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS run (key TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS done "
+            "(z INTEGER, x INTEGER, y INTEGER, features INTEGER, PRIMARY KEY (z, x, y)) WITHOUT ROWID"
+        )
+        key = json.dumps(run_key, sort_keys=True)
+        row = self.conn.execute("SELECT key FROM run").fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO run (key) VALUES (?)", (key,))
+            self.conn.commit()
+        elif row[0] != key:
+            self.conn.close()
+            raise ValueError(f"Checkpoint {path} belongs to a run with different arguments; "
+                             f"remove it or use another --checkpoint path")
+
+    def done_tiles(self, z):
+        """Returns {(x, y): features} for the tiles of zoom z that are already processed."""
+        rows = self.conn.execute("SELECT x, y, features FROM done WHERE z = ?", (z,))
+        return {(x, y): features for x, y, features in rows}
+
+    def mark(self, z, x, y, features):
+        self._pending.append((z, x, y, features))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def commit(self):
+        """Records the pending marks. Call only after the tile writer has flushed."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO done (z, x, y, features) VALUES (?, ?, ?, ?)", self._pending
+        )
+        self.conn.commit()
+        self._pending = []
+
+    def close(self):
+        self.conn.close()
+
+    def remove(self):
+        """Deletes the checkpoint once the run has completed."""
+        self.conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,75 @@
+import queue
+import threading
+
+# Fetch/write pipeline for postgis2mvt.py. The rendering side (the main thread,
+# or the worker pool feeding it) puts finished blocks on a bounded queue and one
+# or more writer threads drain it, so the database never waits for the disk and
+# the disk never waits for the database. A full queue blocks the producer
+# (backpressure); close() lets the writers finish everything already queued, so
+# an interrupted run still flushes the tiles it has rendered.
+
+DEFAULT_QUEUE_SIZE = 64 # Rendered blocks waiting for a writer thread
+_DONE = object() # Sentinel telling a writer thread to stop
+
+
+class WriterPipeline:
+    """Bounded queue of rendered blocks drained by writer threads calling handle_result."""
+
+    def __init__(self, handle_result, threads=1, queue_size=DEFAULT_QUEUE_SIZE):
+        self.handle_result = handle_result
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.threads = [
+            threading.Thread(target=self._drain, name=f"tile-writer-{index}", daemon=True)
+            for index in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                continue # Keep emptying the queue so the producer never blocks on a dead pipeline
+            try:
+                self.handle_result(item)
+            except BaseException as e:
+                self.error = e
+
+    def put(self, item):
+        """Queues a rendered block, waiting while the queue is full. Raises if a writer failed."""
+        while True:
+            self.check()
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def check(self):
+        """Re-raises the first error of a writer thread in the producer."""
+        if self.error is not None:
+            raise RuntimeError(f"Tile writer failed: {self.error}") from self.error
+
+    def close(self):
+        """Lets the writer threads finish the queued blocks, then stops them."""
+        for _ in self.threads:
+            self.queue.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+
+
+def throttled(items, slots, stopping):
+    """
+    Yields items while a slot of the slots semaphore is free. Fed to
+    Pool.imap_unordered, this bounds how many rendered blocks can pile up in the
+    pool's result buffer; the consumer releases one slot per result taken.
+    Stops early once stopping is set, so terminating the pool never hangs.
+    """
+    for item in items:
+        while not slots.acquire(timeout=0.5):
+            if stopping.is_set():
+                return
+        yield item
@@ -0,0 +1,196 @@
+import gzip
+import io
+import struct
+
+# PMTiles v3 format (https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md):
+# header layout, tile ids and directory encoding. Shared by PMTilesWriter
+# (tile_writers.py), PMTilesReader (tile_readers.py) and the app, which serves
+# PMTiles archives (app/utils/tile_archives.py), so the writer and both readers
+# cannot drift apart.
+
+PMTILES_HEADER_FORMAT = "<7sBQQQQQQQQQQQBBBBBBiiiiBii"
+PMTILES_HEADER_LENGTH = 127
+PMTILES_ROOT_MAX_LENGTH = 16384 - PMTILES_HEADER_LENGTH
+PMTILES_COMPRESSION_NONE = 1
+PMTILES_COMPRESSION_GZIP = 2
+PMTILES_COMPRESSION_BROTLI = 3
+PMTILES_TILE_COMPRESSION = {
+    "none": PMTILES_COMPRESSION_NONE,
+    "gzip": PMTILES_COMPRESSION_GZIP,
+    "br": PMTILES_COMPRESSION_BROTLI,
+}
+PMTILES_TILE_COMPRESSION_NAMES = {code: name for name, code in PMTILES_TILE_COMPRESSION.items()}
+PMTILES_TILE_TYPE_MVT = 1
+
+
+def unpack_header(data, path):
+    """
+    Unpacks the header at the start of data (at least PMTILES_HEADER_LENGTH
+    bytes) of the archive at path. Raises ValueError for anything but a
+    PMTiles v3 archive with uncompressed or gzip-compressed directories.
+    """
+    header = struct.unpack(PMTILES_HEADER_FORMAT, data[:PMTILES_HEADER_LENGTH])
+    if header[0] != b"PMTiles" or header[1] != 3:
+        raise ValueError(f"{path} is not a PMTiles v3 archive")
+    if header[14] not in (PMTILES_COMPRESSION_NONE, PMTILES_COMPRESSION_GZIP):
+        raise ValueError(f"{path} uses an unsupported directory compression")
+    return header
+
+
+def _rotate(n, xy, rx, ry):
+    if ry == 0:
+        if rx == 1:
+            xy[0] = n - 1 - xy[0]
+            xy[1] = n - 1 - xy[1]
+        xy[0], xy[1] = xy[1], xy[0]
+
+def zxy_to_tileid(z, x, y):
+    """
+    PMTiles tile id: the number of tiles in all lower zooms plus the position of
+    (x, y) along the Hilbert curve of zoom z.
+    """
+    acc = ((1 << (2 * z)) - 1) // 3 # 4^0 + 4^1 + ... + 4^(z-1)
+    n = 1 << z
+    xy = [x, y]
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if (xy[0] & s) > 0 else 0
+        ry = 1 if (xy[1] & s) > 0 else 0
+        d += s * s * ((3 * rx) ^ ry)
+        _rotate(n, xy, rx, ry)
+        s //= 2
+    return acc + d
+
+def tileid_to_zxy(tile_id):
+    """Inverse of zxy_to_tileid."""
+    z = 0
+    acc = 0
+    while acc + (1 << (2 * z)) <= tile_id:
+        acc += 1 << (2 * z)
+        z += 1
+    position = tile_id - acc
+    n = 1 << z
+    x = y = 0
+    s = 1
+    while s < n:
+        rx = 1 & (position // 2)
+        ry = 1 & (position ^ rx)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        x += s * rx
+        y += s * ry
+        position //= 4
+        s *= 2
+    return z, x, y
+
+
+def _write_varint(buf, value):
+    while value >= 0x80:
+        buf.write(bytes([(value & 0x7F) | 0x80]))
+        value >>= 7
+    buf.write(bytes([value]))
+
+def _read_varint(buf):
+    value = 0
+    shift = 0
+    while True:
+        byte = buf.read(1)[0]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value
+        shift += 7
+
+def serialize_directory(entries):
+    """
+    Encodes (tile_id, offset, length, run_length) entries as a gzip-compressed
+    PMTiles directory: delta-coded tile ids, run lengths, lengths, then offsets
+    (0 meaning "directly after the previous entry").
+    """
+    buf = io.BytesIO()
+    _write_varint(buf, len(entries))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        _write_varint(buf, tile_id - last_id)
+        last_id = tile_id
+    for _, _, _, run_length in entries:
+        _write_varint(buf, run_length)
+    for _, _, length, _ in entries:
+        _write_varint(buf, length)
+    previous = None
+    for tile_id, offset, length, _ in entries:
+        if previous is not None and offset == previous[1] + previous[2]:
+            _write_varint(buf, 0)
+        else:
+            _write_varint(buf, offset + 1)
+        previous = (tile_id, offset, length)
+    return gzip.compress(buf.getvalue())
+
+def deserialize_directory(data):
+    """Decodes an (uncompressed) PMTiles directory into (tile_id, offset, length, run_length) entries."""
+    buf = io.BytesIO(data)
+    count = _read_varint(buf)
+    tile_ids = []
+    last_id = 0
+    for _ in range(count):
+        last_id += _read_varint(buf)
+        tile_ids.append(last_id)
+    run_lengths = [_read_varint(buf) for _ in range(count)]
+    lengths = [_read_varint(buf) for _ in range(count)]
+    entries = []
+    for i in range(count):
+        offset = _read_varint(buf)
+        if offset == 0 and i > 0:
+            offset = entries[i - 1][1] + entries[i - 1][2]
+        else:
+            offset -= 1
+        entries.append((tile_ids[i], offset, lengths[i], run_lengths[i]))
+    return entries
+
+def build_directories(entries):
+    """
+    Returns (root_bytes, leaves_bytes). The root directory must fit in the first
+    16 KiB of the archive; when it does not, entries are split into leaf
+    directories (doubling the leaf size until the root fits).
+    """
+    root = serialize_directory(entries)
+    if len(root) <= PMTILES_ROOT_MAX_LENGTH:
+        return root, b""
+
+    leaf_size = 4096
+    while True:
+        root_entries = []
+        leaves = io.BytesIO()
+        for i in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[i:i + leaf_size])
+            # A run_length of 0 marks an entry that points at a leaf directory
+            root_entries.append((entries[i][0], leaves.tell(), len(leaf), 0))
+            leaves.write(leaf)
+        root = serialize_directory(root_entries)
+        if len(root) <= PMTILES_ROOT_MAX_LENGTH:
+            return root, leaves.getvalue()
+        leaf_size *= 2
+
+def find_entry(entries, tile_id):
+    """
+    The entry of a directory (sorted by tile id) holding tile_id: an exact
+    match, a run covering it, or the leaf directory it is in. None when the
+    tile is not stored.
+    """
+    low, high = 0, len(entries) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        if entries[middle][0] < tile_id:
+            low = middle + 1
+        elif entries[middle][0] > tile_id:
+            high = middle - 1
+        else:
+            return entries[middle]
+    if high >= 0:
+        entry = entries[high]
+        if entry[3] == 0 or tile_id - entry[0] < entry[3]:
+            return entry
+    return None
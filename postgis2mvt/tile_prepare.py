@@ -0,0 +1,122 @@
+from psycopg2 import sql
+
+# Serving copies for postgis2mvt.py ("postgis2mvt.py prepare").
+#
+# A serving copy <table>_mvt sits next to the source table and holds the same
+# attribute columns with:
+#   - geom transformed once to EPSG:3857, so ST_TileEnvelope bounds hit the GiST index directly
+#   - lines and polygons split with ST_Subdivide, so a huge land-zone polygon is
+#     clipped as a few small pieces instead of in full for every tile it touches
+#   - a GiST index on geom, and rows CLUSTERed on it so neighbouring tiles read
+#     neighbouring pages
+#   - mvt_source_area / mvt_source_length: the area and length of the whole source
+#     feature on every piece, so min_area/min_length profile filters and degrade
+#     thinning judge features rather than pieces
+#   - mvt_feature: the number of the source feature on every piece, and
+#     mvt_whole_geom: the whole feature (EPSG:3857) on its first piece only
+# The generator reads from the serving copy automatically whenever it exists.
+# Zooms whose profile simplifies (and degraded tiles) cannot use the pieces, which
+# simplified one by one would no longer meet along their cut lines: they find the
+# features through the pieces' index and simplify their whole geometry instead.
+# Re-run prepare after the source table changes; the copy is rebuilt and swapped in
+# within one transaction.
+
+SERVING_SUFFIX = "_mvt"
+DEFAULT_MAX_VERTICES = 256
+SOURCE_AREA_COLUMN = "mvt_source_area"
+SOURCE_LENGTH_COLUMN = "mvt_source_length"
+FEATURE_COLUMN = "mvt_feature"
+WHOLE_GEOM_COLUMN = "mvt_whole_geom"
+
+
+def serving_table_name(table_name):
+    """Name of the serving copy of a table."""
+    return f"{table_name}{SERVING_SUFFIX}"
+
+
+def find_serving_copy(cursor, schema_name, table_name):
+    """
+    Returns the serving copy's table name if it exists, otherwise None. Copies
+    built before the whole feature geometry was kept are ignored until prepare
+    is re-run.
+    """
+    serving_name = serving_table_name(table_name)
+    cursor.execute("""
+        SELECT to_regclass(format('%%I.%%I', %s, %s)) IS NOT NULL,
+               EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = %s AND table_name = %s AND column_name = %s)
+    """, (schema_name, serving_name, schema_name, serving_name, WHOLE_GEOM_COLUMN))
+    exists, current = cursor.fetchone()
+    if exists and not current:
+        print(f"Ignoring outdated serving copy {schema_name}.{serving_name}; re-run prepare to use it")
+    return serving_name if exists and current else None
+
+
+def build_serving_copy(cursor, schema_name, table_name, columns, max_vertices=DEFAULT_MAX_VERTICES):
+    """
+    Builds (or rebuilds) the serving copy of schema.table from its attribute
+    columns and returns its row count. The new copy is built under a temporary
+    name and swapped in at the end; the caller commits.
+    """
+    serving_name = serving_table_name(table_name)
+    building_name = f"{serving_name}_building"
+    schema = sql.Identifier(schema_name)
+    building = sql.Identifier(building_name)
+    serving = sql.Identifier(serving_name)
+    building_index = sql.Identifier(f"{building_name}_geom_idx")
+    building_feature_index = sql.Identifier(f"{building_name}_feature_idx")
+
+    column_list = sql.SQL("").join(
+        [sql.SQL("t.{}, ").format(sql.Identifier(col)) for col in columns]
+    )
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(schema, building))
+    cursor.execute(sql.SQL("""
+        CREATE TABLE {schema}.{building} AS
+        SELECT {column_list}ST_Area(whole.geom) AS {area_column}, ST_Length(whole.geom) AS {length_column},
+               t.{feature_column}, CASE WHEN pieces.piece = 1 THEN whole.geom END AS {whole_column},
+               pieces.geom
+        FROM (
+            SELECT s.*, row_number() OVER () AS {feature_column}
+            FROM {schema}.{table_name} AS s
+            WHERE s.geom IS NOT NULL AND NOT ST_IsEmpty(s.geom)
+        ) AS t
+        CROSS JOIN LATERAL (SELECT ST_Transform(t.geom, 3857) AS geom) AS whole
+        CROSS JOIN LATERAL (
+            SELECT parts.geom, row_number() OVER () AS piece
+            FROM (
+                SELECT ST_Subdivide(whole.geom, {max_vertices}) AS geom
+                WHERE ST_Dimension(whole.geom) > 0
+                UNION ALL
+                SELECT whole.geom
+                WHERE ST_Dimension(whole.geom) = 0
+            ) AS parts
+        ) AS pieces
+    """).format(
+        schema=schema,
+        building=building,
+        column_list=column_list,
+        area_column=sql.Identifier(SOURCE_AREA_COLUMN),
+        length_column=sql.Identifier(SOURCE_LENGTH_COLUMN),
+        feature_column=sql.Identifier(FEATURE_COLUMN),
+        whole_column=sql.Identifier(WHOLE_GEOM_COLUMN),
+        table_name=sql.Identifier(table_name),
+        max_vertices=sql.Literal(max_vertices),
+    ))
+    row_count = cursor.rowcount
+    cursor.execute(sql.SQL("CREATE INDEX {} ON {}.{} USING GIST (geom)").format(building_index, schema, building))
+    # Finds the piece holding a feature's whole geometry, for simplified zooms
+    cursor.execute(sql.SQL("CREATE INDEX {} ON {}.{} ({}) WHERE {} IS NOT NULL").format(
+        building_feature_index, schema, building,
+        sql.Identifier(FEATURE_COLUMN), sql.Identifier(WHOLE_GEOM_COLUMN)))
+    cursor.execute(sql.SQL("CLUSTER {}.{} USING {}").format(schema, building, building_index))
+    cursor.execute(sql.SQL("ANALYZE {}.{}").format(schema, building))
+
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(schema, serving))
+    cursor.execute(sql.SQL("ALTER TABLE {}.{} RENAME TO {}").format(schema, building, serving))
+    cursor.execute(sql.SQL("ALTER INDEX {}.{} RENAME TO {}").format(
+        schema, building_index, sql.Identifier(f"{serving_name}_geom_idx")))
+    cursor.execute(sql.SQL("ALTER INDEX {}.{} RENAME TO {}").format(
+        schema, building_feature_index, sql.Identifier(f"{serving_name}_feature_idx")))
+    cursor.execute(sql.SQL("COMMENT ON TABLE {}.{} IS {}").format(
+        schema, serving, sql.Literal(f"postgis2mvt serving copy of {schema_name}.{table_name}")))
+    return row_count
@@ -0,0 +1,98 @@
+import json
+import os
+
+import yaml
+
+# Per-layer generalization profiles for postgis2mvt.py.
+#
+# A profile file (JSON or YAML) maps layer names to a list of zoom-range rules:
+#
+#   {
+#     "nsw_lots": [
+#       {"minzoom": 10, "maxzoom": 13, "columns": ["lotidstring"], "simplify": 20,
+#        "min_area": 2000, "extent": 1024, "buffer": 64},
+#       {"minzoom": 14, "maxzoom": 22}
+#     ]
+#   }
+#
+# Rule keys (all optional except the zoom range):
+#   columns    - attributes to include (default: every non-geometry column; the id is always kept)
+#   simplify   - ST_Simplify tolerance in the geometry's units (metres for EPSG:3857)
+#   min_area   - polygons smaller than this (in squared geometry units) are left out
+#   min_length - lines shorter than this (in geometry units) are left out
+#   extent     - MVT extent (default: 4096)
+#   buffer     - MVT buffer in extent units (default: 256)
+#   cluster    - point layers: snap points to a grid of this many extent units and emit one
+#                feature per cell with a point_count attribute (default: 0, raw points)
+#   cluster_summary - with cluster: {"column": "sum" | "avg" | "min" | "max" | "count_distinct"},
+#                emitted as <column>_<aggregate> attributes of each cell
+# Zooms without a matching rule, and layers without a profile, use the defaults, so a
+# clustering rule for the low zooms switches back to raw points above its maxzoom:
+#
+#   {"nsw_addresses": [{"minzoom": 10, "maxzoom": 13, "cluster": 64}]}
+
+DEFAULT_RULE = {
+    "columns": None,
+    "simplify": 0,
+    "min_area": 0,
+    "min_length": 0,
+    "extent": 4096,
+    "buffer": 256,
+    "cluster": 0,
+    "cluster_summary": {},
+}
+
+CLUSTER_AGGREGATES = ("sum", "avg", "min", "max", "count_distinct")
+
+WEB_MERCATOR_WIDTH = 40075016.686 # Width of the EPSG:3857 world in metres
+
+# --max-tile-bytes (and the app's TILE_MAX_BYTES): over-budget tiles are re-rendered
+# with these progressively coarser settings until they fit: (simplification tolerance
+# in MVT extent units, share of each layer's features kept, highest priority first).
+DEGRADE_STEPS = [(4, 1.0), (8, 0.75), (16, 0.5), (32, 0.25), (64, 0.1)]
+
+
+def load_profiles(path):
+    """Loads and validates a profile file. Returns {layer_name: [rule, ...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            if os.path.splitext(path)[1].lower() in (".yml", ".yaml"):
+                raw = yaml.safe_load(f)
+            else:
+                raw = json.load(f)
+        except (yaml.YAMLError, json.JSONDecodeError) as e:
+            raise ValueError(f"Could not parse profile file {path}: {e}")
+
+    if not isinstance(raw, dict):
+        raise ValueError(f"Profile file {path} must map layer names to lists of rules")
+
+    profiles = {}
+    for layer_name, rules in raw.items():
+        if not isinstance(rules, list):
+            raise ValueError(f"Profile for layer '{layer_name}' must be a list of rules")
+        checked = []
+        for rule in rules:
+            unknown = set(rule) - set(DEFAULT_RULE) - {"minzoom", "maxzoom"}
+            if unknown:
+                raise ValueError(f"Unknown profile keys for layer '{layer_name}': {', '.join(sorted(unknown))}")
+            if "minzoom" not in rule or "maxzoom" not in rule:
+                raise ValueError(f"Every profile rule for layer '{layer_name}' needs minzoom and maxzoom")
+            if rule["minzoom"] > rule["maxzoom"]:
+                raise ValueError(f"Profile rule for layer '{layer_name}' has minzoom > maxzoom")
+            summary = rule.get("cluster_summary", {})
+            if not isinstance(summary, dict) or any(agg not in CLUSTER_AGGREGATES for agg in summary.values()):
+                raise ValueError(f"cluster_summary for layer '{layer_name}' must map columns to one of: "
+                                 f"{', '.join(CLUSTER_AGGREGATES)}")
+            if summary and not rule.get("cluster"):
+                raise ValueError(f"cluster_summary for layer '{layer_name}' needs a cluster grid size")
+            checked.append(dict(DEFAULT_RULE, **rule))
+        profiles[layer_name] = checked
+    return profiles
+
+
+def profile_rule(profiles, layer_name, zoom):
+    """Returns the rule that applies to layer_name at zoom (the first matching one)."""
+    for rule in (profiles or {}).get(layer_name, []):
+        if rule["minzoom"] <= zoom <= rule["maxzoom"]:
+            return rule
+    return DEFAULT_RULE
@@ -0,0 +1,214 @@
+import gzip
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+
+import brotli
+import mapbox_vector_tile
+from mapbox_vector_tile.encoder import on_invalid_geometry_make_valid
+from shapely import affinity
+from shapely.geometry import Point, box, shape
+from shapely.ops import unary_union
+
+from tile_profiles import WEB_MERCATOR_WIDTH
+
+# Bottom-up pyramid engine for postgis2mvt.py (--engine bottom-up). PostGIS is
+# only queried at the base zoom; every lower zoom is built in Python by
+# decoding the four child tiles, scaling their features into the parent tile,
+# merging the pieces and generalizing them with the layer's profile rule
+# (simplify, min_area, min_length, columns, extent, buffer, cluster).
+# Tiles of each level are kept in a SQLite scratch file until their parents exist.
+
+PYRAMID_SUMMARY_AGGREGATES = ("sum", "min", "max") # cluster_summary aggregates that can be rebuilt from children
+
+
+class PyramidScratch:
+    """SQLite store of the tiles of the levels that still have to be merged into their parents."""
+
+    def __init__(self, path=None):
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix="postgis2mvt-pyramid-", suffix=".sqlite")
+            os.close(handle)
+        self.path = path
+        # Filled by the writer threads while the same level's parents may already be read
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tiles "
+            "(z INTEGER, x INTEGER, y INTEGER, data BLOB, PRIMARY KEY (z, x, y)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def put(self, z, x, y, data):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO tiles (z, x, y, data) VALUES (?, ?, ?, ?)",
+                              (z, x, y, sqlite3.Binary(data)))
+
+    def commit(self):
+        """Makes the level stored so far visible to other connections (the --workers processes)."""
+        with self.lock:
+            self.conn.commit()
+
+    def parents(self, child_zoom):
+        """The (x, y) parents at child_zoom - 1 of every stored tile of child_zoom."""
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT x / 2, y / 2 FROM tiles WHERE z = ?", (child_zoom,)).fetchall()
+        return {(x, y) for x, y in rows}
+
+    def children(self, z, x, y):
+        """Returns [(dx, dy, data)] for the stored children of tile (z, x, y)."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT x, y, data FROM tiles WHERE z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+                (z + 1, 2 * x, 2 * x + 1, 2 * y, 2 * y + 1),
+            ).fetchall()
+        return [(child_x - 2 * x, child_y - 2 * y, bytes(data)) for child_x, child_y, data in rows]
+
+    def drop_level(self, z):
+        """Forgets a level once all its parents are built."""
+        with self.lock:
+            self.conn.execute("DELETE FROM tiles WHERE z = ?", (z,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def remove(self):
+        self.conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+def decode_stored_tile(data, compression):
+    """Undoes postgis2mvt's --compress on a stored tile."""
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "br":
+        return brotli.decompress(data)
+    return data
+
+
+def _feature_weight(geometry, properties, priority):
+    """Thinning order under a byte budget: priority attribute if present, otherwise area/length."""
+    if priority and isinstance(properties.get(priority), (int, float)):
+        return properties[priority]
+    return geometry.area + geometry.length
+
+
+def _cluster_points(features, rule):
+    """Re-clusters point features on the rule's grid, adding up point_count and the summary attributes."""
+    cells = {}
+    for geometry, properties in features:
+        for point in geometry.geoms if geometry.geom_type == "MultiPoint" else [geometry.centroid]:
+            key = (math.floor(point.x / rule["cluster"]), math.floor(point.y / rule["cluster"]))
+            cells.setdefault(key, []).append((point, properties))
+
+    clustered = []
+    for members in cells.values():
+        counts = [properties.get("point_count", 1) for _, properties in members]
+        total = sum(counts)
+        x = sum(point.x * count for (point, _), count in zip(members, counts)) / total
+        y = sum(point.y * count for (point, _), count in zip(members, counts)) / total
+        properties = {"point_count": total}
+        for column_name, aggregate in rule["cluster_summary"].items():
+            name = f"{column_name}_{aggregate}"
+            values = [props.get(name, props.get(column_name)) for _, props in members]
+            values = [value for value in values if value is not None]
+            if values:
+                properties[name] = {"sum": sum, "min": min, "max": max}[aggregate](values)
+        clustered.append((Point(x, y), properties))
+    return clustered
+
+
+def merge_child_tiles(children, zoom, layer_rules, tolerance_units=0, keep_share=1.0):
+    """
+    Builds the raw MVT of a tile at zoom from its decoded children.
+    children is [(dx, dy, raw_mvt)]; layer_rules maps layer names to
+    (rule, has_id, priority). Each child contributes its own quarter of the
+    parent plus, on the parent's outer edges, what its buffer holds. Pieces of
+    a feature with a real id are unioned back together. tolerance_units and
+    keep_share coarsen the result for --max-tile-bytes.
+    Returns (raw_mvt, feature_count).
+    """
+    pieces = {} # layer name -> [(geometry, properties)]
+    for dx, dy, data in children:
+        for layer_name, layer in mapbox_vector_tile.decode(data, default_options={"y_coord_down": True}).items():
+            rule, _, _ = layer_rules[layer_name]
+            extent = rule["extent"]
+            half = extent / 2
+            scale = extent / (2 * layer["extent"])
+            clip = box(
+                dx * half - (rule["buffer"] if dx == 0 else 0),
+                dy * half - (rule["buffer"] if dy == 0 else 0),
+                (dx + 1) * half + (rule["buffer"] if dx == 1 else 0),
+                (dy + 1) * half + (rule["buffer"] if dy == 1 else 0),
+            )
+            for feature in layer["features"]:
+                geometry = affinity.affine_transform(
+                    shape(feature["geometry"]), [scale, 0, 0, scale, dx * half, dy * half])
+                geometry = geometry.intersection(clip)
+                if not geometry.is_empty:
+                    pieces.setdefault(layer_name, []).append((geometry, feature["properties"]))
+
+    layers = []
+    per_layer_options = {}
+    feature_count = 0
+    for layer_name, features in pieces.items():
+        rule, has_id, priority = layer_rules[layer_name]
+        units_per_metre = rule["extent"] * (1 << zoom) / WEB_MERCATOR_WIDTH
+
+        if rule["cluster"]:
+            features = _cluster_points(features, rule)
+        elif has_id:
+            by_id = {}
+            for geometry, properties in features:
+                by_id.setdefault(properties.get("id"), []).append((geometry, properties))
+            features = [
+                (unary_union([geometry for geometry, _ in group]) if len(group) > 1 else group[0][0], group[0][1])
+                for group in by_id.values()
+            ]
+
+        tolerance = max(rule["simplify"] * units_per_metre, tolerance_units)
+        kept = []
+        for geometry, properties in features:
+            if tolerance:
+                geometry = geometry.simplify(tolerance, preserve_topology=True)
+            if geometry.is_empty:
+                continue
+            if rule["min_area"] and geometry.geom_type.endswith("Polygon") \
+                    and geometry.area < rule["min_area"] * units_per_metre ** 2:
+                continue
+            if rule["min_length"] and geometry.geom_type.endswith("LineString") \
+                    and geometry.length < rule["min_length"] * units_per_metre:
+                continue
+            if rule["columns"] is not None and not rule["cluster"]:
+                properties = {key: value for key, value in properties.items()
+                              if key == "id" or key in rule["columns"]}
+            kept.append((geometry, properties))
+
+        if keep_share < 1.0 and not rule["cluster"]:
+            kept.sort(key=lambda item: _feature_weight(item[0], item[1], priority), reverse=True)
+            kept = kept[:math.ceil(len(kept) * keep_share)]
+        if not kept:
+            continue
+
+        feature_count += len(kept)
+        layers.append({
+            "name": layer_name,
+            "features": [{"geometry": geometry, "properties": properties} for geometry, properties in kept],
+        })
+        per_layer_options[layer_name] = {"extents": rule["extent"]}
+
+    if not layers:
+        return b"", 0
+    raw = mapbox_vector_tile.encode(
+        layers,
+        per_layer_options=per_layer_options,
+        default_options={"y_coord_down": True, "on_invalid_geometry": on_invalid_geometry_make_valid},
+    )
+    return raw, feature_count
@@ -0,0 +1,184 @@
+import gzip
+import json
+import os
+import sqlite3
+
+from tile_pmtiles import (
+    PMTILES_COMPRESSION_GZIP,
+    PMTILES_HEADER_LENGTH,
+    PMTILES_TILE_COMPRESSION_NAMES,
+    deserialize_directory,
+    tileid_to_zxy,
+    unpack_header,
+)
+
+# Readers for the outputs of tile_writers.py, used by "postgis2mvt.py merge" to
+# combine the outputs of sharded runs. Every reader exposes:
+#   tiles()     - yields (z, x, y, data) for every stored tile (data as stored, possibly compressed)
+#   metadata()  - the metadata dict the writer was closed with (see tile_writers.py)
+
+
+class DirectoryReader:
+    """Reads a <path>/<z>/<x>/<y>.pbf tree and its metadata.json."""
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise ValueError(f"Tile directory {path} does not exist")
+        self.path = path
+
+    def tiles(self):
+        for z_name in sorted(os.listdir(self.path)):
+            z_dir = os.path.join(self.path, z_name)
+            if not z_name.isdigit() or not os.path.isdir(z_dir):
+                continue
+            for x_name in sorted(os.listdir(z_dir), key=int):
+                x_dir = os.path.join(z_dir, x_name)
+                for file_name in sorted(os.listdir(x_dir)):
+                    y_name, extension = os.path.splitext(file_name)
+                    if extension != ".pbf":
+                        continue
+                    with open(os.path.join(x_dir, file_name), "rb") as f:
+                        yield int(z_name), int(x_name), int(y_name), f.read()
+
+    def metadata(self):
+        metadata_path = os.path.join(self.path, "metadata.json")
+        if not os.path.exists(metadata_path):
+            raise ValueError(f"{metadata_path} is missing; was the run finished?")
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def __str__(self):
+        return f"directory {os.path.abspath(self.path)}"
+
+
+class MBTilesReader:
+    """Reads an MBTiles archive (plain or deduplicated schema); rows are flipped back from TMS."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError(f"MBTiles archive {path} does not exist")
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+    def tiles(self):
+        rows = self.conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")
+        for z, x, tms_y, data in rows:
+            yield z, x, (1 << z) - 1 - tms_y, bytes(data)
+
+    def metadata(self):
+        rows = dict(self.conn.execute("SELECT name, value FROM metadata"))
+        west, south, east, north = (float(value) for value in rows["bounds"].split(","))
+        return {
+            "name": rows.get("name"),
+            "bounds": (west, south, east, north),
+            "minzoom": int(rows["minzoom"]),
+            "maxzoom": int(rows["maxzoom"]),
+            "compression": rows.get("compression", "none"),
+            "vector_layers": json.loads(rows.get("json", "{}")).get("vector_layers", []),
+        }
+
+    def __str__(self):
+        return f"MBTiles archive {os.path.abspath(self.path)}"
+
+
+class PMTilesReader:
+    """Reads a PMTiles v3 archive such as those written by PMTilesWriter."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError(f"PMTiles archive {path} does not exist")
+        self.path = path
+        with open(path, "rb") as f:
+            self.header = unpack_header(f.read(PMTILES_HEADER_LENGTH), path)
+        self.internal_compression = self.header[14]
+
+    def _directory(self, f, offset, length):
+        f.seek(offset)
+        return deserialize_directory(self._decompress(f.read(length)))
+
+    def _decompress(self, data):
+        if self.internal_compression == PMTILES_COMPRESSION_GZIP:
+            return gzip.decompress(data)
+        return data
+
+    def tiles(self):
+        (_, _, root_offset, root_length, _, _, leaves_offset, _, data_offset, *_rest) = self.header
+        with open(self.path, "rb") as f:
+            pending = [self._directory(f, root_offset, root_length)]
+            while pending:
+                for tile_id, offset, length, run_length in pending.pop(0):
+                    if run_length == 0:
+                        pending.append(self._directory(f, leaves_offset + offset, length))
+                        continue
+                    f.seek(data_offset + offset)
+                    data = f.read(length)
+                    for repeat in range(run_length):
+                        z, x, y = tileid_to_zxy(tile_id + repeat)
+                        yield z, x, y, data
+
+    def metadata(self):
+        header = self.header
+        with open(self.path, "rb") as f:
+            f.seek(header[4])
+            raw = self._decompress(f.read(header[5]))
+        stored = json.loads(raw or b"{}")
+        return {
+            "name": stored.get("name"),
+            "bounds": (header[19] / 1e7, header[20] / 1e7, header[21] / 1e7, header[22] / 1e7),
+            "minzoom": header[17],
+            "maxzoom": header[18],
+            "compression": PMTILES_TILE_COMPRESSION_NAMES.get(header[15], "none"),
+            "vector_layers": stored.get("vector_layers", []),
+        }
+
+    def __str__(self):
+        return f"PMTiles archive {os.path.abspath(self.path)}"
+
+
+def open_tile_reader(input_spec):
+    """Opens a reader for a "dir:<path>", "mbtiles:<path>" or "pmtiles:<path>" value (as in --output)."""
+    kind, sep, path = input_spec.partition(":")
+    if not sep or not path:
+        raise ValueError(f"Invalid input '{input_spec}', expected <dir|mbtiles|pmtiles>:<path>")
+    if kind == "dir":
+        return DirectoryReader(path)
+    if kind == "mbtiles":
+        return MBTilesReader(path)
+    if kind == "pmtiles":
+        return PMTilesReader(path)
+    raise ValueError(f"Unknown input type '{kind}', expected dir, mbtiles or pmtiles")
+
+
+def merge_metadata(metadatas, name=None):
+    """
+    Combines the metadata of several outputs of the same tileset (e.g. shards):
+    bounds and zoom range are widened to cover all of them and vector_layers
+    with the same id have their fields and zooms merged. The outputs must share
+    one tile compression.
+    """
+    compressions = {metadata["compression"] for metadata in metadatas}
+    if len(compressions) != 1:
+        raise ValueError(f"Inputs use different tile compressions ({', '.join(sorted(compressions))}); "
+                         f"they cannot be merged into one tileset")
+
+    layers = {}
+    for metadata in metadatas:
+        for layer in metadata["vector_layers"]:
+            merged = layers.setdefault(layer["id"], dict(layer, fields={}))
+            merged["fields"].update(layer.get("fields", {}))
+            merged["minzoom"] = min(merged["minzoom"], layer["minzoom"])
+            merged["maxzoom"] = max(merged["maxzoom"], layer["maxzoom"])
+
+    return {
+        "name": name or metadatas[0]["name"],
+        "bounds": (
+            min(metadata["bounds"][0] for metadata in metadatas),
+            min(metadata["bounds"][1] for metadata in metadatas),
+            max(metadata["bounds"][2] for metadata in metadatas),
+            max(metadata["bounds"][3] for metadata in metadatas),
+        ),
+        "minzoom": min(metadata["minzoom"] for metadata in metadatas),
+        "maxzoom": max(metadata["maxzoom"] for metadata in metadatas),
+        "compression": compressions.pop(),
+        "vector_layers": list(layers.values()),
+    }
@@ -0,0 +1,94 @@
+import json
+import math
+
+# Per-tile instrumentation for postgis2mvt.py (--stats). Every rendered tile is
+# recorded with its database query time, write time, stored size and feature
+# count; the report shows per-zoom percentiles and the slowest / largest tiles,
+# which is where an index, a serving table or a generalization profile pays off.
+#
+# Tiles are rendered in batches (--batch-size), so a tile's query time is its
+# share of the batch round trip. Use --batch-size 1 for exact per-tile timings.
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class TileStats:
+    """Collects per-tile timings and sizes for one run."""
+
+    def __init__(self):
+        self.tiles = [] # (z, x, y, query_ms, write_ms, bytes, features)
+
+    def record(self, z, x, y, query_seconds, write_seconds, size, features):
+        self.tiles.append((z, x, y, query_seconds * 1000, write_seconds * 1000, size, features))
+
+    def zoom_summaries(self):
+        """Returns {zoom: summary} with tile counts, totals and percentiles of query time and size."""
+        by_zoom = {}
+        for tile in self.tiles:
+            by_zoom.setdefault(tile[0], []).append(tile)
+
+        summaries = {}
+        for zoom, tiles in sorted(by_zoom.items()):
+            query_ms = sorted(tile[3] for tile in tiles)
+            write_ms = sorted(tile[4] for tile in tiles)
+            sizes = sorted(tile[5] for tile in tiles)
+            summaries[zoom] = {
+                "tiles": len(tiles),
+                "non_empty": sum(1 for tile in tiles if tile[5]),
+                "features": sum(tile[6] for tile in tiles),
+                "bytes": sum(sizes),
+                "query_ms_total": round(sum(query_ms), 3),
+                "write_ms_total": round(sum(write_ms), 3),
+                "query_ms": {f"p{pct}": round(percentile(query_ms, pct), 3) for pct in PERCENTILES},
+                "bytes_pct": {f"p{pct}": percentile(sizes, pct) for pct in PERCENTILES},
+                "query_ms_max": round(query_ms[-1], 3),
+                "bytes_max": sizes[-1],
+            }
+        return summaries
+
+    def top(self, key, n):
+        """The n tiles with the highest value of key ('query_ms' or 'bytes')."""
+        index = 3 if key == "query_ms" else 5
+        return sorted(self.tiles, key=lambda tile: tile[index], reverse=True)[:n]
+
+    def save(self, path):
+        """Writes the summaries and every tile record to a JSON file."""
+        report = {
+            "zooms": {str(zoom): summary for zoom, summary in self.zoom_summaries().items()},
+            "tiles": [
+                {"z": z, "x": x, "y": y, "query_ms": round(query_ms, 3), "write_ms": round(write_ms, 3),
+                 "bytes": size, "features": features}
+                for z, x, y, query_ms, write_ms, size, features in self.tiles
+            ],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+
+    def print_report(self, top_n):
+        """Prints per-zoom percentiles and the top_n slowest and largest tiles."""
+        print("Tile statistics (query time per tile, stored size):")
+        for zoom, summary in self.zoom_summaries().items():
+            query_ms = summary["query_ms"]
+            sizes = summary["bytes_pct"]
+            print(f"  Z{zoom}: {summary['tiles']} tiles ({summary['non_empty']} non-empty), "
+                  f"{summary['bytes'] / 1024 / 1024:.1f} MiB - "
+                  f"query ms p50 {query_ms['p50']:.1f} / p90 {query_ms['p90']:.1f} / p99 {query_ms['p99']:.1f} "
+                  f"/ max {summary['query_ms_max']:.1f} - "
+                  f"KiB p50 {sizes['p50'] / 1024:.1f} / p90 {sizes['p90'] / 1024:.1f} / p99 {sizes['p99'] / 1024:.1f} "
+                  f"/ max {summary['bytes_max'] / 1024:.1f}")
+        if not self.tiles:
+            return
+        print(f"Slowest {top_n} tiles:")
+        for z, x, y, query_ms, _, size, features in self.top("query_ms", top_n):
+            print(f"  {z}/{x}/{y}: {query_ms:.1f} ms, {size / 1024:.1f} KiB, {features} features")
+        print(f"Largest {top_n} tiles:")
+        for z, x, y, query_ms, _, size, features in self.top("bytes", top_n):
+            print(f"  {z}/{x}/{y}: {size / 1024:.1f} KiB, {query_ms:.1f} ms, {features} features")
@@ -0,0 +1,433 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import struct
+
+from tile_pmtiles import (
+    PMTILES_COMPRESSION_GZIP,
+    PMTILES_HEADER_FORMAT,
+    PMTILES_HEADER_LENGTH,
+    PMTILES_TILE_COMPRESSION,
+    PMTILES_TILE_TYPE_MVT,
+    build_directories,
+    zxy_to_tileid,
+)
+
+# Output targets for postgis2mvt.py. Every writer exposes the same small interface:
+#   write(z, x, y, data)  - store one tile
+#   delete(z, x, y)       - drop a tile that no longer has data (incremental runs;
+#                           only writers with supports_updates)
+#   flush()               - make everything written so far durable
+#   close(metadata)       - finish the tileset and record its metadata
+#   abort()               - stop after an error, keeping whatever is safe to keep
+# With dedup=True, byte-identical tiles are stored once (content addressed by
+# their MD5 digest) and every writer counts how many unique payloads it kept.
+# metadata is a dict with name, bounds (west, south, east, north), minzoom,
+# maxzoom, compression ("none", "gzip" or "br": how the tile bytes handed to
+# write() are encoded) and vector_layers (TileJSON style layer descriptions).
+
+MBTILES_BATCH_SIZE = 1000 # Tiles per MBTiles transaction
+
+def tile_digest(data):
+    """Content address of a tile payload."""
+    return hashlib.md5(data).hexdigest()
+
+
+class TileWriter:
+    """Shared bookkeeping for the writers: tiles written vs. unique payloads kept."""
+
+    supports_updates = False # Whether existing tiles can be replaced, deleted and resumed
+    concurrent_writes = False # Whether several writer threads may call write() at once
+
+    def __init__(self, dedup):
+        self.dedup = dedup
+        self._count_lock = threading.Lock()
+        self.tiles_written = 0
+        self.bytes_written = 0
+        self.unique_tiles = 0
+        self.unique_bytes = 0
+
+    def _count(self, data, unique):
+        with self._count_lock:
+            self.tiles_written += 1
+            self.bytes_written += len(data)
+            if unique:
+                self.unique_tiles += 1
+                self.unique_bytes += len(data)
+
+    def delete(self, z, x, y):
+        raise ValueError(f"A {self} cannot delete tiles; check supports_updates before an incremental run")
+
+    def dedup_summary(self):
+        """One-line report of the deduplication ratio for this run."""
+        if not self.tiles_written:
+            return "Deduplication: no tiles written."
+        ratio = self.tiles_written / self.unique_tiles if self.unique_tiles else 0.0
+        saved = self.bytes_written - self.unique_bytes
+        return (f"Deduplication: {self.tiles_written} tiles stored as {self.unique_tiles} unique payloads "
+                f"({ratio:.2f}:1), {saved / 1024 / 1024:.1f} MiB saved.")
+
+
+class DirectoryWriter(TileWriter):
+    """
+    Writes tiles as <path>/<z>/<x>/<y>.pbf files plus a metadata.json.
+    With dedup, repeated payloads become hardlinks to the first file written
+    with the same content. Linked files share one inode, so files are always
+    replaced (written aside, then renamed) rather than rewritten in place.
+    """
+
+    supports_updates = True # Existing tiles can be replaced, deleted and resumed
+    concurrent_writes = True # One file per tile, no shared handle
+
+    def __init__(self, path, dedup=False):
+        super().__init__(dedup)
+        self.path = path
+        self._known_dirs = set() # Avoids one makedirs call per tile
+        self._blobs = {} # digest -> path of the first file with that content
+        os.makedirs(path, exist_ok=True)
+        # A tree written with dedup may contain hardlinks even if this run does not dedup
+        self._replace_writes = dedup or self._existing_metadata().get("dedup", False)
+
+    def _existing_metadata(self):
+        metadata_path = os.path.join(self.path, "metadata.json")
+        if not os.path.exists(metadata_path):
+            return {}
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write(self, z, x, y, data):
+        x_dir = os.path.join(self.path, str(z), str(x))
+        if x_dir not in self._known_dirs:
+            os.makedirs(x_dir, exist_ok=True)
+            self._known_dirs.add(x_dir)
+        tile_path = os.path.join(x_dir, f"{y}.pbf")
+
+        if not self._replace_writes:
+            with open(tile_path, "wb") as f:
+                f.write(data)
+            self._count(data, unique=True)
+            return
+
+        temp_path = tile_path + ".tmp"
+        if self.dedup:
+            digest = tile_digest(data)
+            source = self._blobs.get(digest)
+            if source is not None:
+                try:
+                    os.link(source, temp_path)
+                    os.replace(temp_path, tile_path)
+                    self._count(data, unique=False)
+                    return
+                except OSError:
+                    # Hardlink limit reached (or no hardlink support): start a new copy
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            self._blobs[digest] = tile_path
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, tile_path)
+        self._count(data, unique=True)
+
+    def delete(self, z, x, y):
+        tile_path = os.path.join(self.path, str(z), str(x), f"{y}.pbf")
+        if os.path.exists(tile_path):
+            os.remove(tile_path)
+
+    def flush(self):
+        pass
+
+    def close(self, metadata):
+        with open(os.path.join(self.path, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2)
+
+    def abort(self):
+        pass
+
+    def __str__(self):
+        return f"directory {os.path.abspath(self.path)}"
+
+
+class MBTilesWriter(TileWriter):
+    """
+    Writes tiles into a single MBTiles (SQLite) archive. Inserts are grouped into
+    transactions of batch_size tiles instead of one commit per tile.
+    MBTiles stores rows in TMS order, so the y coordinate is flipped on write.
+    With dedup, the archive uses the images + map schema with a 'tiles' view on
+    top, so each unique payload is stored once.
+    """
+
+    supports_updates = True
+
+    def __init__(self, path, batch_size=MBTILES_BATCH_SIZE, dedup=False):
+        super().__init__(dedup)
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = 0
+        self._seen = set() # Digests stored during this run
+        self._deleted = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Written from the pipeline's writer thread, closed from the main thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+
+        existing = self.conn.execute("SELECT type FROM sqlite_master WHERE name = 'tiles'").fetchone()
+        if existing is not None and (existing[0] == "view") != dedup:
+            self.conn.close()
+            layout = "deduplicated (images + map)" if existing[0] == "view" else "plain tiles table"
+            raise ValueError(f"{path} already uses the {layout} layout; "
+                             f"{'drop' if dedup else 'add'} --dedup or choose another output")
+
+        self.conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)")
+        if dedup:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT)")
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS map "
+                "(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT)"
+            )
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row)"
+            )
+            self.conn.execute(
+                "CREATE VIEW IF NOT EXISTS tiles AS "
+                "SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, "
+                "map.tile_row AS tile_row, images.tile_data AS tile_data "
+                "FROM map JOIN images ON images.tile_id = map.tile_id"
+            )
+        else:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles "
+                "(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)"
+            )
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)"
+            )
+        self.conn.commit()
+
+    def write(self, z, x, y, data):
+        tms_y = (1 << z) - 1 - y
+        if self.dedup:
+            digest = tile_digest(data)
+            unique = digest not in self._seen
+            if unique:
+                self._seen.add(digest)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                    (sqlite3.Binary(data), digest),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                (z, x, tms_y, digest),
+            )
+        else:
+            unique = True
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                (z, x, tms_y, sqlite3.Binary(data)),
+            )
+        self._count(data, unique)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def delete(self, z, x, y):
+        tms_y = (1 << z) - 1 - y
+        table = "map" if self.dedup else "tiles"
+        self.conn.execute(
+            f"DELETE FROM {table} WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, tms_y),
+        )
+        self._deleted = True
+        self._pending += 1
+
+    def flush(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self, metadata):
+        west, south, east, north = metadata["bounds"]
+        rows = {
+            "name": metadata["name"],
+            "format": "pbf",
+            "type": "overlay",
+            "bounds": f"{west},{south},{east},{north}",
+            "center": f"{(west + east) / 2},{(south + north) / 2},{metadata['minzoom']}",
+            "minzoom": str(metadata["minzoom"]),
+            "maxzoom": str(metadata["maxzoom"]),
+            "compression": metadata["compression"],
+            "json": json.dumps({"vector_layers": metadata["vector_layers"]}),
+        }
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", rows.items()
+        )
+        if self.dedup and self._deleted:
+            # Drop payloads no tile refers to any more
+            self.conn.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+        self.flush()
+        self.conn.close()
+
+    def abort(self):
+        # Keep the tiles that were written; the archive is still readable.
+        self.flush()
+        self.conn.close()
+
+    def __str__(self):
+        return f"MBTiles archive {os.path.abspath(self.path)}"
+
+
+class PMTilesWriter(TileWriter):
+    """
+    Writes tiles into a single PMTiles v3 archive. Tiles are spooled to a side
+    file as they arrive (in any order); on close they are copied into the
+    archive sorted by Hilbert tile id, producing a clustered archive whose
+    directories are written ahead of the tile data.
+    With dedup, repeated payloads are spooled once and share one data offset;
+    runs of consecutive tile ids with the same payload collapse into one
+    directory entry (run_length > 1).
+    The archive is built in one pass, so it cannot be resumed or updated in place.
+    """
+
+    def __init__(self, path, dedup=False):
+        super().__init__(dedup)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.spool_path = path + ".spool"
+        self.spool = open(self.spool_path, "w+b")
+        self.entries = [] # (tile_id, spool_offset, length)
+        self._spooled = {} # digest -> spool_offset (dedup)
+
+    def write(self, z, x, y, data):
+        tile_id = zxy_to_tileid(z, x, y)
+        if self.dedup:
+            digest = tile_digest(data)
+            offset = self._spooled.get(digest)
+            if offset is not None:
+                self.entries.append((tile_id, offset, len(data)))
+                self._count(data, unique=False)
+                return
+            self._spooled[digest] = self.spool.tell()
+        offset = self.spool.tell()
+        self.spool.write(data)
+        self.entries.append((tile_id, offset, len(data)))
+        self._count(data, unique=True)
+
+    def flush(self):
+        self.spool.flush()
+
+    def close(self, metadata):
+        self.spool.flush()
+        self.entries.sort()
+
+        # Offsets in a clustered archive follow tile id order; a repeated payload
+        # points back at the offset of its first occurrence
+        directory_entries = []
+        final_offsets = {} # spool_offset -> archive data offset
+        copy_order = [] # (spool_offset, length) in archive order
+        data_length = 0
+        for tile_id, spool_offset, length in self.entries:
+            offset = final_offsets.get(spool_offset)
+            if offset is None:
+                offset = data_length
+                final_offsets[spool_offset] = offset
+                copy_order.append((spool_offset, length))
+                data_length += length
+            if directory_entries:
+                last_id, last_offset, last_length, last_run = directory_entries[-1]
+                if last_offset == offset and last_id + last_run == tile_id:
+                    directory_entries[-1] = (last_id, last_offset, last_length, last_run + 1)
+                    continue
+            directory_entries.append((tile_id, offset, length, 1))
+
+        root_bytes, leaves_bytes = build_directories(directory_entries)
+        metadata_bytes = gzip.compress(json.dumps({
+            "name": metadata["name"],
+            "format": "pbf",
+            "type": "overlay",
+            "vector_layers": metadata["vector_layers"],
+        }).encode("utf-8"))
+
+        root_offset = PMTILES_HEADER_LENGTH
+        metadata_offset = root_offset + len(root_bytes)
+        leaves_offset = metadata_offset + len(metadata_bytes)
+        data_offset = leaves_offset + len(leaves_bytes)
+
+        west, south, east, north = metadata["bounds"]
+        header = struct.pack(
+            PMTILES_HEADER_FORMAT,
+            b"PMTiles", 3,
+            root_offset, len(root_bytes),
+            metadata_offset, len(metadata_bytes),
+            leaves_offset, len(leaves_bytes),
+            data_offset, data_length,
+            len(self.entries), # addressed tiles
+            len(directory_entries), # tile entries
+            len(copy_order), # tile contents
+            1, # clustered
+            PMTILES_COMPRESSION_GZIP, # internal (directory/metadata) compression
+            PMTILES_TILE_COMPRESSION[metadata["compression"]], # tile compression
+            PMTILES_TILE_TYPE_MVT,
+            metadata["minzoom"], metadata["maxzoom"],
+            int(round(west * 1e7)), int(round(south * 1e7)),
+            int(round(east * 1e7)), int(round(north * 1e7)),
+            metadata["minzoom"],
+            int(round((west + east) / 2 * 1e7)), int(round((south + north) / 2 * 1e7)),
+        )
+
+        # Built aside and renamed into place: a server may have the previous
+        # archive mapped, and must never see a truncated or half-written one
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "wb") as out:
+                out.write(header)
+                out.write(root_bytes)
+                out.write(metadata_bytes)
+                out.write(leaves_bytes)
+                for spool_offset, length in copy_order:
+                    self.spool.seek(spool_offset)
+                    out.write(self.spool.read(length))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._remove_spool()
+
+    def abort(self):
+        # A PMTiles archive cannot be finished without its directories.
+        self._remove_spool()
+
+    def _remove_spool(self):
+        self.spool.close()
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+    def __str__(self):
+        return f"PMTiles archive {os.path.abspath(self.path)}"
+
+
+def open_tile_writer(output_spec, default_dir, dedup=False):
+    """
+    Opens the writer for an --output value: "dir:<path>", "mbtiles:<path>" or
+    "pmtiles:<path>". Without a value, tiles go to the default_dir tree.
+    """
+    if not output_spec:
+        return DirectoryWriter(default_dir, dedup=dedup)
+    kind, sep, path = output_spec.partition(":")
+    if not sep or not path:
+        raise ValueError(f"Invalid --output '{output_spec}', expected <dir|mbtiles|pmtiles>:<path>")
+    if kind == "dir":
+        return DirectoryWriter(path, dedup=dedup)
+    if kind == "mbtiles":
+        return MBTilesWriter(path, dedup=dedup)
+    if kind == "pmtiles":
+        return PMTilesWriter(path, dedup=dedup)
+    raise ValueError(f"Unknown output type '{kind}', expected dir, mbtiles or pmtiles")